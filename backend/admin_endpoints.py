@@ -2,17 +2,56 @@
 Admin endpoints - Gerenciamento de usuários
 """
 from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import Optional
+from datetime import datetime
+import os
+import json
+import base64
 import logging
+from cache_utils import TTLCache
 from security_utils import get_authenticated_user, require_role
-from supabase_service import get_supabase_service
+from supabase_service import get_supabase_service, SupabaseService
 from audit_service import get_audit_service
+from maintenance_scheduler import get_maintenance_scheduler
+from diagnostics import get_event_loop_watchdog, capture_profile
+from company_context import get_company_context_cache
+from waha_session import get_waha_session_cache
+from realtime_listener import get_realtime_listener
+from orphan_reconciler import get_orphan_reconciler
+from user_deletion import get_user_deletion_service
 
 logger = logging.getLogger(__name__)
 
 admin_router = APIRouter(prefix="/api/admin", tags=["admin"])
 
+# Total de usuários por combinação de filtros (plano/status mudam em poucos pontos)
+_users_total_cache = TTLCache(
+    maxsize=256,
+    ttl=float(os.getenv('ADMIN_USERS_COUNT_CACHE_TTL', '60')),
+    name="admin_users_total"
+)
+
+
+def invalidate_users_total() -> None:
+    """Chamado quando usuários são criados/removidos ou mudam de plano"""
+    _users_total_cache.clear()
+
+
+def _encode_users_cursor(row: dict) -> str:
+    raw = json.dumps([row.get('sort_key'), row['id']], default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode_users_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_key, user_id = json.loads(base64.urlsafe_b64decode(padded))
+        return sort_key, user_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
 
 class DeleteUserRequest(BaseModel):
     user_id: str
@@ -80,6 +119,8 @@ async def suspend_user_account(
             'messages_limit': 0,
             'updated_at': datetime.now().isoformat()
         }, on_conflict='user_id').execute()
+        db.invalidate_user_quota(user_id)
+        invalidate_users_total()
         
         # Log de auditoria
         await audit.log_action(
@@ -173,6 +214,9 @@ async def activate_user_account(
             'plan_expires_at': expires_at,
             'updated_at': datetime.now().isoformat()
         }, on_conflict='user_id').execute()
+        # Uso foi zerado: incrementos pendentes não devem ser gravados por cima
+        db.invalidate_user_quota(user_id, discard_pending=True)
+        invalidate_users_total()
         
         # Log de auditoria
         await audit.log_action(
@@ -212,65 +256,193 @@ async def activate_user_account(
 async def list_all_users(
     auth_user: dict = Depends(require_role("super_admin")),
     limit: int = 50,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    sort: str = "created_at",
+    order: str = "desc",
+    plan_type: Optional[str] = None,
+    status: Optional[str] = None,
+    expires_before: Optional[datetime] = None,
+    expires_after: Optional[datetime] = None,
+    search: Optional[str] = None
 ):
     """
     Lista todos os usuários com seus planos e status
     
+    Uma única consulta (RPC admin_list_users): filtros por plano, status e
+    expiração, ordenação e paginação por cursor (next_cursor). O total é
+    cacheado por combinação de filtros.
+    
     IMPORTANTE: Requer role super_admin
     """
+    if sort not in SupabaseService.ADMIN_USER_SORTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Ordenação inválida: {sort} (use {', '.join(SupabaseService.ADMIN_USER_SORTS)})"
+        )
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order deve ser 'asc' ou 'desc'")
+    limit = max(1, min(limit, 200))
+
     try:
         db = get_supabase_service()
-        
-        # Buscar profiles com quotas (LEFT JOIN simulado)
-        profiles_result = db.client.table('profiles')\
-            .select('id, email, full_name, company_id, created_at')\
-            .order('created_at', desc=True)\
-            .range(offset, offset + limit - 1)\
-            .execute()
-        
-        users = []
-        for profile in (profiles_result.data or []):
-            user_id = profile['id']
-            
-            # Buscar quota do usuário
-            quota_result = db.client.table('user_quotas')\
-                .select('plan_type, plan_name, subscription_status, plan_expires_at')\
-                .eq('user_id', user_id)\
-                .maybe_single()\
-                .execute()
-            
-            quota = quota_result.data if quota_result.data else {}
-            
-            users.append({
-                'id': user_id,
-                'email': profile['email'],
-                'full_name': profile.get('full_name'),
-                'company_id': profile.get('company_id'),
-                'plan_type': quota.get('plan_type', 'sem_plano'),
-                'plan_name': quota.get('plan_name', 'Sem Plano'),
-                'status': quota.get('subscription_status', 'inactive'),
-                'expires_at': quota.get('plan_expires_at'),
-                'created_at': profile['created_at']
-            })
-        
-        # Contar total
-        count_result = db.client.table('profiles')\
-            .select('id', count='exact')\
-            .execute()
+        filters = (plan_type, status, expires_before, expires_after, search)
+        total = _users_total_cache.get(filters)
+
+        page = await db.list_users_admin(
+            limit=limit,
+            sort=sort,
+            descending=order == "desc",
+            plan_type=plan_type,
+            status=status,
+            expires_before=expires_before,
+            expires_after=expires_after,
+            search=search,
+            cursor=_decode_users_cursor(cursor) if cursor else None,
+            offset=offset,
+            include_total=total is None
+        )
+        rows = page.get('users') or []
+        # O fallback sem RPC filtra em memória e informa de onde continuar
+        if 'next' in page:
+            next_row = {'sort_key': page['next'][0], 'id': page['next'][1]} if page['next'] else None
+        else:
+            next_row = rows[-1] if len(rows) == limit else None
+        if total is None and page.get('total') is not None:
+            total = page['total']
+            _users_total_cache.set(filters, total)
+
+        users = [{
+            'id': row['id'],
+            'email': row['email'],
+            'full_name': row.get('full_name'),
+            'company_id': row.get('company_id'),
+            'plan_type': row.get('plan_type') or 'sem_plano',
+            'plan_name': row.get('plan_name') or 'Sem Plano',
+            'status': row.get('subscription_status') or 'inactive',
+            'expires_at': row.get('plan_expires_at'),
+            'created_at': row['created_at']
+        } for row in rows]
         
         return {
             'users': users,
-            'total': count_result.count or len(users),
+            'total': total if total is not None else len(users),
             'limit': limit,
-            'offset': offset
+            'offset': offset,
+            'sort': sort,
+            'order': order,
+            'next_cursor': _encode_users_cursor(next_row) if next_row else None
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro ao listar usuários: {e}")
         raise HTTPException(status_code=500, detail=f"Erro ao listar: {str(e)}")
 
 
+async def _start_orphan_job(request: Request, auth_user: dict, dry_run: bool) -> dict:
+    try:
+        job = await get_orphan_reconciler().start(dry_run=dry_run, requested_by=auth_user)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if not dry_run:
+        await get_audit_service().log_action(
+            user_id=auth_user['user_id'],
+            user_email=auth_user['email'],
+            action='orphan_cleanup_started',
+            target_type='system',
+            details={'job_id': job['id']},
+            ip_address=request.client.host if request.client else None,
+            user_agent=request.headers.get('user-agent')
+        )
+    logger.info(f"Admin {auth_user['email']} iniciou reconciliação de órfãos {job['id']} (dry_run={dry_run})")
+    return {
+        'success': True,
+        'job': job,
+        'status_url': f"/api/admin/orphan-users/jobs/{job['id']}"
+    }
+
+
+@admin_router.post("/orphan-users/jobs", status_code=202)
+async def start_orphan_reconcile(
+    request: Request,
+    dry_run: bool = True,
+    auth_user: dict = Depends(require_role("super_admin"))
+):
+    """
+    Inicia a reconciliação de usuários órfãos (existem em auth.users mas não em profiles)
+    em background. dry_run=true apenas lista; dry_run=false remove do Auth.
+
+    IMPORTANTE: Requer role super_admin
+    """
+    return await _start_orphan_job(request, auth_user, dry_run)
+
+
+@admin_router.get("/orphan-users/jobs")
+async def list_orphan_reconcile_jobs(
+    limit: int = 20,
+    auth_user: dict = Depends(require_role("super_admin"))
+):
+    """
+    Jobs de reconciliação de órfãos mais recentes (com progresso)
+
+    IMPORTANTE: Requer role super_admin
+    """
+    return {'jobs': await get_orphan_reconciler().list_jobs(max(1, min(limit, 100)))}
+
+
+@admin_router.get("/orphan-users/jobs/{job_id}")
+async def get_orphan_reconcile_job(
+    job_id: str,
+    auth_user: dict = Depends(require_role("super_admin"))
+):
+    """
+    Progresso e resultado de um job de reconciliação de órfãos
+
+    IMPORTANTE: Requer role super_admin
+    """
+    job = await get_orphan_reconciler().get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
+
+@admin_router.post("/orphan-users/jobs/{job_id}/resume", status_code=202)
+async def resume_orphan_reconcile_job(
+    job_id: str,
+    auth_user: dict = Depends(require_role("super_admin"))
+):
+    """
+    Retoma um job cancelado ou interrompido a partir da última página concluída
+
+    IMPORTANTE: Requer role super_admin
+    """
+    try:
+        return await get_orphan_reconciler().resume(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@admin_router.post("/orphan-users/jobs/{job_id}/cancel")
+async def cancel_orphan_reconcile_job(
+    job_id: str,
+    auth_user: dict = Depends(require_role("super_admin"))
+):
+    """
+    Cancela o job em execução (ao fim da página atual; pode ser retomado)
+
+    IMPORTANTE: Requer role super_admin
+    """
+    try:
+        return get_orphan_reconciler().cancel(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job não está em execução")
 
 
 @admin_router.get("/orphan-users")
@@ -278,114 +450,42 @@ async def get_orphan_users(
     auth_user: dict = Depends(require_role("super_admin"))
 ):
     """
-    Lista usuários órfãos (existem em auth.users mas não em profiles)
-    
+    Último relatório de usuários órfãos (job de listagem mais recente, somente leitura).
+    Para gerar um novo: POST /orphan-users/jobs?dry_run=true
+
     IMPORTANTE: Requer role super_admin
     """
-    try:
-        db = get_supabase_service()
-        
-        # Buscar todos os usuários do Auth
-        auth_response = db.client.auth.admin.list_users()
-        auth_users = auth_response if isinstance(auth_response, list) else []
-        
-        # Buscar todos os IDs de profiles
-        profiles_result = db.client.table('profiles').select('id').execute()
-        profile_ids = set([p['id'] for p in profiles_result.data]) if profiles_result.data else set()
-        
-        # Encontrar órfãos
-        orphans = []
-        for user in auth_users:
-            user_id = user.id if hasattr(user, 'id') else user.get('id')
-            email = user.email if hasattr(user, 'email') else user.get('email')
-            created_at = user.created_at if hasattr(user, 'created_at') else user.get('created_at')
-            
-            if user_id not in profile_ids:
-                orphans.append({
-                    'id': user_id,
-                    'email': email,
-                    'created_at': created_at
-                })
-        
-        logger.info(f"Admin {auth_user['email']} listou {len(orphans)} usuários órfãos")
-        
+    jobs = await get_orphan_reconciler().list_jobs(20)
+    job = next((j for j in jobs if (j.get('params') or {}).get('dry_run', True)), None)
+    if job is None:
         return {
-            'total_auth_users': len(auth_users),
-            'total_profiles': len(profile_ids),
-            'orphans_found': len(orphans),
-            'orphans': orphans
+            'job': None,
+            'orphans_found': 0,
+            'orphans': [],
+            'start_url': "/api/admin/orphan-users/jobs?dry_run=true"
         }
-        
-    except Exception as e:
-        logger.error(f"Erro ao listar usuários órfãos: {e}")
-        raise HTTPException(status_code=500, detail=f"Erro ao listar órfãos: {str(e)}")
+    return {
+        'job': job,
+        'orphans_found': (job.get('progress') or {}).get('orphans_found', 0),
+        'orphans': (job.get('result') or {}).get('orphans', []),
+        'status_url': f"/api/admin/orphan-users/jobs/{job['id']}",
+        'start_url': "/api/admin/orphan-users/jobs?dry_run=true"
+    }
 
 
-@admin_router.delete("/orphan-users")
+@admin_router.delete("/orphan-users", status_code=202)
 async def cleanup_orphan_users(
+    request: Request,
     auth_user: dict = Depends(require_role("super_admin"))
 ):
     """
     Remove todos os usuários órfãos (existem em auth.users mas não em profiles)
-    
+    em background; acompanhe o progresso em status_url
+
     ATENÇÃO: Ação irreversível!
     IMPORTANTE: Requer role super_admin
     """
-    try:
-        db = get_supabase_service()
-        
-        # Buscar órfãos (mesmo código do endpoint GET)
-        auth_response = db.client.auth.admin.list_users()
-        auth_users = auth_response if isinstance(auth_response, list) else []
-        
-        profiles_result = db.client.table('profiles').select('id').execute()
-        profile_ids = set([p['id'] for p in profiles_result.data]) if profiles_result.data else set()
-        
-        orphans = []
-        for user in auth_users:
-            user_id = user.id if hasattr(user, 'id') else user.get('id')
-            email = user.email if hasattr(user, 'email') else user.get('email')
-            
-            if user_id not in profile_ids:
-                orphans.append({'id': user_id, 'email': email})
-        
-        if not orphans:
-            return {
-                'success': True,
-                'message': 'Nenhum usuário órfão encontrado',
-                'orphans_deleted': 0,
-                'orphan_emails': []
-            }
-        
-        # Deletar órfãos
-        deleted_count = 0
-        deleted_emails = []
-        failed = []
-        
-        for orphan in orphans:
-            try:
-                db.client.auth.admin.delete_user(orphan['id'])
-                deleted_count += 1
-                deleted_emails.append(orphan['email'])
-                logger.info(f"✅ Órfão deletado: {orphan['email']} (ID: {orphan['id']})")
-            except Exception as e:
-                failed.append({'email': orphan['email'], 'error': str(e)})
-                logger.error(f"❌ Erro ao deletar órfão {orphan['email']}: {e}")
-        
-        logger.warning(f"Admin {auth_user['email']} deletou {deleted_count} usuários órfãos")
-        
-        return {
-            'success': True,
-            'message': f'{deleted_count} usuário(s) órfão(s) deletado(s)',
-            'orphans_found': len(orphans),
-            'orphans_deleted': deleted_count,
-            'orphan_emails': deleted_emails,
-            'failed': failed if failed else None
-        }
-        
-    except Exception as e:
-        logger.error(f"Erro ao limpar usuários órfãos: {e}")
-        raise HTTPException(status_code=500, detail=f"Erro na limpeza: {str(e)}")
+    return await _start_orphan_job(request, auth_user, dry_run=False)
 
 
 class UpdateQuotaRequest(BaseModel):
@@ -489,6 +589,8 @@ async def update_user_quota(
         result = db.client.table('user_quotas')\
             .upsert(quota_dict, on_conflict='user_id')\
             .execute()
+        db.invalidate_user_quota(user_id)
+        invalidate_users_total()
         
         # LOG DE AUDITORIA
         await audit.log_action(
@@ -528,15 +630,17 @@ async def update_user_quota(
 async def delete_user_completely(
     request: Request,
     user_id: str,
+    background: Optional[bool] = None,
     auth_user: dict = Depends(require_role("super_admin"))
 ):
     """
     Deleta completamente um usuário do sistema
+    - Remove campanhas (com contatos e logs), leads, histórico de busca,
+      notificações, user_roles, user_quotas e profile em uma transação
     - Remove de auth.users (Supabase Auth)
-    - Remove de profiles
-    - Remove de user_roles
-    - Remove de user_quotas
-    - Remove todas as dependências
+    
+    Contas grandes (ou background=true) são removidas por um job em background:
+    a resposta é 202 com o job e status_url para acompanhar o progresso.
     
     IMPORTANTE: Requer role super_admin
     """
@@ -549,7 +653,7 @@ async def delete_user_completely(
             )
         
         db = get_supabase_service()
-        audit = get_audit_service()
+        deletion = get_user_deletion_service()
         
         # 1. Buscar dados do usuário antes de deletar (com maybe_single para evitar erro se não existir)
         user_profile = db.client.table('profiles')\
@@ -559,7 +663,7 @@ async def delete_user_completely(
             .execute()
         
         # Se profile não existe, verificar se usuário existe no auth
-        if not user_profile.data:
+        if not user_profile or not user_profile.data:
             # Tentar buscar direto no auth
             try:
                 auth_user_data = db.client.auth.admin.get_user_by_id(user_id)
@@ -576,106 +680,45 @@ async def delete_user_completely(
         
         logger.info(f"Admin {auth_user['email']} iniciando deleção de usuário {user_email} (ID: {user_id})")
         
-        # 2. Deletar user_quotas
-        try:
-            db.client.table('user_quotas').delete().eq('user_id', user_id).execute()
-            logger.info(f"✅ user_quotas deletado para {user_id}")
-        except Exception as e:
-            logger.warning(f"Erro ao deletar user_quotas: {e}")
-        
-        # 3. Deletar user_roles
-        try:
-            db.client.table('user_roles').delete().eq('user_id', user_id).execute()
-            logger.info(f"✅ user_roles deletado para {user_id}")
-        except Exception as e:
-            logger.warning(f"Erro ao deletar user_roles: {e}")
-        
-        # 4. Deletar campanhas do usuário (se houver)
-        try:
-            campaigns = db.client.table('campaigns')\
-                .select('id')\
-                .eq('user_id', user_id)\
-                .execute()
-            
-            if campaigns.data:
-                for campaign in campaigns.data:
-                    # Deletar contatos e logs da campanha
-                    db.client.table('campaign_contacts')\
-                        .delete()\
-                        .eq('campaign_id', campaign['id'])\
-                        .execute()
-                    db.client.table('message_logs')\
-                        .delete()\
-                        .eq('campaign_id', campaign['id'])\
-                        .execute()
-                
-                # Deletar campanhas
-                db.client.table('campaigns').delete().eq('user_id', user_id).execute()
-                logger.info(f"✅ Campanhas deletadas para {user_id}")
-        except Exception as e:
-            logger.warning(f"Erro ao deletar campanhas: {e}")
-        
-        # 5. Deletar leads do usuário
-        try:
-            db.client.table('leads').delete().eq('user_id', user_id).execute()
-            logger.info(f"✅ Leads deletados para {user_id}")
-        except Exception as e:
-            logger.warning(f"Erro ao deletar leads: {e}")
-        
-        # 6. Deletar histórico de busca
-        try:
-            db.client.table('search_history').delete().eq('user_id', user_id).execute()
-            logger.info(f"✅ Histórico de busca deletado para {user_id}")
-        except Exception as e:
-            logger.warning(f"Erro ao deletar search_history: {e}")
-        
-        # 7. Deletar notificações
-        try:
-            db.client.table('notifications').delete().eq('user_id', user_id).execute()
-            logger.info(f"✅ Notificações deletadas para {user_id}")
-        except Exception as e:
-            logger.warning(f"Erro ao deletar notificações: {e}")
-        
-        # 8. Deletar profile
-        db.client.table('profiles').delete().eq('id', user_id).execute()
-        logger.info(f"✅ Profile deletado para {user_id}")
-        
-        # 9. CRÍTICO: Deletar da tabela auth.users usando admin API
-        try:
-            # Usar service_role para deletar usuário do Auth
-            response = db.client.auth.admin.delete_user(user_id)
-            logger.info(f"✅ Usuário deletado do Supabase Auth: {user_id}")
-        except Exception as e:
-            error_msg = str(e)
-            # Se o usuário não foi encontrado ou já foi deletado, considerar sucesso
-            if "not found" in error_msg.lower() or "user not allowed" in error_msg.lower():
-                logger.warning(f"⚠️ Usuário já removido do auth ou sem permissão: {user_id}")
-            else:
-                logger.error(f"❌ ERRO ao deletar do auth.users: {e}")
-                # Não levantar exceção, pois já deletamos do banco
+        context = {
+            'company_id': company_id,
+            'ip_address': request.client.host if request.client else None,
+            'user_agent': request.headers.get('user-agent')
+        }
         
-        # LOG DE AUDITORIA
-        await audit.log_action(
-            user_id=auth_user['user_id'],
-            user_email=auth_user['email'],
-            action='user_deleted',
-            target_type='user',
-            target_id=user_id,
-            target_email=user_email,
-            details={
-                'company_id': company_id
-            },
-            ip_address=request.client.host if request.client else None,
-            user_agent=request.headers.get('user-agent')
-        )
+        # 2. Contas grandes vão para background (lotes de campanhas com progresso)
+        estimate = await deletion.estimate(user_id)
+        if background is None:
+            background = estimate['estimated_rows'] > deletion.background_threshold
+        
+        if background:
+            try:
+                job = deletion.start(
+                    user_id, user_email, auth_user, estimate['campaigns'],
+                    context=context, on_deleted=invalidate_users_total
+                )
+            except RuntimeError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            return JSONResponse(status_code=202, content={
+                "success": True,
+                "message": f"Deleção de {user_email} iniciada em background",
+                "user_id": user_id,
+                "email": user_email,
+                "job": job,
+                "status_url": f"/api/admin/user-deletions/{job['id']}"
+            })
         
-        logger.info(f"✅ DELEÇÃO COMPLETA: Usuário {user_email} (ID: {user_id}) totalmente removido")
+        # 3. Conta pequena: uma transação + Auth
+        deleted = await deletion.delete_user(
+            user_id, user_email, auth_user, context=context, on_deleted=invalidate_users_total
+        )
         
         return {
             "success": True,
             "message": f"Usuário {user_email} deletado completamente do sistema",
             "user_id": user_id,
-            "email": user_email
+            "email": user_email,
+            "deleted": deleted
         }
         
     except HTTPException:
@@ -686,3 +729,130 @@ async def delete_user_completely(
             status_code=500,
             detail=f"Erro ao deletar usuário: {str(e)}"
         )
+
+
+@admin_router.get("/user-deletions")
+async def list_user_deletions(
+    limit: int = 20,
+    auth_user: dict = Depends(require_role("super_admin"))
+):
+    """
+    Jobs de deleção de usuários em background mais recentes
+    
+    IMPORTANTE: Requer role super_admin
+    """
+    return {'jobs': await get_user_deletion_service().list_jobs(max(1, min(limit, 100)))}
+
+
+@admin_router.get("/user-deletions/{job_id}")
+async def get_user_deletion(
+    job_id: str,
+    auth_user: dict = Depends(require_role("super_admin"))
+):
+    """
+    Progresso de uma deleção de usuário em background
+    
+    IMPORTANTE: Requer role super_admin
+    """
+    job = await get_user_deletion_service().get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
+
+@admin_router.get("/maintenance/jobs")
+async def list_maintenance_jobs(
+    auth_user: dict = Depends(require_role("super_admin"))
+):
+    """
+    Métricas dos jobs de retenção/compactação de logs
+    
+    IMPORTANTE: Requer role super_admin
+    """
+    return get_maintenance_scheduler().stats()
+
+
+@admin_router.post("/maintenance/jobs/{job_name}/run")
+async def run_maintenance_job(
+    job_name: str,
+    auth_user: dict = Depends(require_role("super_admin"))
+):
+    """
+    Executa um job de manutenção imediatamente
+    
+    IMPORTANTE: Requer role super_admin
+    """
+    try:
+        return await get_maintenance_scheduler().run_job(job_name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Job {job_name} não encontrado")
+
+
+@admin_router.get("/diagnostics/event-loop")
+async def event_loop_diagnostics(
+    recent: int = 10,
+    auth_user: dict = Depends(require_role("super_admin"))
+):
+    """
+    Bloqueios do event loop detectados pelo watchdog (por call site + stacks recentes)
+    
+    IMPORTANTE: Requer role super_admin
+    """
+    return get_event_loop_watchdog().stats(recent=max(0, min(recent, 50)))
+
+
+@admin_router.get("/diagnostics/caches")
+async def cache_diagnostics(
+    auth_user: dict = Depends(require_role("super_admin"))
+):
+    """
+    Tamanho e taxa de acerto dos caches de empresa (contexto, sessão WAHA) e do Realtime
+    
+    IMPORTANTE: Requer role super_admin
+    """
+    return {
+        "company_context": get_company_context_cache().stats(),
+        "waha_sessions": get_waha_session_cache().stats(),
+        "realtime": get_realtime_listener().stats()
+    }
+
+
+@admin_router.post("/diagnostics/profile")
+async def capture_process_profile(
+    request: Request,
+    seconds: float = 10,
+    mode: str = "sampling",
+    interval_ms: float = 5,
+    all_threads: bool = False,
+    auth_user: dict = Depends(require_role("super_admin"))
+):
+    """
+    Captura um perfil do processo por alguns segundos.
+    sampling: stacks no formato collapsed (speedscope/flamegraph); cprofile: pstats
+    
+    IMPORTANTE: Requer role super_admin
+    """
+    try:
+        output = await capture_profile(
+            seconds=seconds,
+            mode=mode,
+            interval=interval_ms / 1000,
+            all_threads=all_threads
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    await get_audit_service().log_action(
+        user_id=auth_user['user_id'],
+        user_email=auth_user['email'],
+        action='process_profiled',
+        target_type='system',
+        details={'mode': mode, 'seconds': seconds},
+        ip_address=request.client.host if request.client else None,
+        user_agent=request.headers.get('user-agent')
+    )
+
+    filename = f"profile-{mode}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.txt"
+    return PlainTextResponse(output, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
@@ -1,96 +1,462 @@
+"""
+Agent Service
+Encaminha mensagens recebidas pelo WhatsApp (webhook do WAHA) para o agente de IA no n8n
+
+- O webhook só filtra e enfileira; workers fazem o resto fora da requisição
+- Sessão -> empresa por um índice em memória carregado em lote de company_settings
+  e waha_configs (recarregado por TTL, por invalidação ou, com intervalo mínimo,
+  quando chega uma sessão desconhecida)
+- agent_configs vem do cache do SupabaseService
+- Um único httpx.AsyncClient com pool de conexões para o n8n
+- Mensagens em sequência do mesmo contato são agrupadas: o envio espera
+  agent_config.response_delay segundos sem mensagem nova e vai uma vez só para o n8n;
+  o grupo pronto volta para a fila, então toda chamada ao n8n passa pelos AGENT_WORKERS
+"""
 import os
-import httpx
+import time
+import asyncio
 import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import httpx
+
 from supabase_service import get_supabase_service
+from metrics import AGENT_MESSAGES, AGENT_QUEUE_DEPTH
 
 logger = logging.getLogger(__name__)
 
-async def process_waha_message_for_n8n(payload: dict):
+_PAGE_SIZE = 1000
+
+
+def _valid_session(name: Optional[str]) -> bool:
+    # "default" significa sessão não configurada (mesma regra de get_waha_config)
+    return bool(name) and name.lower() != 'default'
+
+
+class SessionCompanyIndex:
+    """Índice sessão WAHA -> company_id"""
+
+    def __init__(self):
+        self.ttl = float(os.getenv('WAHA_SESSION_INDEX_TTL', '300'))
+        # Sessão desconhecida recarrega o índice no máximo uma vez por intervalo
+        self.miss_reload_interval = float(os.getenv('WAHA_SESSION_INDEX_MISS_RELOAD', '30'))
+        self._index: Dict[str, str] = {}
+        # Sessões conhecidas pelo backend sem linha no banco (nome gerado a partir da empresa)
+        self._remembered: Dict[str, str] = {}
+        self._loaded_at = 0.0
+        self._loading: Optional[asyncio.Future] = None
+        self.reloads = 0
+
+    async def resolve(self, session_name: str) -> Optional[str]:
+        age = time.monotonic() - self._loaded_at
+        if age > self.ttl:
+            await self.reload()
+        company_id = self._index.get(session_name) or self._remembered.get(session_name)
+        if company_id is None and time.monotonic() - self._loaded_at > self.miss_reload_interval:
+            await self.reload()
+            company_id = self._index.get(session_name) or self._remembered.get(session_name)
+        return company_id
+
+    async def reload(self) -> None:
+        """Recarrega o índice; chamadas concorrentes esperam a mesma carga"""
+        if self._loading is not None:
+            await asyncio.shield(self._loading)
+            return
+        self._loading = asyncio.get_running_loop().create_future()
+        try:
+            self._index = await asyncio.to_thread(self._load)
+            self._loaded_at = time.monotonic()
+            self.reloads += 1
+        except Exception as e:
+            # Mantém o índice anterior; nova tentativa após miss_reload_interval
+            self._loaded_at = time.monotonic() - self.ttl + self.miss_reload_interval
+            logger.warning(f"⚠️ Não foi possível carregar o índice de sessões WAHA: {e}")
+        finally:
+            self._loading.set_result(None)
+            self._loading = None
+
+    def _load(self) -> Dict[str, str]:
+        db = get_supabase_service()
+        index: Dict[str, str] = {}
+        # waha_configs (legado) primeiro: company_settings tem precedência
+        try:
+            for row in self._fetch_all(db, 'waha_configs', 'company_id, session_name', 'session_name'):
+                if _valid_session(row.get('session_name')):
+                    index[row['session_name']] = row['company_id']
+        except Exception:
+            # Tabela legada pode não existir
+            pass
+        for row in self._fetch_all(db, 'company_settings', 'company_id, waha_session', 'waha_session'):
+            if _valid_session(row.get('waha_session')):
+                index[row['waha_session']] = row['company_id']
+        return index
+
+    @staticmethod
+    def _fetch_all(db, table: str, columns: str, session_column: str) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            result = db.client.table(table)\
+                .select(columns)\
+                .not_.is_(session_column, 'null')\
+                .order('company_id')\
+                .range(offset, offset + _PAGE_SIZE - 1)\
+                .execute()
+            page = result.data or []
+            rows.extend(page)
+            if len(page) < _PAGE_SIZE:
+                return rows
+            offset += _PAGE_SIZE
+
+    def remember(self, session_name: str, company_id: str) -> None:
+        """Registra uma sessão resolvida pelo backend (ex.: nome gerado em get_session_name_for_company)"""
+        if self._remembered.get(session_name) != company_id:
+            self._remembered[session_name] = company_id
+
+    def invalidate(self) -> None:
+        """Força recarga na próxima mensagem (configuração de sessão mudou)"""
+        self._loaded_at = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._index),
+            "remembered": len(self._remembered),
+            "reloads": self.reloads,
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None
+        }
+
+
+class ConversationBurst:
+    """Mensagens de um contato aguardando envio conjunto"""
+    __slots__ = ('session_name', 'sender', 'company_id', 'agent_config', 'contact_name', 'messages', 'started_at', 'timer')
+
+    def __init__(self, session_name: str, sender: str, company_id: str, agent_config: Dict[str, Any], started_at: float):
+        self.session_name = session_name
+        self.sender = sender
+        self.company_id = company_id
+        self.agent_config = agent_config
+        self.contact_name = 'Cliente'
+        self.messages: List[str] = []
+        self.started_at = started_at
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class ConversationCoalescer:
     """
-    Processa webhook do WAHA, valida se a empresa tem o agente ativo
-    e encaminha para o n8n gerar a resposta.
+    Agrupa mensagens por (sessão, contato) com debounce de response_delay segundos.
+
+    Só conversas com mensagens pendentes ocupam memória: a entrada sai no envio.
+    O número de conversas e de mensagens por conversa é limitado; ao atingir o
+    limite o grupo é entregue na hora (nada é descartado). `flush` só entrega o
+    grupo (ex.: para a fila dos workers), sem I/O.
     """
-    try:
-        # 1. Obter URL do Webhook do ambiente
-        n8n_url = os.getenv("N8N_WEBHOOK_URL")
-        if not n8n_url:
-            logger.error("❌ N8N_WEBHOOK_URL não configurada no .env")
+
+    def __init__(self, flush: Callable[[ConversationBurst], None]):
+        self._flush = flush
+        self.max_conversations = int(os.getenv('AGENT_COALESCE_MAX_CONVERSATIONS', '10000'))
+        self.max_messages = int(os.getenv('AGENT_COALESCE_MAX_MESSAGES', '20'))
+        # Teto de espera desde a primeira mensagem (contato que não para de digitar)
+        self.max_wait = float(os.getenv('AGENT_COALESCE_MAX_WAIT', '30'))
+        self._bursts: "OrderedDict[Tuple[str, str], ConversationBurst]" = OrderedDict()
+        self.coalesced = 0
+        self.evicted = 0
+
+    def add(
+        self,
+        session_name: str,
+        sender: str,
+        company_id: str,
+        agent_config: Dict[str, Any],
+        body: str,
+        contact_name: Optional[str],
+        delay: float
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        key = (session_name, sender)
+        burst = self._bursts.get(key)
+        if burst is None:
+            if len(self._bursts) >= self.max_conversations:
+                # Sem espaço: envia o grupo mais antigo antes do prazo
+                self.evicted += 1
+                self._flush_now(next(iter(self._bursts)))
+            burst = ConversationBurst(session_name, sender, company_id, agent_config, loop.time())
+            self._bursts[key] = burst
+        else:
+            self.coalesced += 1
+            AGENT_MESSAGES.labels("coalesced").inc()
+            burst.agent_config = agent_config
+
+        burst.messages.append(body)
+        if contact_name:
+            burst.contact_name = contact_name
+        if len(burst.messages) >= self.max_messages:
+            self._flush_now(key)
             return
 
-        # 2. Extrair dados básicos
-        event = payload.get("event")
-        if event != "message": return
-        
-        msg_payload = payload.get("payload", {})
-        
-        # Ignorar mensagens enviadas por mim ou grupos
-        # O filtro @g.us remove grupos
-        if msg_payload.get("fromMe") or "@g.us" in msg_payload.get("from", ""):
+        if burst.timer is not None:
+            burst.timer.cancel()
+        wait = min(delay, burst.started_at + self.max_wait - loop.time())
+        burst.timer = loop.call_later(max(0.0, wait), self._flush_now, key)
+
+    def _flush_now(self, key: Tuple[str, str]) -> None:
+        burst = self._bursts.pop(key, None)
+        if burst is None:
             return
-        
-        session_name = payload.get("session")
-        sender = msg_payload.get("from")
-        body = msg_payload.get("body")
-        
-        if not body or not sender: return
+        if burst.timer is not None:
+            burst.timer.cancel()
+        try:
+            self._flush(burst)
+        except Exception as e:
+            logger.error(f"❌ Erro ao entregar mensagens agrupadas de {burst.sender}: {e}")
 
-        db = get_supabase_service()
+    def drain(self) -> None:
+        """Entrega tudo que está pendente sem esperar o debounce (shutdown)"""
+        for key in list(self._bursts):
+            self._flush_now(key)
 
-        # 3. Identificar a Empresa pela Sessão
-        company_id = None
-        
-        # Tenta buscar pelo company_settings (padrão novo)
-        settings_res = db.client.table("company_settings")\
-            .select("company_id")\
-            .eq("waha_session", session_name)\
-            .maybe_single().execute()
-            
-        if settings_res.data:
-            company_id = settings_res.data["company_id"]
-        
-        # Fallback para waha_configs (legado)
-        if not company_id:
-            waha_res = db.client.table("waha_configs")\
-                .select("company_id")\
-                .eq("session_name", session_name)\
-                .maybe_single().execute()
-            if waha_res.data:
-                company_id = waha_res.data["company_id"]
-
-        if not company_id:
-            #logger.warning(f"⚠️ Agente: Empresa não encontrada para sessão {session_name}")
-            return 
-
-        # 4. Buscar Configuração do Agente
-        agent_config = await db.get_agent_config(company_id)
-        
-        # Verifica se está habilitado
-        if not agent_config or not agent_config.get("enabled"):
-            return 
-
-        # 5. Enviar payload para o n8n
-        n8n_payload = {
-            "message": body,
-            "sender": sender,
-            "session_name": session_name,
-            "company_id": company_id,
-            "contact_name": msg_payload.get("_data", {}).get("notifyName", "Cliente"),
-            "agent_config": {
-                "name": agent_config.get("name", "Assistente"),
-                "personality": agent_config.get("personality", ""),
-                "system_prompt": agent_config.get("system_prompt", ""),
-                "response_delay": agent_config.get("response_delay", 3),
-                "full_config": agent_config 
-            }
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_conversations": len(self._bursts),
+            "pending_messages": sum(len(burst.messages) for burst in self._bursts.values()),
+            "coalesced": self.coalesced,
+            "evicted": self.evicted
         }
 
-        # Disparo assíncrono (Fire & Forget)
-        async with httpx.AsyncClient() as client:
+
+class AgentService:
+    """Fila + workers que encaminham mensagens recebidas para o n8n"""
+
+    def __init__(self):
+        self.n8n_url = os.getenv("N8N_WEBHOOK_URL")
+        self.n8n_timeout = float(os.getenv('N8N_TIMEOUT', '5'))
+        self.max_connections = int(os.getenv('N8N_MAX_CONNECTIONS', '50'))
+        self.queue_size = int(os.getenv('AGENT_QUEUE_SIZE', '10000'))
+        self.worker_count = int(os.getenv('AGENT_WORKERS', '8'))
+        # Shutdown: espera máxima para os workers esvaziarem a fila (s)
+        self.drain_timeout = float(os.getenv('AGENT_DRAIN_TIMEOUT', '10'))
+
+        self.sessions = SessionCompanyIndex()
+        self.coalescer = ConversationCoalescer(self._enqueue_burst)
+        # Eventos do webhook (limitados a AGENT_QUEUE_SIZE) e grupos prontos do coalescer
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._client: Optional[httpx.AsyncClient] = None
+        # Grupos enviados fora do ciclo de vida do servidor (scripts, sem workers)
+        self._detached: set = set()
+
+    @property
+    def is_running(self) -> bool:
+        return any(not worker.done() for worker in self._workers)
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        if not self.n8n_url:
+            logger.warning("🤖 N8N_WEBHOOK_URL não configurada - agente de IA desativado")
+            return
+        # Sem maxsize: o limite vale só para eventos do webhook (submit); grupos
+        # prontos do coalescer sempre entram
+        self._queue = asyncio.Queue()
+        self._client = httpx.AsyncClient(
+            # Workers <= conexões: esperar por uma conexão do pool não é erro
+            timeout=httpx.Timeout(self.n8n_timeout, pool=None),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections
+            )
+        )
+        if not os.getenv('WAHA_WEBHOOK_HMAC_KEY'):
+            logger.error(
+                "🚨 WAHA_WEBHOOK_HMAC_KEY não configurada - /api/webhook/waha vai recusar "
+                "todas as mensagens até a chave HMAC ser definida aqui e no webhook da sessão WAHA"
+            )
+        self._workers = [asyncio.create_task(self._run()) for _ in range(self.worker_count)]
+        AGENT_QUEUE_DEPTH.set_function(lambda: self._queue.qsize() if self._queue is not None else 0)
+        logger.info(f"🤖 Agente de IA iniciado ({self.worker_count} workers, fila {self.queue_size})")
+
+    async def stop(self) -> None:
+        if self._queue is not None and self.is_running:
             try:
-                await client.post(n8n_url, json=n8n_payload, timeout=5.0)
-                logger.info(f"🤖 Agente IA acionado para: {sender} (via n8n)")
+                await asyncio.wait_for(self._drain_queue(), timeout=self.drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️ Agente de IA: {self._queue.qsize()} itens não enviados no desligamento")
+        else:
+            self.coalescer.drain()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await asyncio.gather(*self._detached, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _drain_queue(self) -> None:
+        """Processa os eventos na fila e envia os grupos que eles formaram, sem debounce"""
+        await self._queue.join()
+        self.coalescer.drain()
+        await self._queue.join()
+
+    def submit(self, payload: Dict[str, Any]) -> str:
+        """
+        Filtra e enfileira um evento do webhook (O(1), sem I/O).
+        Retorna 'queued', 'ignored' ou 'disabled'.
+
+        Raises:
+            asyncio.QueueFull: Fila cheia (o WAHA deve reenviar)
+        """
+        if not is_agent_message(payload):
+            AGENT_MESSAGES.labels("ignored").inc()
+            return 'ignored'
+        if self._queue is None:
+            AGENT_MESSAGES.labels("disabled").inc()
+            return 'disabled'
+        if self._queue.qsize() >= self.queue_size:
+            AGENT_MESSAGES.labels("dropped").inc()
+            raise asyncio.QueueFull()
+        self._queue.put_nowait(payload)
+        AGENT_MESSAGES.labels("queued").inc()
+        return 'queued'
+
+    def _enqueue_burst(self, burst: ConversationBurst) -> None:
+        """Grupo pronto do coalescer: enviado por um worker (respeita AGENT_WORKERS)"""
+        if self._queue is not None:
+            self._queue.put_nowait(burst)
+            return
+        task = asyncio.create_task(forward_burst_to_n8n(burst))
+        self._detached.add(task)
+        task.add_done_callback(self._detached.discard)
+
+    async def _run(self) -> None:
+        while True:
+            item: Union[Dict[str, Any], ConversationBurst] = await self._queue.get()
+            try:
+                if isinstance(item, ConversationBurst):
+                    await forward_burst_to_n8n(item)
+                else:
+                    await process_waha_message_for_n8n(item)
             except Exception as e:
-                logger.error(f"❌ Erro ao chamar n8n: {e}")
+                logger.error(f"❌ Erro no processamento do agente: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def post_to_n8n(self, n8n_payload: Dict[str, Any]) -> None:
+        client = self._client
+        if client is None:
+            # Fora do ciclo de vida do servidor (scripts): cliente avulso
+            async with httpx.AsyncClient(timeout=self.n8n_timeout) as client:
+                response = await client.post(self.n8n_url, json=n8n_payload)
+        else:
+            response = await client.post(self.n8n_url, json=n8n_payload)
+        response.raise_for_status()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.is_running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "workers": len(self._workers),
+            "sessions": self.sessions.stats(),
+            "coalescer": self.coalescer.stats(),
+            "agent_configs": get_supabase_service()._agent_configs.stats()
+        }
+
+
+# Singleton global
+_agent_service: Optional[AgentService] = None
+
+
+def get_agent_service() -> AgentService:
+    """Retorna instância singleton do AgentService"""
+    global _agent_service
+    if _agent_service is None:
+        _agent_service = AgentService()
+    return _agent_service
+
 
+def is_agent_message(payload: Dict[str, Any]) -> bool:
+    """Mensagem de texto recebida de um contato (ignora enviadas por mim e grupos)"""
+    if payload.get("event") != "message":
+        return False
+    msg_payload = payload.get("payload") or {}
+    # O filtro @g.us remove grupos
+    if msg_payload.get("fromMe") or "@g.us" in (msg_payload.get("from") or ""):
+        return False
+    return bool(msg_payload.get("body") and msg_payload.get("from") and payload.get("session"))
+
+
+async def process_waha_message_for_n8n(payload: dict):
+    """
+    Processa webhook do WAHA, valida se a empresa tem o agente ativo
+    e encaminha para o n8n gerar a resposta (agrupando mensagens em sequência
+    do mesmo contato por agent_config.response_delay segundos).
+    """
+    service = get_agent_service()
+    if not service.n8n_url:
+        logger.error("❌ N8N_WEBHOOK_URL não configurada no .env")
+        return
+    if not is_agent_message(payload):
+        return
+
+    msg_payload = payload.get("payload", {})
+    session_name = payload.get("session")
+    sender = msg_payload.get("from")
+    body = msg_payload.get("body")
+
+    # 1. Identificar a Empresa pela Sessão
+    company_id = await service.sessions.resolve(session_name)
+    if not company_id:
+        AGENT_MESSAGES.labels("unknown_session").inc()
+        return
+
+    # 2. Buscar Configuração do Agente (cache)
+    agent_config = await get_supabase_service().get_agent_config(company_id)
+
+    # Verifica se está habilitado
+    if not agent_config or not agent_config.get("enabled"):
+        AGENT_MESSAGES.labels("agent_disabled").inc()
+        return
+
+    # 3. Agrupar com as próximas mensagens do contato (ou enviar direto sem delay)
+    try:
+        delay = float(agent_config.get("response_delay") or 0)
+    except (TypeError, ValueError):
+        delay = 0.0
+    contact_name = (msg_payload.get("_data") or {}).get("notifyName")
+    if delay > 0:
+        service.coalescer.add(session_name, sender, company_id, agent_config, body, contact_name, delay)
+        return
+
+    burst = ConversationBurst(session_name, sender, company_id, agent_config, time.monotonic())
+    burst.messages.append(body)
+    if contact_name:
+        burst.contact_name = contact_name
+    await forward_burst_to_n8n(burst)
+
+
+async def forward_burst_to_n8n(burst: ConversationBurst) -> None:
+    """Envia ao n8n as mensagens agrupadas de um contato (uma chamada ao agente)"""
+    agent_config = burst.agent_config
+    n8n_payload = {
+        "message": "\n".join(burst.messages),
+        "messages": burst.messages,
+        "sender": burst.sender,
+        "session_name": burst.session_name,
+        "company_id": burst.company_id,
+        "contact_name": burst.contact_name,
+        "agent_config": {
+            "name": agent_config.get("name", "Assistente"),
+            "personality": agent_config.get("personality", ""),
+            "system_prompt": agent_config.get("system_prompt", ""),
+            "response_delay": agent_config.get("response_delay", 3),
+            "full_config": agent_config
+        }
+    }
+
+    try:
+        await get_agent_service().post_to_n8n(n8n_payload)
+        AGENT_MESSAGES.labels("forwarded").inc()
+        logger.info(f"🤖 Agente IA acionado para: {burst.sender} ({len(burst.messages)} mensagens, via n8n)")
     except Exception as e:
-        logger.error(f"❌ Erro no processamento do agente: {e}")
+        AGENT_MESSAGES.labels("error").inc()
+        logger.error(f"❌ Erro ao chamar n8n: {e}")
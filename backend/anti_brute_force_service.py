@@ -1,16 +1,34 @@
 """
 Anti-Brute Force Service
 Sistema de prevenção de ataques de força bruta em login
+
+- Janelas deslizantes em memória (ring buffer de timestamps de falhas)
+  por email e por (email, IP): a validação de login não consulta o banco
+- Tentativas são gravadas em login_attempts de forma assíncrona, em lote
+- LOGIN_LIMITER_SHARED=true: cada chave é re-sincronizada com o banco a cada
+  LOGIN_LIMITER_SYNC_INTERVAL segundos, para que várias réplicas concordem
 """
 import os
+import time
+import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, Optional, Tuple
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
 from supabase_service import get_supabase_service
+from cache_utils import TTLCache
 
 logger = logging.getLogger(__name__)
 
 
+def _parse_timestamp(value: str) -> float:
+    """created_at do banco (ISO, com ou sem timezone) -> epoch UTC"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
 class AntiBruteForceService:
     """Serviço de proteção contra brute force"""
     
@@ -19,9 +37,115 @@ class AntiBruteForceService:
         self.max_attempts = int(os.getenv('LOGIN_MAX_ATTEMPTS', '5'))
         self.lockout_duration = int(os.getenv('LOGIN_LOCKOUT_DURATION', '1800'))  # 30 min
         self.window_duration = int(os.getenv('LOGIN_WINDOW_DURATION', '900'))  # 15 min
+        # Limite por email (todas as origens) para ataques distribuídos entre IPs
+        self.max_attempts_per_email = int(os.getenv('LOGIN_MAX_ATTEMPTS_PER_EMAIL', str(self.max_attempts * 4)))
+        self.captcha_after_failures = int(os.getenv('LOGIN_CAPTCHA_AFTER_FAILURES', '3'))
+        
+        self.shared_mode = os.getenv('LOGIN_LIMITER_SHARED', 'false').lower() == 'true'
+        self.sync_interval = float(os.getenv('LOGIN_LIMITER_SYNC_INTERVAL', '10'))
+        self.flush_size = int(os.getenv('LOGIN_ATTEMPTS_FLUSH_SIZE', '100'))
+        self.flush_interval = float(os.getenv('LOGIN_ATTEMPTS_FLUSH_INTERVAL', '2'))
+        self.max_buffer = int(os.getenv('LOGIN_ATTEMPTS_MAX_BUFFER', '10000'))
+        
+        # Janelas: chave -> deque(maxlen=N) com (timestamp, ip) das N falhas mais recentes
+        max_keys = int(os.getenv('LOGIN_LIMITER_MAX_KEYS', '100000'))
+        retention = self.window_duration + self.lockout_duration
+        self._by_email = TTLCache(maxsize=max_keys, ttl=retention, name="login_failures_email")
+        self._by_email_ip = TTLCache(maxsize=max_keys, ttl=retention, name="login_failures_email_ip")
+        # Emails sincronizados recentemente com o banco (modo compartilhado)
+        self._synced = TTLCache(maxsize=max_keys, ttl=self.sync_interval, name="login_limiter_sync")
+        
+        self._buffer: List[Dict[str, Any]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        # Acorda o flusher antes do intervalo quando o lote enche
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock = asyncio.Lock()
         
         logger.info(f"🔒 Anti-Brute Force configurado: {self.max_attempts} tentativas em {self.window_duration}s, lockout de {self.lockout_duration}s")
     
+    # ========== Janelas deslizantes ==========
+    
+    def _email_ring_size(self) -> int:
+        return max(self.max_attempts_per_email, self.captcha_after_failures)
+    
+    def _add_failure(self, email: str, ip_address: str, timestamp: float) -> None:
+        for cache, key, size in (
+            (self._by_email, email, self._email_ring_size()),
+            (self._by_email_ip, (email, ip_address), self.max_attempts),
+        ):
+            ring = cache.get(key)
+            if ring is None:
+                ring = deque(maxlen=size)
+            ring.append((timestamp, ip_address))
+            cache.set(key, ring)  # renova a retenção da chave
+    
+    def _lockout_remaining(self, ring: Optional[deque], limit: int, now: float) -> int:
+        """
+        Segundos de bloqueio restantes: `limit` falhas dentro da janela
+        bloqueiam até lockout_duration após a última falha.
+        """
+        if ring is None or len(ring) < limit:
+            return 0
+        newest = ring[-1][0]
+        oldest = ring[-limit][0]
+        if newest - oldest > self.window_duration:
+            return 0
+        return max(0, int(newest + self.lockout_duration - now))
+    
+    async def _sync_email(self, email: str) -> None:
+        """Reconstrói as janelas do email a partir do banco (modo compartilhado)"""
+        if email in self._synced:
+            return
+        self._synced.set(email, True)
+        try:
+            since = datetime.utcnow() - timedelta(seconds=self.window_duration + self.lockout_duration)
+            db = get_supabase_service()
+            result = db.client.table('login_attempts')\
+                .select('ip_address, created_at')\
+                .eq('email', email)\
+                .eq('success', False)\
+                .gte('created_at', since.isoformat())\
+                .order('created_at', desc=True)\
+                .limit(self._email_ring_size() * 4)\
+                .execute()
+            rows = [(r['ip_address'], _parse_timestamp(r['created_at'])) for r in (result.data or [])]
+        except Exception as e:
+            logger.warning(f"⚠️ Não foi possível sincronizar tentativas de {email}: {e}")
+            return
+        
+        # Falhas locais ainda não gravadas também contam
+        rows += [
+            (r['ip_address'], _parse_timestamp(r['created_at']))
+            for r in self._buffer
+            if r['email'] == email and not r['success']
+        ]
+        previous = self._by_email.pop(email) or ()
+        for ip_address in {ip for ip, _ in rows} | {ip for _, ip in previous}:
+            self._by_email_ip.pop((email, ip_address))
+        for ip_address, timestamp in sorted(rows, key=lambda row: row[1]):
+            self._add_failure(email, ip_address, timestamp)
+    
+    async def warm_up(self) -> None:
+        """Carrega falhas recentes do banco (estado sobrevive a restart)"""
+        try:
+            since = datetime.utcnow() - timedelta(seconds=self.window_duration + self.lockout_duration)
+            db = get_supabase_service()
+            result = db.client.table('login_attempts')\
+                .select('email, ip_address, created_at')\
+                .eq('success', False)\
+                .gte('created_at', since.isoformat())\
+                .order('created_at', desc=True)\
+                .limit(self.max_buffer)\
+                .execute()
+            # Mais recentes primeiro no limite; aplicadas em ordem cronológica
+            rows = list(reversed(result.data or []))
+            for row in rows:
+                self._add_failure(row['email'], row['ip_address'], _parse_timestamp(row['created_at']))
+            if rows:
+                logger.info(f"🔒 {len(rows)} falhas de login recentes carregadas")
+        except Exception as e:
+            logger.warning(f"⚠️ Não foi possível carregar tentativas de login recentes: {e}")
+    
     async def check_login_allowed(self, email: str, ip_address: str) -> Tuple[bool, Optional[str], Optional[int]]:
         """
         Verifica se o login é permitido para este email/IP
@@ -33,40 +157,18 @@ class AntiBruteForceService:
             - retry_after: Segundos até poder tentar novamente
         """
         try:
-            db = get_supabase_service()
+            if self.shared_mode:
+                await self._sync_email(email)
             
-            # Buscar tentativas recentes (últimos 15 minutos)
-            window_start = datetime.utcnow() - timedelta(seconds=self.window_duration)
-            
-            # Buscar por email E IP (mais rigoroso)
-            attempts = db.client.table('login_attempts')\
-                .select('*')\
-                .eq('email', email)\
-                .eq('ip_address', ip_address)\
-                .eq('success', False)\
-                .gte('created_at', window_start.isoformat())\
-                .order('created_at', desc=True)\
-                .execute()
-            
-            failed_attempts = attempts.data if attempts.data else []
-            
-            # Contar tentativas falhadas
-            failed_count = len(failed_attempts)
-            
-            if failed_count >= self.max_attempts:
-                # Calcular tempo restante de lockout
-                last_attempt = datetime.fromisoformat(failed_attempts[0]['created_at'].replace('Z', '+00:00'))
-                lockout_until = last_attempt + timedelta(seconds=self.lockout_duration)
-                now = datetime.utcnow().replace(tzinfo=last_attempt.tzinfo)
-                
-                if now < lockout_until:
-                    retry_after = int((lockout_until - now).total_seconds())
-                    logger.warning(f"🚫 Login bloqueado - {email} ({ip_address}) - {failed_count} tentativas - retry em {retry_after}s")
-                    return False, f"Conta temporariamente bloqueada após {self.max_attempts} tentativas falhas", retry_after
-                else:
-                    # Lockout expirou, pode tentar novamente
-                    logger.info(f"🔓 Lockout expirado para {email} ({ip_address})")
-                    return True, None, None
+            now = time.time()
+            ip_retry = self._lockout_remaining(self._by_email_ip.get((email, ip_address)), self.max_attempts, now)
+            email_retry = self._lockout_remaining(self._by_email.get(email), self.max_attempts_per_email, now)
+            retry_after = max(ip_retry, email_retry)
+            if retry_after > 0:
+                # Informa o limite que disparou o bloqueio mais longo
+                limit = self.max_attempts if ip_retry >= email_retry else self.max_attempts_per_email
+                logger.warning(f"🚫 Login bloqueado - {email} ({ip_address}) - retry em {retry_after}s")
+                return False, f"Conta temporariamente bloqueada após {limit} tentativas falhas", retry_after
             
             # Permitido
             return True, None, None
@@ -76,6 +178,17 @@ class AntiBruteForceService:
             # Em caso de erro, permitir (fail-open para não bloquear sistema)
             return True, None, None
     
+    def recent_failures(self, email: str) -> int:
+        """Falhas do email (qualquer IP) dentro da janela, sem consultar o banco"""
+        ring = self._by_email.get(email)
+        if not ring:
+            return 0
+        window_start = time.time() - self.window_duration
+        return sum(1 for timestamp, _ in ring if timestamp >= window_start)
+    
+    def captcha_required(self, email: str) -> bool:
+        return self.recent_failures(email) >= self.captcha_after_failures
+    
     async def record_login_attempt(
         self, 
         email: str, 
@@ -99,8 +212,6 @@ class AntiBruteForceService:
             user_agent: User-Agent do browser
         """
         try:
-            db = get_supabase_service()
-            
             attempt_data = {
                 'email': email,
                 'ip_address': ip_address,
@@ -112,7 +223,18 @@ class AntiBruteForceService:
                 'created_at': datetime.utcnow().isoformat()
             }
             
-            db.client.table('login_attempts').insert(attempt_data).execute()
+            if not success:
+                self._add_failure(email, ip_address, time.time())
+            
+            if self.is_running:
+                self._buffer.append(attempt_data)
+                if len(self._buffer) >= self.max_buffer:
+                    await self.flush()
+                elif len(self._buffer) >= self.flush_size:
+                    self._wakeup.set()
+            else:
+                db = get_supabase_service()
+                db.client.table('login_attempts').insert(attempt_data).execute()
             
             if success:
                 logger.info(f"✅ Login bem-sucedido: {email} ({ip_address})")
@@ -122,6 +244,69 @@ class AntiBruteForceService:
         except Exception as e:
             logger.error(f"❌ Erro ao registrar tentativa de login: {e}", exc_info=True)
     
+    # ========== Persistência em lote ==========
+    
+    @property
+    def is_running(self) -> bool:
+        return self._flusher is not None and not self._flusher.done()
+    
+    def start(self) -> None:
+        """Carrega o estado recente e inicia o flusher (startup do servidor)"""
+        if not self.is_running:
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._run_flusher())
+            logger.info(f"🔒 Persistência de tentativas de login em lote (intervalo {self.flush_interval}s)")
+    
+    async def stop(self) -> None:
+        """Para o flusher e grava as tentativas pendentes"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+    
+    async def _run_flusher(self) -> None:
+        if not self.shared_mode:
+            await self.warm_up()
+        while True:
+            # asyncio.timeout, não wait_for: no 3.11 wait_for engole um cancel()
+            # que chega junto com o set() e o stop() ficaria preso
+            try:
+                async with asyncio.timeout(self.flush_interval):
+                    await self._wakeup.wait()
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+    
+    async def flush(self) -> int:
+        """Grava as tentativas pendentes em um único insert"""
+        async with self._flush_lock:
+            if not self._buffer:
+                return 0
+            
+            batch, self._buffer = self._buffer, []
+            try:
+                db = get_supabase_service()
+                db.client.table('login_attempts').insert(batch).execute()
+                return len(batch)
+            except Exception as e:
+                logger.error(f"❌ Erro ao gravar {len(batch)} tentativas de login: {e}", exc_info=True)
+                self._buffer = (batch + self._buffer)[-self.max_buffer:]
+                return 0
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.is_running,
+            "shared_mode": self.shared_mode,
+            "buffered": len(self._buffer),
+            "tracked_emails": len(self._by_email),
+            "tracked_email_ips": len(self._by_email_ip)
+        }
+    
     async def get_recent_attempts(self, email: Optional[str] = None, limit: int = 100) -> list:
         """
         Busca tentativas recentes de login
@@ -134,6 +319,8 @@ class AntiBruteForceService:
             Lista de tentativas
         """
         try:
+            # Inclui tentativas ainda no buffer
+            await self.flush()
             db = get_supabase_service()
             
             query = db.client.table('login_attempts')\
@@ -166,12 +353,7 @@ class AntiBruteForceService:
             
             cutoff_date = datetime.utcnow() - timedelta(days=days)
             
-            result = db.client.table('login_attempts')\
-                .delete()\
-                .lt('created_at', cutoff_date.isoformat())\
-                .execute()
-            
-            count = len(result.data) if result.data else 0
+            count = await db.purge_old_rows('login_attempts', cutoff_date)
             logger.info(f"🗑️ Removidas {count} tentativas de login antigas (>{days} dias)")
             return count
         
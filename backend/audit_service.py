@@ -1,12 +1,17 @@
 """
 Audit Service
 Sistema de logs de auditoria para ações administrativas
+
+Os eventos são enfileirados em memória (O(1)) e gravados em lote
+(insert multi-linha) por tamanho ou tempo; o buffer é gravado no shutdown.
 """
 import os
+import asyncio
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
 from supabase_service import get_supabase_service
+from cache_utils import TTLCache
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +19,87 @@ logger = logging.getLogger(__name__)
 class AuditService:
     """Serviço de logs de auditoria"""
     
+    def __init__(self):
+        self.flush_size = int(os.getenv('AUDIT_FLUSH_SIZE', '50'))
+        self.flush_interval = float(os.getenv('AUDIT_FLUSH_INTERVAL', '2'))
+        self.max_buffer = int(os.getenv('AUDIT_MAX_BUFFER', '5000'))
+        self._buffer: List[Dict[str, Any]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        # Acorda o flusher antes do intervalo quando o lote enche
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock = asyncio.Lock()
+        
+        # Estatísticas agregadas (RPC get_audit_stats) com TTL curto,
+        # atualizadas incrementalmente a cada novo evento
+        self.stats_top_n = int(os.getenv('AUDIT_STATS_TOP_N', '10'))
+        self._stats_cache = TTLCache(
+            maxsize=1,
+            ttl=float(os.getenv('AUDIT_STATS_CACHE_TTL', '30')),
+            name="audit_stats"
+        )
+    
+    @property
+    def is_running(self) -> bool:
+        return self._flusher is not None and not self._flusher.done()
+    
+    def start(self) -> None:
+        """Inicia o flusher periódico (chamado no startup do servidor)"""
+        if not self.is_running:
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._run_flusher())
+            logger.info(f"📋 Audit writer iniciado (lote {self.flush_size}, intervalo {self.flush_interval}s)")
+    
+    async def stop(self) -> None:
+        """Para o flusher e grava o buffer restante"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.is_running,
+            "buffered": len(self._buffer)
+        }
+    
+    async def _run_flusher(self) -> None:
+        while True:
+            # asyncio.timeout, não wait_for: no 3.11 wait_for engole um cancel()
+            # que chega junto com o set() e o stop() ficaria preso
+            try:
+                async with asyncio.timeout(self.flush_interval):
+                    await self._wakeup.wait()
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+    
+    async def flush(self) -> int:
+        """
+        Grava o buffer em um único insert multi-linha
+        
+        Returns:
+            Quantidade de registros gravados
+        """
+        async with self._flush_lock:
+            if not self._buffer:
+                return 0
+            
+            batch, self._buffer = self._buffer, []
+            try:
+                db = get_supabase_service()
+                db.client.table('audit_logs').insert(batch).execute()
+                return len(batch)
+            except Exception as e:
+                logger.error(f"❌ Erro ao gravar {len(batch)} audit logs: {e}", exc_info=True)
+                # Devolve ao buffer respeitando o limite (descarta os mais antigos)
+                self._buffer = (batch + self._buffer)[-self.max_buffer:]
+                return 0
+    
     async def log_action(
         self,
         user_id: str,
@@ -44,8 +130,6 @@ class AuditService:
             True se registrado com sucesso
         """
         try:
-            db = get_supabase_service()
-            
             log_data = {
                 'user_id': user_id,
                 'user_email': user_email,
@@ -59,8 +143,19 @@ class AuditService:
                 'created_at': datetime.utcnow().isoformat()
             }
             
-            db.client.table('audit_logs').insert(log_data).execute()
+            if self.is_running:
+                self._buffer.append(log_data)
+                if len(self._buffer) >= self.max_buffer:
+                    # Buffer cheio: grava agora em vez de descartar eventos
+                    await self.flush()
+                elif len(self._buffer) >= self.flush_size:
+                    self._wakeup.set()
+            else:
+                # Sem writer em background (scripts): grava diretamente
+                db = get_supabase_service()
+                db.client.table('audit_logs').insert(log_data).execute()
             
+            self._apply_to_stats([log_data])
             logger.info(f"📋 Audit log: {user_email} - {action} - {target_type} {target_id or ''}")
             return True
         
@@ -156,12 +251,9 @@ class AuditService:
             
             cutoff_date = datetime.utcnow() - timedelta(days=days)
             
-            result = db.client.table('audit_logs')\
-                .delete()\
-                .lt('created_at', cutoff_date.isoformat())\
-                .execute()
-            
-            count = len(result.data) if result.data else 0
+            count = await db.purge_old_rows('audit_logs', cutoff_date)
+            if count:
+                self.invalidate_stats()
             logger.info(f"🗑️ Removidos {count} audit logs antigos (>{days} dias)")
             return count
         
@@ -173,6 +265,9 @@ class AuditService:
         """
         Retorna estatísticas dos logs de auditoria
         
+        Agregação feita no banco (RPC get_audit_stats); o resultado fica em cache
+        por AUDIT_STATS_CACHE_TTL segundos e recebe os novos eventos incrementalmente.
+        
         Returns:
             {
                 "total_logs": int,
@@ -182,36 +277,45 @@ class AuditService:
                 "top_users": [{"user_email": str, "count": int}]
             }
         """
+        now = datetime.utcnow()
+        cached = self._stats_cache.get('stats')
+        if cached is not None and cached['day'] == now.date():
+            return self._copy_stats(cached['stats'])
+        
         try:
             db = get_supabase_service()
+            today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            week_start = now - timedelta(days=7)
             
-            # Total de logs
-            total_result = db.client.table('audit_logs').select('*', count='exact').execute()
-            total_logs = total_result.count or 0
-            
-            # Logs hoje
-            today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-            today_result = db.client.table('audit_logs')\
-                .select('*', count='exact')\
-                .gte('created_at', today_start.isoformat())\
-                .execute()
-            logs_today = today_result.count or 0
+            try:
+                result = db.client.rpc('get_audit_stats', {
+                    'p_today_start': today_start.isoformat(),
+                    'p_week_start': week_start.isoformat(),
+                    'p_top_n': self.stats_top_n
+                }).execute()
+                stats = result.data or {}
+                stats = {
+                    'total_logs': stats.get('total_logs', 0),
+                    'logs_today': stats.get('logs_today', 0),
+                    'logs_this_week': stats.get('logs_this_week', 0),
+                    'top_actions': stats.get('top_actions') or [],
+                    'top_users': stats.get('top_users') or []
+                }
+            except Exception as e:
+                # RPC ainda não aplicada: apenas contagens (sem trazer linhas)
+                logger.warning(f"⚠️ RPC get_audit_stats indisponível, usando contagens simples: {e}")
+                stats = {
+                    'total_logs': self._count(db),
+                    'logs_today': self._count(db, today_start),
+                    'logs_this_week': self._count(db, week_start),
+                    'top_actions': [],
+                    'top_users': []
+                }
             
-            # Logs esta semana
-            week_start = datetime.utcnow() - timedelta(days=7)
-            week_result = db.client.table('audit_logs')\
-                .select('*', count='exact')\
-                .gte('created_at', week_start.isoformat())\
-                .execute()
-            logs_this_week = week_result.count or 0
-            
-            return {
-                'total_logs': total_logs,
-                'logs_today': logs_today,
-                'logs_this_week': logs_this_week,
-                'top_actions': [],  # TODO: Implementar agregação
-                'top_users': []  # TODO: Implementar agregação
-            }
+            self._stats_cache.set('stats', {'day': now.date(), 'stats': stats})
+            # Eventos ainda no buffer não estão no banco
+            self._apply_to_stats(list(self._buffer))
+            return self._copy_stats(self._stats_cache.get('stats')['stats'])
         
         except Exception as e:
             logger.error(f"❌ Erro ao buscar stats de auditoria: {e}", exc_info=True)
@@ -222,6 +326,58 @@ class AuditService:
                 'top_actions': [],
                 'top_users': []
             }
+    
+    def invalidate_stats(self) -> None:
+        """Descarta as estatísticas em cache (ex: após remoção de logs)"""
+        self._stats_cache.pop('stats')
+    
+    def _count(self, db, since: Optional[datetime] = None) -> int:
+        query = db.client.table('audit_logs').select('id', count='exact')
+        if since is not None:
+            query = query.gte('created_at', since.isoformat())
+        return query.limit(1).execute().count or 0
+    
+    def _apply_to_stats(self, rows: List[Dict[str, Any]]) -> None:
+        """Soma novos eventos às estatísticas em cache (se houver)"""
+        cached = self._stats_cache.get('stats')
+        if cached is None or not rows:
+            return
+        if cached['day'] != datetime.utcnow().date():
+            # Virada do dia: logs_today precisa ser recalculado
+            self._stats_cache.pop('stats')
+            return
+        
+        stats = self._copy_stats(cached['stats'])
+        stats['total_logs'] += len(rows)
+        stats['logs_today'] += len(rows)
+        stats['logs_this_week'] += len(rows)
+        for row in rows:
+            self._bump(stats['top_actions'], 'action', row.get('action'))
+            self._bump(stats['top_users'], 'user_email', row.get('user_email'))
+        self._stats_cache.replace('stats', {'day': cached['day'], 'stats': stats})
+    
+    def _bump(self, ranking: List[Dict[str, Any]], key: str, value: Optional[str]) -> None:
+        """
+        Incrementa um item do top-N. Itens fora do ranking só entram se a lista
+        ainda não estiver completa (os demais aparecem no próximo refresh).
+        """
+        for item in ranking:
+            if item[key] == value:
+                item['count'] += 1
+                break
+        else:
+            if len(ranking) >= self.stats_top_n:
+                return
+            ranking.append({key: value, 'count': 1})
+        ranking.sort(key=lambda item: -item['count'])
+    
+    @staticmethod
+    def _copy_stats(stats: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            **stats,
+            'top_actions': [dict(item) for item in stats['top_actions']],
+            'top_users': [dict(item) for item in stats['top_users']]
+        }
 
 
 # Singleton global
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga ponta a ponta: N campanhas × M contatos contra WAHA e Supabase falsos
+
+- Sobe fake_waha e fake_postgrest (uvicorn em threads) e aponta o backend para eles
+- Fase "campaigns": inicia as campanhas via POST /api/campaigns/{id}/start
+  (process_campaign real) e espera todas terminarem
+- Fase "api": requisições concorrentes às rotas de leitura do painel
+- Reporta mensagens/s, p50/p95/p99 por mensagem e por rota e chamadas ao
+  banco por mensagem/requisição; resultado em JSON para comparar entre commits
+
+O limiter (slowapi) é desativado: o objetivo é medir o backend, não o rate limit.
+
+Uso: python benchmarks/bench_campaign_load.py --campaigns 5 --contacts 200 --output benchmarks/results/load.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx
+import jwt
+
+from fake_postgrest import FakePostgrest, create_app as create_postgrest_app
+from fake_waha import FakeWaha, FakeWahaConfig, create_app as create_waha_app
+
+JWT_SECRET = "bench-jwt-secret-for-local-load-tests"
+API_ENDPOINTS = (
+    "/api/campaigns",
+    "/api/campaigns/{campaign_id}",
+    "/api/campaigns/{campaign_id}/logs",
+    "/api/dashboard/stats",
+    "/api/quotas/me",
+)
+
+
+# ========== Infra ==========
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve_in_thread(app, port: int):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread
+
+
+def _configure_env(postgrest_url: str, waha_url: str) -> None:
+    # Antes de importar server: o load_dotenv não sobrescreve o que já está definido
+    os.environ.update({
+        'SUPABASE_URL': postgrest_url,
+        'SUPABASE_KEY': 'bench-service-key',
+        'SUPABASE_SERVICE_ROLE_KEY': 'bench-service-key',
+        'SUPABASE_JWT_SECRET': JWT_SECRET,
+        'WAHA_DEFAULT_URL': waha_url,
+        'WAHA_MASTER_KEY': 'bench-waha-key',
+        'RATE_LIMIT_STORAGE_URI': 'memory://',
+        'OTEL_ENABLED': 'false',
+        'SMTP_HOST': '',
+    })
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+# ========== Dados ==========
+
+def seed(db: FakePostgrest, args) -> Dict[str, Any]:
+    """Empresas, usuários (plano avançado ilimitado) e campanhas prontas para iniciar"""
+    now = datetime.utcnow().isoformat()
+    companies = []
+    for index in range(args.companies):
+        company_id = str(uuid.uuid4())
+        user_id = str(uuid.uuid4())
+        companies.append({"company_id": company_id, "user_id": user_id, "campaign_ids": []})
+        db.seed('companies', [{'id': company_id, 'name': f'Bench {index}', 'timezone': 'America/Sao_Paulo'}])
+        db.seed('company_settings', [{'company_id': company_id, 'waha_session': f'bench_{index}'}])
+        db.seed('profiles', [{
+            'id': user_id, 'company_id': company_id,
+            'email': f'bench{index}@example.com', 'full_name': f'Bench {index}', 'session_token': None
+        }])
+        db.seed('user_roles', [{'user_id': user_id, 'role': 'company_owner'}])
+        db.seed('user_quotas', [{
+            'user_id': user_id, 'company_id': company_id, 'plan_type': 'avancado', 'plan_name': 'Avançado',
+            'campaigns_limit': -1, 'campaigns_used': 0, 'messages_limit': -1, 'messages_used': 0,
+            'leads_limit': -1, 'leads_used': 0
+        }])
+
+    for index in range(args.campaigns):
+        owner = companies[index % len(companies)]
+        campaign_id = str(uuid.uuid4())
+        owner["campaign_ids"].append(campaign_id)
+        db.seed('campaigns', [{
+            'id': campaign_id, 'company_id': owner["company_id"], 'user_id': owner["user_id"],
+            'name': f'Campanha {index}', 'status': 'ready',
+            'message_type': 'text', 'message_text': 'Olá {nome}, temos uma oferta para {categoria}!',
+            'media_url': None, 'media_filename': None,
+            'interval_min': args.interval, 'interval_max': args.interval,
+            'start_time': None, 'end_time': None, 'daily_limit': None,
+            'working_days': [0, 1, 2, 3, 4, 5, 6],
+            'total_contacts': args.contacts, 'pending_count': args.contacts,
+            'sent_count': 0, 'error_count': 0, 'created_at': now, 'updated_at': now
+        }])
+        db.seed('campaign_contacts', [{
+            'campaign_id': campaign_id, 'name': f'Contato {index}-{n}',
+            'phone': f'5511{9_0000_0000 + index * args.contacts + n}',
+            'email': None, 'category': 'Varejo', 'extra_data': {}, 'status': 'pending'
+        } for n in range(args.contacts)])
+
+    return {"companies": companies}
+
+
+def make_token(user_id: str, email: str) -> str:
+    return jwt.encode({
+        'sub': user_id,
+        'email': email,
+        'aud': 'authenticated',
+        'role': 'authenticated',
+        'exp': datetime.now(timezone.utc) + timedelta(hours=1)
+    }, JWT_SECRET, algorithm='HS256')
+
+
+# ========== Estatística ==========
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 (nearest-rank), média e máximo em ms"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50": round(rank(50) * 1000, 3),
+        "p95": round(rank(95) * 1000, 3),
+        "p99": round(rank(99) * 1000, 3),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+def message_latencies(logs: List[Dict[str, Any]], started_at: Dict[str, datetime]) -> List[float]:
+    """Tempo entre mensagens consecutivas da mesma campanha (a primeira conta desde o start)"""
+    by_campaign: Dict[str, List[datetime]] = {}
+    for log in logs:
+        by_campaign.setdefault(log['campaign_id'], []).append(datetime.fromisoformat(log['sent_at']))
+
+    samples = []
+    for campaign_id, sent_at in by_campaign.items():
+        previous = started_at.get(campaign_id)
+        for moment in sorted(sent_at):
+            if previous is not None:
+                samples.append(max(0.0, (moment - previous).total_seconds()))
+            previous = moment
+    return samples
+
+
+def _per_unit(calls: Counter, units: int) -> Dict[str, float]:
+    return {key: round(count / max(1, units), 3) for key, count in calls.most_common()}
+
+
+# ========== Fases ==========
+
+async def run_campaign_phase(client, db: FakePostgrest, waha: FakeWaha, fixtures, tokens, args) -> Dict[str, Any]:
+    from campaign_worker import running_campaigns
+
+    db.reset_stats()
+    waha.reset()
+    started_at: Dict[str, datetime] = {}
+    start_latencies: List[float] = []
+    start_status: Counter = Counter()
+
+    async def start(campaign_id: str, token: str):
+        started_at[campaign_id] = datetime.now(timezone.utc)
+        begin = time.perf_counter()
+        response = await client.post(
+            f"/api/campaigns/{campaign_id}/start", headers={"Authorization": f"Bearer {token}"}
+        )
+        start_latencies.append(time.perf_counter() - begin)
+        start_status[str(response.status_code)] += 1
+        if response.status_code != 200:
+            logging.getLogger("bench").warning(f"start {campaign_id}: {response.status_code} {response.text}")
+
+    begin = time.perf_counter()
+    await asyncio.gather(*(
+        start(campaign_id, tokens[company["user_id"]])
+        for company in fixtures["companies"]
+        for campaign_id in company["campaign_ids"]
+    ))
+
+    tasks = [task for task in running_campaigns.values() if not task.done()]
+    timed_out = False
+    if tasks:
+        done, pending = await asyncio.wait(tasks, timeout=args.timeout)
+        if pending:
+            timed_out = True
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+    duration = time.perf_counter() - begin
+
+    with db.lock:
+        calls = Counter(db.calls)
+    campaign_ids = set(started_at)
+    logs = [log for log in db.rows('message_logs') if log.get('campaign_id') in campaign_ids]
+    statuses = Counter(log.get('status') for log in logs)
+    messages = len(logs)
+
+    return {
+        "campaigns": len(campaign_ids),
+        "contacts_per_campaign": args.contacts,
+        "timed_out": timed_out,
+        "duration_s": round(duration, 3),
+        "messages": messages,
+        "sent": statuses.get('sent', 0),
+        "errors": statuses.get('error', 0),
+        "messages_per_sec": round(messages / duration, 2) if duration else 0.0,
+        "message_latency_ms": percentiles(message_latencies(logs, started_at)),
+        "start_request_latency_ms": percentiles(start_latencies),
+        "start_request_status": dict(start_status),
+        "db_calls": sum(calls.values()),
+        "db_calls_per_message": round(sum(calls.values()) / max(1, messages), 3),
+        "db_calls_per_message_by_operation": _per_unit(calls, messages),
+        "waha": waha.stats(),
+    }
+
+
+async def run_api_phase(client, db: FakePostgrest, fixtures, tokens, args) -> Dict[str, Any]:
+    db.reset_stats()
+    requests_plan = []
+    rng = random.Random(args.seed)
+    for _ in range(args.api_requests):
+        company = rng.choice(fixtures["companies"])
+        campaign_id = rng.choice(company["campaign_ids"]) if company["campaign_ids"] else "missing"
+        template = rng.choice(API_ENDPOINTS)
+        requests_plan.append((template, template.format(campaign_id=campaign_id), tokens[company["user_id"]]))
+
+    latencies: Dict[str, List[float]] = {template: [] for template in API_ENDPOINTS}
+    statuses: Dict[str, Counter] = {template: Counter() for template in API_ENDPOINTS}
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in requests_plan:
+        queue.put_nowait(item)
+
+    async def worker():
+        while not queue.empty():
+            template, path, token = queue.get_nowait()
+            begin = time.perf_counter()
+            response = await client.get(path, headers={"Authorization": f"Bearer {token}"})
+            latencies[template].append(time.perf_counter() - begin)
+            statuses[template][str(response.status_code)] += 1
+
+    begin = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.api_concurrency)))
+    duration = time.perf_counter() - begin
+
+    with db.lock:
+        calls = Counter(db.calls)
+    total = len(requests_plan)
+    all_latencies = [sample for samples in latencies.values() for sample in samples]
+    errors = sum(count for counter in statuses.values() for status, count in counter.items() if status[0] != '2')
+
+    return {
+        "requests": total,
+        "concurrency": args.api_concurrency,
+        "duration_s": round(duration, 3),
+        "requests_per_sec": round(total / duration, 2) if duration else 0.0,
+        "errors": errors,
+        "latency_ms": percentiles(all_latencies),
+        "endpoints": {
+            template: {"latency_ms": percentiles(latencies[template]), "status": dict(statuses[template])}
+            for template in API_ENDPOINTS
+        },
+        "db_calls": sum(calls.values()),
+        "db_calls_per_request": round(sum(calls.values()) / max(1, total), 3),
+        "db_calls_per_request_by_operation": _per_unit(calls, total),
+    }
+
+
+async def run(args, db: FakePostgrest, waha: FakeWaha, fixtures) -> Dict[str, Any]:
+    import server
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    server.limiter.enabled = False
+
+    tokens = {}
+    for company in fixtures["companies"]:
+        profile = next(p for p in db.rows('profiles') if p['id'] == company["user_id"])
+        tokens[company["user_id"]] = make_token(company["user_id"], profile['email'])
+
+    await server.start_background_services()
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            campaigns = await run_campaign_phase(client, db, waha, fixtures, tokens, args)
+            api = await run_api_phase(client, db, fixtures, tokens, args) if args.api_requests else None
+    finally:
+        await server.stop_background_services()
+
+    return {"campaigns": campaigns, "api": api}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga ponta a ponta (campanhas + API)")
+    parser.add_argument("--campaigns", type=int, default=5)
+    parser.add_argument("--contacts", type=int, default=100, help="contatos por campanha")
+    parser.add_argument("--companies", type=int, default=1, help="campanhas são distribuídas entre as empresas")
+    parser.add_argument("--interval", type=int, default=0, help="interval_min/max das campanhas (s)")
+    parser.add_argument("--waha-latency-ms", type=float, default=50.0)
+    parser.add_argument("--waha-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--waha-error-rate", type=float, default=0.0)
+    parser.add_argument("--waha-rate-limit", type=float, default=0.0, help="envios/s por sessão (0 = sem limite)")
+    parser.add_argument("--db-latency-ms", type=float, default=2.0, help="latência simulada por chamada ao PostgREST")
+    parser.add_argument("--api-requests", type=int, default=500)
+    parser.add_argument("--api-concurrency", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=600.0, help="tempo máximo da fase de campanhas (s)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="arquivo JSON (padrão: benchmarks/results/campaign_load_<data>.json)")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    args.companies = max(1, min(args.companies, args.campaigns or 1))
+
+    db = FakePostgrest(latency_ms=args.db_latency_ms)
+    waha = FakeWaha(FakeWahaConfig(
+        latency_ms=args.waha_latency_ms,
+        jitter_ms=args.waha_jitter_ms,
+        error_rate=args.waha_error_rate,
+        rate_limit=args.waha_rate_limit,
+        seed=args.seed
+    ))
+    postgrest_port, waha_port = _free_port(), _free_port()
+    servers = [
+        _serve_in_thread(create_postgrest_app(db), postgrest_port),
+        _serve_in_thread(create_waha_app(waha), waha_port),
+    ]
+    _configure_env(f"http://127.0.0.1:{postgrest_port}", f"http://127.0.0.1:{waha_port}")
+    fixtures = seed(db, args)
+
+    try:
+        results = asyncio.run(run(args, db, waha, fixtures))
+    finally:
+        for server, thread in servers:
+            server.should_exit = True
+            thread.join(timeout=5)
+
+    report = {
+        "benchmark": "campaign_load",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")},
+        **results,
+    }
+
+    output = args.output or os.path.join(
+        BACKEND_DIR, 'benchmarks', 'results',
+        f"campaign_load_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    campaigns = results["campaigns"]
+    print(f"Campanhas: {campaigns['messages']} mensagens em {campaigns['duration_s']}s "
+          f"({campaigns['messages_per_sec']} msg/s), "
+          f"p50/p95/p99 {campaigns['message_latency_ms'].get('p50')}/"
+          f"{campaigns['message_latency_ms'].get('p95')}/{campaigns['message_latency_ms'].get('p99')} ms, "
+          f"{campaigns['db_calls_per_message']} chamadas ao banco por mensagem")
+    if results["api"]:
+        api = results["api"]
+        print(f"API: {api['requests']} requisições ({api['requests_per_sec']} req/s), "
+              f"p50/p95/p99 {api['latency_ms'].get('p50')}/{api['latency_ms'].get('p95')}/"
+              f"{api['latency_ms'].get('p99')} ms, {api['errors']} erros, "
+              f"{api['db_calls_per_request']} chamadas ao banco por requisição")
+    print(f"Resultado salvo em {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Benchmark: custo de render por email (Template() a cada envio vs. templates pré-compilados)
+
+Uso: python benchmarks/bench_email_templates.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from jinja2 import Template
+
+from email_service import EmailService, TEMPLATES_DIR
+
+
+CONTEXT = {
+    'user_name': 'Maria Silva',
+    'campaign_name': 'Black Friday',
+    'total_contacts': 1200,
+    'total_sent': 1150,
+    'total_errors': 50,
+    'total_pending': 0,
+    'success_rate': '95.8',
+    'campaign_id': 'c0ffee',
+}
+
+
+def main(emails=500):
+    service = EmailService()
+    html_source = (TEMPLATES_DIR / 'campaign_completed.html').read_text()
+
+    def legacy():
+        # Comportamento anterior: parse + compile do template a cada email
+        return Template(html_source).render(**CONTEXT)
+
+    def compiled():
+        return service.render('campaign_completed', **CONTEXT)
+
+    assert legacy() == compiled()[0]
+
+    legacy_time = timeit.timeit(legacy, number=emails)
+    compiled_time = timeit.timeit(compiled, number=emails)
+
+    print(f"📊 Render de {emails} emails (campaign_completed)")
+    print(f"   Template() por email: {legacy_time / emails * 1e6:9.1f} µs/email")
+    print(f"   pré-compilado:        {compiled_time / emails * 1e6:9.1f} µs/email (HTML + texto)")
+    print(f"   speedup:              {legacy_time / compiled_time:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark: templates de mensagem compilados vs. replace_variables legado
+
+Verifica também a saída em templates/dados aleatórios: igual à do legado,
+exceto quando um valor substituído contém um placeholder - o legado o
+reprocessa, o compilado não (diferença intencional, ver CompiledTemplate).
+Uso: python benchmarks/bench_message_templates.py
+"""
+import os
+import random
+import re
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from security_utils import sanitize_template_value
+from waha_service import CompiledTemplate, compile_template
+
+
+def legacy_replace_variables(template, data):
+    """Implementação anterior (duas passadas de str.replace)"""
+    result = template
+    for key, value in data.items():
+        safe_value = sanitize_template_value(value)
+        placeholder = "{" + key + "}"
+        result = result.replace(placeholder, safe_value)
+    for key, value in data.items():
+        safe_value = sanitize_template_value(value)
+        for variant in [key.lower(), key.upper(), key.capitalize()]:
+            placeholder = "{" + variant + "}"
+            result = result.replace(placeholder, safe_value)
+    return result
+
+
+def single_pass_replace_variables(template, data):
+    """Referência da regra do compilado: mesma resolução do legado, uma única passada"""
+    def resolve(match):
+        name = match.group(1)
+        if name in data:
+            return sanitize_template_value(data[name])
+        for key, value in data.items():
+            if name in (key.lower(), key.upper(), key.capitalize()):
+                return sanitize_template_value(value)
+        return match.group(0)
+    return re.sub(r'\{([^{}]*)\}', resolve, template)
+
+
+def random_value(rng, braces=True):
+    alphabet = string.ascii_letters + string.digits + " <>&;|$`'\"\n"
+    if braces:
+        alphabet += "{}"
+    value = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+    if braces and rng.random() < 0.2:
+        # Valor que parece um placeholder (ex: contato com nome "{email}")
+        value += "{" + random_case(rng, random_key(rng)) + "}"
+    return value
+
+
+def random_key(rng):
+    return rng.choice(["nome", "Nome", "NOME", "phone", "Email", "categoria", "cidade", "Cidade", "empresa"]) \
+        + rng.choice(["", "", "_x", "2"])
+
+
+def random_case(rng, key):
+    return rng.choice([key, key.lower(), key.upper(), key.capitalize(), key.swapcase()])
+
+
+def check_equivalence(iterations=20000, seed=42):
+    rng = random.Random(seed)
+    divergent = 0
+    for _ in range(iterations):
+        data = {random_key(rng): random_value(rng) for _ in range(rng.randint(0, 12))}
+        keys = list(data) or ["nome"]
+        pieces = []
+        for _ in range(rng.randint(0, 10)):
+            pieces.append(random_value(rng, braces=False))
+            pieces.append("{" + random_case(rng, rng.choice(keys)) + "}")
+            if rng.random() < 0.1:
+                pieces.append(rng.choice(["{", "}", "{}", "{{"]))
+        template = ''.join(pieces)
+        got = CompiledTemplate(template).render(data)
+        expected = single_pass_replace_variables(template, data)
+        assert got == expected, (template, data, expected, got)
+        legacy = legacy_replace_variables(template, data)
+        if got != legacy:
+            # Só diverge do legado quando um valor substituído contém um placeholder
+            assert any(re.search(r'\{[^{}]*\}', sanitize_template_value(v)) for v in data.values()), \
+                (template, data, legacy, got)
+            divergent += 1
+
+    # Diferença intencional: o valor não é reprocessado
+    data = {"nome": "{email}", "email": "a@b.com"}
+    assert legacy_replace_variables("Oi {nome}", data) == "Oi a@b.com"
+    assert CompiledTemplate("Oi {nome}").render(data) == "Oi {email}"
+    print(f"✅ Saída verificada em {iterations} casos aleatórios "
+          f"({divergent} com placeholder dentro de um valor, não reprocessado)")
+
+
+def bench(variables=20, contacts=2000):
+    rng = random.Random(1)
+    keys = [f"campo{i}" for i in range(variables - 4)] + ["nome", "telefone", "email", "categoria"]
+    template = "Olá {Nome}! " + " ".join("{" + k + "} texto fixo" for k in keys) + " Abraços."
+    rows = [{k: random_value(rng, braces=False) for k in keys} for _ in range(contacts)]
+
+    legacy = timeit.timeit(lambda: [legacy_replace_variables(template, r) for r in rows], number=3)
+    compiled_tpl = compile_template(template)
+    compiled = timeit.timeit(lambda: [compiled_tpl.render(r) for r in rows], number=3)
+
+    per_legacy = legacy / (3 * contacts) * 1e6
+    per_compiled = compiled / (3 * contacts) * 1e6
+    print(f"📊 {variables} variáveis, {contacts} contatos")
+    print(f"   legado:    {per_legacy:8.2f} µs/mensagem")
+    print(f"   compilado: {per_compiled:8.2f} µs/mensagem")
+    print(f"   speedup:   {per_legacy / per_compiled:8.1f}x")
+
+
+if __name__ == "__main__":
+    check_equivalence()
+    bench()
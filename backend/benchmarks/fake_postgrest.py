@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Fake PostgREST: subconjunto da API REST do Supabase em memória
+
+Cobre o que o backend usa: select com colunas simples, filtros
+(eq, neq, gt, gte, lt, lte, in, is, like, ilike, com not.; or/and aninhados),
+order, limit/offset, Prefer count=exact (Content-Range), .single() (406 quando
+não há exatamente uma linha), insert/upsert (on_conflict), update, delete e as RPCs de contadores
+atômicos, de deletes em cascata e de claim de filas. Tabelas são criadas sob
+demanda; RPCs desconhecidas respondem 404 como o PostgREST, o que exercita os
+fallbacks do SupabaseService.
+
+Cada requisição é contada por tabela/operação (GET /__stats) para medir
+chamadas ao banco por mensagem. Seleções embutidas (rel(col)) são ignoradas.
+
+Uso: python benchmarks/fake_postgrest.py --port 54321 --latency-ms 5
+     (SUPABASE_URL=http://127.0.0.1:54321)
+"""
+import argparse
+import asyncio
+import re
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+_RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns", "or", "and"}
+_LOGIC_PARAMS = {"or", "and"}
+_OBJECT_MEDIA_TYPE = "application/vnd.pgrst.object+json"
+_OPERATIONS = {"GET": "select", "HEAD": "count", "POST": "insert", "PATCH": "update", "DELETE": "delete"}
+
+
+def _error(status: int, code: str, message: str, details: Optional[str] = None) -> JSONResponse:
+    return JSONResponse(
+        {"code": code, "message": message, "details": details, "hint": None},
+        status_code=status
+    )
+
+
+def _split_top_level(value: str) -> List[str]:
+    """Divide por vírgula fora de parênteses (select=a,b,rel(c,d))"""
+    parts, depth, current = [], 0, []
+    for char in value:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == ',' and depth == 0:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    if current:
+        parts.append(''.join(current))
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _coerce(raw: str, actual: Any) -> Any:
+    if isinstance(actual, bool):
+        return raw.lower() == 'true'
+    if isinstance(actual, (int, float)):
+        try:
+            return float(raw)
+        except ValueError:
+            return raw
+    return raw
+
+
+def _like(pattern: str, value: Any, flags: int = 0) -> bool:
+    regex, i = '', 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+            continue
+        regex += {'*': '.*', '%': '.*', '_': '.'}.get(char) or re.escape(char)
+        i += 1
+    return value is not None and re.match('^' + regex + '$', str(value), flags | re.DOTALL) is not None
+
+
+def _unquote(raw: str) -> str:
+    """Valor entre aspas de or()/and(): \\ e \\" viram literais"""
+    if len(raw) >= 2 and raw[0] == raw[-1] == '"':
+        return re.sub(r'\\(.)', r'\1', raw[1:-1])
+    return raw
+
+
+def _split_logic(value: str) -> List[str]:
+    """Divide termos de or()/and() por vírgula fora de parênteses e aspas"""
+    parts, depth, quoted, escaped, current = [], 0, False, False, []
+    for char in value:
+        if escaped:
+            escaped = False
+        elif char == '\\' and quoted:
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and char == ',' and depth == 0:
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(char)
+    if current:
+        parts.append(''.join(current))
+    return parts
+
+
+def _matches_logic(row: Dict[str, Any], operator: str, body: str) -> bool:
+    """or=(a.eq.1,and(b.lt.2,c.eq.3)) com not. e aninhamento"""
+    negate = operator.startswith('not.')
+    operator = operator[4:] if negate else operator
+    results = []
+    for term in _split_logic(body[1:-1]):
+        name = term.split('(', 1)[0]
+        if name in ('or', 'and', 'not.or', 'not.and') and term.endswith(')'):
+            results.append(_matches_logic(row, name, term[len(name):]))
+        else:
+            column, _, expression = term.partition('.')
+            results.append(_matches(row, column, expression))
+    result = any(results) if operator == 'or' else all(results)
+    return not result if negate else result
+
+
+def _matches(row: Dict[str, Any], column: str, expression: str) -> bool:
+    negate = expression.startswith('not.')
+    if negate:
+        expression = expression[4:]
+    operator, _, raw = expression.partition('.')
+    raw = _unquote(raw)
+    actual = row.get(column)
+
+    if operator == 'is':
+        result = {'null': actual is None, 'true': actual is True, 'false': actual is False}.get(raw.lower(), False)
+    elif operator == 'in':
+        values = [v.strip().strip('"') for v in raw.strip('()').split(',') if v.strip()]
+        result = actual is not None and str(actual) in values
+    elif operator == 'like':
+        result = _like(raw, actual)
+    elif operator == 'ilike':
+        result = _like(raw, actual, re.IGNORECASE)
+    elif actual is None:
+        result = False
+    else:
+        expected = _coerce(raw, actual)
+        if not isinstance(expected, (bool, float)):
+            # Textos e timestamps ISO comparam como string
+            actual = str(actual)
+        compare = {
+            'eq': lambda a, b: a == b,
+            'neq': lambda a, b: a != b,
+            'gt': lambda a, b: a > b,
+            'gte': lambda a, b: a >= b,
+            'lt': lambda a, b: a < b,
+            'lte': lambda a, b: a <= b,
+        }.get(operator)
+        if compare is None:
+            return False
+        try:
+            result = compare(actual, expected)
+        except TypeError:
+            result = False
+    return not result if negate else result
+
+
+def _order_key(column: str):
+    def key(row):
+        value = row.get(column)
+        # NULLs por último (padrão do Postgres em ASC)
+        return (value is None, value if value is not None else 0)
+    return key
+
+
+class FakePostgrest:
+    """Banco em memória + contadores de chamadas"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.rpcs: Dict[str, Callable[['FakePostgrest', Dict[str, Any]], Any]] = dict(DEFAULT_RPCS)
+        self.calls: Counter = Counter()
+        self.lock = threading.Lock()
+
+    # ========== Dados ==========
+
+    def table(self, name: str) -> List[Dict[str, Any]]:
+        return self.tables.setdefault(name, [])
+
+    def seed(self, name: str, rows: List[Dict[str, Any]]) -> None:
+        with self.lock:
+            self.table(name).extend(self._with_defaults(row) for row in rows)
+
+    def rows(self, name: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [dict(row) for row in self.tables.get(name, [])]
+
+    @staticmethod
+    def _with_defaults(row: Dict[str, Any]) -> Dict[str, Any]:
+        row = dict(row)
+        row.setdefault('id', str(uuid.uuid4()))
+        row.setdefault('created_at', datetime.utcnow().isoformat())
+        return row
+
+    # ========== Contadores ==========
+
+    def record(self, table: str, operation: str) -> None:
+        self.calls[f"{table}:{operation}"] += 1
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "total_calls": self.total_calls(),
+            "calls": dict(self.calls.most_common()),
+            "tables": {name: len(rows) for name, rows in self.tables.items()}
+        }
+
+    def reset_stats(self) -> None:
+        self.calls.clear()
+
+    # ========== Consulta ==========
+
+    @staticmethod
+    def _filters(request: Request):
+        return [
+            (k, v) for k, v in request.query_params.multi_items()
+            if (k not in _RESERVED_PARAMS or k in _LOGIC_PARAMS) and '.' not in k
+        ]
+
+    @staticmethod
+    def _row_matches(row: Dict[str, Any], filters) -> bool:
+        return all(
+            _matches_logic(row, col, expr) if col in _LOGIC_PARAMS else _matches(row, col, expr)
+            for col, expr in filters
+        )
+
+    def _filtered(self, table: str, filters) -> List[Dict[str, Any]]:
+        return [row for row in self.table(table) if self._row_matches(row, filters)]
+
+    @staticmethod
+    def _project(rows: List[Dict[str, Any]], select: Optional[str]) -> List[Dict[str, Any]]:
+        if not select or select == '*':
+            return [dict(row) for row in rows]
+        columns = []
+        for item in _split_top_level(select):
+            if item == '*':
+                return [dict(row) for row in rows]
+            if '(' in item:
+                continue
+            alias, _, column = item.rpartition(':')
+            columns.append((alias or column, column.split('::')[0]))
+        return [{alias: row.get(column) for alias, column in columns} for row in rows]
+
+    @staticmethod
+    def _ordered(rows: List[Dict[str, Any]], order: Optional[str]) -> List[Dict[str, Any]]:
+        if not order:
+            return rows
+        for item in reversed(order.split(',')):
+            column, _, direction = item.partition('.')
+            rows = sorted(rows, key=_order_key(column), reverse=direction.startswith('desc'))
+        return rows
+
+    def handle_read(self, table: str, request: Request, head: bool = False) -> Response:
+        params = request.query_params
+        rows = self._ordered(self._filtered(table, self._filters(request)), params.get('order'))
+        total = len(rows)
+        offset = int(params.get('offset') or 0)
+        limit = params.get('limit')
+        rows = rows[offset:offset + int(limit)] if limit is not None else rows[offset:]
+        data = self._project(rows, params.get('select'))
+
+        headers = {}
+        if 'count=' in (request.headers.get('prefer') or ''):
+            end = offset + len(data) - 1
+            headers['Content-Range'] = f"{offset}-{end}/{total}" if data else f"*/{total}"
+
+        if head:
+            return Response(status_code=200, headers=headers)
+        return self._respond(request, data, headers)
+
+    @staticmethod
+    def _respond(request: Request, data: List[Dict[str, Any]], headers=None, status: int = 200) -> Response:
+        if _OBJECT_MEDIA_TYPE in (request.headers.get('accept') or ''):
+            if len(data) != 1:
+                return _error(
+                    406, "PGRST116", "JSON object requested, multiple (or no) rows returned",
+                    f"The result contains {len(data)} rows"
+                )
+            return JSONResponse(data[0], status_code=status, headers=headers)
+        return JSONResponse(data, status_code=status, headers=headers)
+
+    # ========== Escrita ==========
+
+    def handle_insert(self, table: str, request: Request, payload: Any) -> Response:
+        rows = payload if isinstance(payload, list) else [payload]
+        prefer = request.headers.get('prefer') or ''
+        stored = self.table(table)
+        result = []
+
+        if 'resolution=' in prefer:
+            conflict = (request.query_params.get('on_conflict') or 'id').split(',')
+            ignore = 'resolution=ignore-duplicates' in prefer
+            for row in rows:
+                existing = next(
+                    (r for r in stored if all(r.get(c) == row.get(c) for c in conflict)), None
+                ) if all(c in row for c in conflict) else None
+                if existing is None:
+                    existing = self._with_defaults(row)
+                    stored.append(existing)
+                elif not ignore:
+                    existing.update(row)
+                else:
+                    continue
+                result.append(dict(existing))
+        else:
+            for row in rows:
+                row = self._with_defaults(row)
+                stored.append(row)
+                result.append(dict(row))
+
+        if 'return=minimal' in prefer:
+            return Response(status_code=201)
+        return self._respond(request, self._project(result, request.query_params.get('select')), status=201)
+
+    def handle_update(self, table: str, request: Request, payload: Dict[str, Any]) -> Response:
+        rows = self._filtered(table, self._filters(request))
+        for row in rows:
+            row.update(payload)
+        return self._respond(request, self._project(rows, request.query_params.get('select')))
+
+    def handle_delete(self, table: str, request: Request) -> Response:
+        filters = self._filters(request)
+        stored = self.table(table)
+        deleted = [row for row in stored if self._row_matches(row, filters)]
+        if deleted:
+            deleted_ids = {id(row) for row in deleted}
+            self.tables[table] = [row for row in stored if id(row) not in deleted_ids]
+        return self._respond(request, self._project(deleted, request.query_params.get('select')))
+
+
+# ========== RPCs ==========
+
+def _rpc_increment_campaign_counter(db: FakePostgrest, params: Dict[str, Any]) -> None:
+    for row in db.table('campaigns'):
+        if row.get('id') == params['p_campaign_id']:
+            field = params['p_field']
+            row[field] = (row.get(field) or 0) + params.get('p_amount', 1)
+
+
+def _rpc_increment_quota(db: FakePostgrest, params: Dict[str, Any]) -> None:
+    for row in db.table('user_quotas'):
+        if row.get('user_id') == params['p_user_id']:
+            field = params['p_field']
+            row[field] = (row.get(field) or 0) + params.get('p_amount', 1)
+
+
+def _rpc_increment_quota_batch(db: FakePostgrest, params: Dict[str, Any]) -> None:
+    for item in params.get('p_items') or []:
+        _rpc_increment_quota(db, {
+            'p_user_id': item['user_id'],
+            'p_field': item['field'],
+            'p_amount': item['amount']
+        })
+
+
+def _rpc_claim_email_outbox(db: FakePostgrest, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    now = datetime.utcnow()
+    cutoff = (now - timedelta(seconds=params['p_lease_seconds'])).isoformat()
+    due = [
+        row for row in db.table('email_outbox')
+        if row.get('status') == 'pending'
+        or (row.get('status') == 'queued' and str(row.get('updated_at') or '') < cutoff)
+    ]
+    due.sort(key=lambda row: row.get('created_at') or '')
+    claimed = due[:params['p_limit']]
+    for row in claimed:
+        row.update(status='queued', updated_at=now.isoformat())
+    return [dict(row) for row in claimed]
+
+
+def _delete_where(db: FakePostgrest, table: str, predicate) -> int:
+    rows = db.table(table)
+    kept = [row for row in rows if not predicate(row)]
+    deleted = len(rows) - len(kept)
+    rows[:] = kept
+    return deleted
+
+
+def _rpc_delete_campaigns_cascade(db: FakePostgrest, params: Dict[str, Any]) -> Dict[str, int]:
+    ids = set(params.get('p_campaign_ids') or [])
+    return {
+        'message_logs': _delete_where(db, 'message_logs', lambda row: row.get('campaign_id') in ids),
+        'campaign_contacts': _delete_where(db, 'campaign_contacts', lambda row: row.get('campaign_id') in ids),
+        'campaigns': _delete_where(db, 'campaigns', lambda row: row.get('id') in ids),
+    }
+
+
+def _rpc_delete_user_cascade(db: FakePostgrest, params: Dict[str, Any]) -> Dict[str, int]:
+    user_id = params['p_user_id']
+    campaign_ids = [row['id'] for row in db.table('campaigns') if row.get('user_id') == user_id]
+    counts = _rpc_delete_campaigns_cascade(db, {'p_campaign_ids': campaign_ids})
+    for table in ('user_quotas', 'user_roles', 'leads', 'search_history', 'notifications'):
+        counts[table] = _delete_where(db, table, lambda row: row.get('user_id') == user_id)
+    counts['profiles'] = _delete_where(db, 'profiles', lambda row: row.get('id') == user_id)
+    return counts
+
+
+DEFAULT_RPCS = {
+    'increment_campaign_counter_atomic': _rpc_increment_campaign_counter,
+    'increment_quota_atomic': _rpc_increment_quota,
+    'increment_quota_batch': _rpc_increment_quota_batch,
+    'delete_campaigns_cascade': _rpc_delete_campaigns_cascade,
+    'delete_user_cascade': _rpc_delete_user_cascade,
+    'claim_email_outbox': _rpc_claim_email_outbox,
+}
+
+
+def create_app(db: Optional[FakePostgrest] = None) -> FastAPI:
+    db = db or FakePostgrest()
+    app = FastAPI(title="Fake PostgREST")
+    app.state.db = db
+
+    async def _delay():
+        if db.latency_ms > 0:
+            await asyncio.sleep(db.latency_ms / 1000)
+
+    @app.post("/rest/v1/rpc/{function}")
+    async def rpc(function: str, request: Request):
+        await _delay()
+        body = await request.body()
+        params = (await request.json()) if body else {}
+        with db.lock:
+            db.record("rpc", function)
+            handler = db.rpcs.get(function)
+            if handler is None:
+                return _error(
+                    404, "PGRST202", f"Could not find the function public.{function} in the schema cache"
+                )
+            result = handler(db, params)
+        if result is None:
+            return Response(status_code=204)
+        return JSONResponse(result)
+
+    @app.api_route("/rest/v1/{table}", methods=["GET", "HEAD", "POST", "PATCH", "DELETE"])
+    async def table_endpoint(table: str, request: Request):
+        await _delay()
+        method = request.method
+        payload = None
+        if method in ("POST", "PATCH"):
+            payload = await request.json()
+
+        operation = _OPERATIONS[method]
+        if operation == "insert" and "resolution=" in (request.headers.get('prefer') or ''):
+            operation = "upsert"
+
+        with db.lock:
+            db.record(table, operation)
+            if method in ("GET", "HEAD"):
+                return db.handle_read(table, request, head=method == "HEAD")
+            if method == "POST":
+                return db.handle_insert(table, request, payload)
+            if method == "PATCH":
+                return db.handle_update(table, request, payload)
+            return db.handle_delete(table, request)
+
+    @app.get("/__stats")
+    async def get_stats():
+        with db.lock:
+            return db.stats()
+
+    @app.post("/__reset")
+    async def reset():
+        with db.lock:
+            db.reset_stats()
+        return {"success": True}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake PostgREST em memória para testes de carga locais")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latência simulada por requisição")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(FakePostgrest(args.latency_ms)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == '__main__':
+    main()
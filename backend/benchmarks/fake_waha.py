@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Fake WAHA: servidor local que imita a API do WAHA usada pelo backend
+
+- Latência configurável (média + jitter), taxa de erro (HTTP 500) e
+  rate limit por sessão (token bucket, responde HTTP 429)
+- Sessões sempre WORKING; sendText/sendImage/sendFile devolvem um id de mensagem
+- GET /__stats e POST /__reset expõem/zeram os contadores
+
+Uso: python benchmarks/fake_waha.py --port 3001 --latency-ms 80 --jitter-ms 40 --error-rate 0.02 --rate-limit 20
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+@dataclass
+class FakeWahaConfig:
+    latency_ms: float = 50.0
+    jitter_ms: float = 20.0
+    error_rate: float = 0.0
+    # Envios por segundo por sessão (0 = sem limite)
+    rate_limit: float = 0.0
+    seed: Optional[int] = None
+
+
+class _TokenBucket:
+    __slots__ = ("rate", "tokens", "updated_at")
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated_at = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class FakeWaha:
+    """Estado do WAHA falso (sessões, contadores, limitador)"""
+
+    SEND_PATHS = {"/api/sendText", "/api/sendImage", "/api/sendFile"}
+
+    def __init__(self, config: Optional[FakeWahaConfig] = None):
+        self.config = config or FakeWahaConfig()
+        self._random = random.Random(self.config.seed)
+        self._buckets: Dict[str, _TokenBucket] = {}
+        self.sessions: Dict[str, str] = {}
+        self.requests: Counter = Counter()
+        self.responses: Counter = Counter()
+        self.messages_sent = 0
+
+    def reset(self) -> None:
+        self._buckets.clear()
+        self.requests.clear()
+        self.responses.clear()
+        self.messages_sent = 0
+
+    def stats(self) -> dict:
+        return {
+            "config": asdict(self.config),
+            "messages_sent": self.messages_sent,
+            "requests": dict(self.requests),
+            "responses": dict(self.responses),
+        }
+
+    async def delay(self) -> None:
+        latency = self.config.latency_ms + self._random.uniform(-1, 1) * self.config.jitter_ms
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+
+    def fail(self) -> bool:
+        return self.config.error_rate > 0 and self._random.random() < self.config.error_rate
+
+    def throttled(self, session: str) -> bool:
+        if self.config.rate_limit <= 0:
+            return False
+        bucket = self._buckets.get(session)
+        if bucket is None:
+            bucket = self._buckets[session] = _TokenBucket(self.config.rate_limit)
+        return not bucket.take()
+
+
+def create_app(waha: Optional[FakeWaha] = None) -> FastAPI:
+    waha = waha or FakeWaha()
+    app = FastAPI(title="Fake WAHA")
+    app.state.waha = waha
+
+    @app.middleware("http")
+    async def simulate(request: Request, call_next):
+        path = request.url.path
+        if path.startswith("/__"):
+            return await call_next(request)
+
+        waha.requests[path if path in waha.SEND_PATHS else f"{request.method} {path}"] += 1
+        await waha.delay()
+
+        if path in waha.SEND_PATHS:
+            try:
+                session = (await request.json()).get("session", "default")
+            except Exception:
+                session = "default"
+            if waha.throttled(session):
+                waha.responses["429"] += 1
+                return JSONResponse({"error": "Too Many Requests"}, status_code=429)
+
+        if waha.fail():
+            waha.responses["500"] += 1
+            return JSONResponse({"error": "Simulated failure"}, status_code=500)
+
+        response = await call_next(request)
+        waha.responses[str(response.status_code)] += 1
+        return response
+
+    # --- Sessões ---
+
+    @app.post("/api/sessions")
+    async def create_session(payload: dict):
+        name = payload.get("name", "default")
+        if name in waha.sessions:
+            return JSONResponse({"error": "Session already exists"}, status_code=409)
+        waha.sessions[name] = "STARTING"
+        return JSONResponse({"name": name, "status": "STARTING"}, status_code=201)
+
+    @app.post("/api/sessions/{session}/start")
+    async def start_session(session: str):
+        waha.sessions[session] = "WORKING"
+        return {"name": session, "status": "WORKING"}
+
+    @app.post("/api/sessions/{session}/stop")
+    async def stop_session(session: str):
+        waha.sessions[session] = "STOPPED"
+        return {"name": session, "status": "STOPPED"}
+
+    @app.post("/api/sessions/{session}/logout")
+    async def logout_session(session: str):
+        waha.sessions.pop(session, None)
+        return {"name": session, "status": "STOPPED"}
+
+    @app.get("/api/sessions/{session}")
+    async def get_session(session: str):
+        return {
+            "name": session,
+            "status": waha.sessions.get(session, "WORKING"),
+            "me": {"id": "5511999999999@c.us", "pushName": "Fake WAHA"}
+        }
+
+    @app.get("/api/screenshot")
+    async def screenshot(session: str = "default"):
+        return {"mimetype": "image/png", "data": ""}
+
+    @app.get("/api/contacts/check-exists")
+    async def check_exists(phone: str, session: str = "default"):
+        return {"numberExists": True, "chatId": f"{phone}@c.us"}
+
+    # --- Envio ---
+
+    def _sent(payload: dict) -> dict:
+        waha.messages_sent += 1
+        return {
+            "id": f"true_{payload.get('chatId', '')}_{uuid.uuid4().hex[:16].upper()}",
+            "timestamp": int(time.time()),
+            "ack": 1
+        }
+
+    @app.post("/api/sendText")
+    async def send_text(payload: dict):
+        return _sent(payload)
+
+    @app.post("/api/sendImage")
+    async def send_image(payload: dict):
+        return _sent(payload)
+
+    @app.post("/api/sendFile")
+    async def send_file(payload: dict):
+        return _sent(payload)
+
+    # --- Controle ---
+
+    @app.get("/__stats")
+    async def get_stats():
+        return waha.stats()
+
+    @app.post("/__reset")
+    async def reset():
+        waha.reset()
+        return {"success": True}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake WAHA para testes de carga locais")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3001)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="envios/s por sessão (0 = sem limite)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    import uvicorn
+    config = FakeWahaConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        seed=args.seed
+    )
+    uvicorn.run(create_app(FakeWaha(config)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Campaign Control
+Canal de controle dos workers de campanha (pausar / cancelar / excluir)
+
+- Cada worker registra um CampaignSignal (asyncio.Event + status) e faz todas as
+  esperas (intervalo entre mensagens, janela de horário, limite diário) por ele:
+  um sinal acorda o worker na hora, sem consultar campaigns.status em loop
+- Os endpoints sinalizam o worker local via stop_campaign_worker
+- Várias réplicas: mudanças em campaigns via Supabase Realtime (UPDATE para status
+  diferente de running, DELETE) sinalizam os workers desta réplica. A cada
+  (re)conexão, uma única consulta confere o status das campanhas locais
+- Fallback: a mesma consulta roda a cada CAMPAIGN_STATUS_POLL_INTERVAL segundos
+  enquanto o Realtime está desligado/desconectado, e com intervalo maior
+  (CAMPAIGN_STATUS_POLL_INTERVAL_CONNECTED) mesmo conectado, caso a tabela não
+  esteja publicada
+"""
+import os
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from realtime_listener import get_realtime_listener
+
+logger = logging.getLogger(__name__)
+
+
+class CampaignSignal:
+    """Sinal de parada de um worker"""
+    __slots__ = ('event', 'status')
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.status: Optional[str] = None
+
+    @property
+    def stopped(self) -> bool:
+        return self.event.is_set()
+
+    def set(self, status: str) -> None:
+        if not self.event.is_set():
+            self.status = status
+            self.event.set()
+
+
+class CampaignControl:
+    """Registro de sinais por campanha + listener Realtime opcional"""
+
+    def __init__(self):
+        self._signals: Dict[str, CampaignSignal] = {}
+        self.poll_interval = float(os.getenv('CAMPAIGN_STATUS_POLL_INTERVAL', '15'))
+        self.connected_poll_interval = float(os.getenv('CAMPAIGN_STATUS_POLL_INTERVAL_CONNECTED', '60'))
+        self._poller: Optional[asyncio.Task] = None
+        self.signals_sent = 0
+        self.remote_signals = 0
+        self.polled_signals = 0
+
+    # ========== Sinais ==========
+
+    def register(self, campaign_id: str) -> CampaignSignal:
+        signal = CampaignSignal()
+        self._signals[campaign_id] = signal
+        return signal
+
+    def unregister(self, campaign_id: str, signal: CampaignSignal) -> None:
+        # Um worker novo da mesma campanha pode já ter registrado outro sinal
+        if self._signals.get(campaign_id) is signal:
+            del self._signals[campaign_id]
+
+    def signal(self, campaign_id: str, status: str) -> bool:
+        """Pede a parada do worker local da campanha; False se não há worker aqui"""
+        signal = self._signals.get(campaign_id)
+        if signal is None:
+            return False
+        signal.set(status)
+        self.signals_sent += 1
+        return True
+
+    @staticmethod
+    async def sleep(signal: CampaignSignal, seconds: float) -> bool:
+        """Espera `seconds` ou até o sinal; True se o worker deve parar"""
+        if signal.stopped:
+            return True
+        try:
+            await asyncio.wait_for(signal.event.wait(), timeout=max(0.0, seconds))
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    # ========== Várias réplicas (Supabase Realtime) ==========
+
+    def start(self) -> None:
+        """Registra as assinaturas no listener Realtime (iniciado pelo servidor) e o fallback"""
+        listener = get_realtime_listener()
+        listener.on_change('campaigns', ['UPDATE'], self._on_change, filter='status=neq.running')
+        listener.on_change('campaigns', ['DELETE'], self._on_change)
+        listener.on_connect(self._reconcile)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self) -> None:
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+    async def _poll(self) -> None:
+        listener = get_realtime_listener()
+        while True:
+            connected = listener.is_subscribed('campaigns')
+            await asyncio.sleep(self.connected_poll_interval if connected else self.poll_interval)
+            try:
+                self.polled_signals += await self._reconcile()
+            except Exception as e:
+                logger.warning(f"⚠️ Não foi possível conferir o status das campanhas: {e}")
+
+    def _on_change(self, event_type: str, record: Dict[str, Any], old_record: Dict[str, Any]) -> None:
+        if event_type == 'DELETE':
+            campaign_id, status = old_record.get('id'), 'deleted'
+        else:
+            campaign_id, status = record.get('id'), record.get('status')
+        if campaign_id and status and status != 'running' and self.signal(campaign_id, status):
+            self.remote_signals += 1
+            logger.info(f"📡 Campanha {campaign_id} mudou para {status} em outra réplica - parando worker")
+
+    async def _reconcile(self) -> int:
+        """Status atual das campanhas com worker local; devolve quantos workers foram sinalizados"""
+        campaign_ids = list(self._signals)
+        if not campaign_ids:
+            return 0
+        from supabase_service import get_supabase_service
+        result = get_supabase_service().client.table('campaigns')\
+            .select('id, status')\
+            .in_('id', campaign_ids)\
+            .execute()
+        found = {row['id']: row.get('status') for row in (result.data or [])}
+        signaled = 0
+        for campaign_id in campaign_ids:
+            status = found.get(campaign_id, 'deleted')
+            signal = self._signals.get(campaign_id)
+            if status != 'running' and signal is not None and not signal.stopped:
+                self.signal(campaign_id, status)
+                signaled += 1
+                logger.info(f"🔎 Campanha {campaign_id} está {status} no banco - parando worker")
+        return signaled
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._signals),
+            "signals_sent": self.signals_sent,
+            "remote_signals": self.remote_signals,
+            "polled_signals": self.polled_signals
+        }
+
+
+# Singleton global
+_campaign_control: Optional[CampaignControl] = None
+
+
+def get_campaign_control() -> CampaignControl:
+    """Retorna instância singleton do CampaignControl"""
+    global _campaign_control
+    if _campaign_control is None:
+        _campaign_control = CampaignControl()
+    return _campaign_control
@@ -1,38 +1,34 @@
+import os
 import asyncio
 import logging
 import random
-from datetime import datetime, time, timedelta
-from typing import Optional, Dict, Any
+from datetime import datetime, time, timedelta, timezone
+from typing import Optional, Dict, Any, List
 from zoneinfo import ZoneInfo
 import pytz # Importante para conversão segura
 
 from models import (
     CampaignStatus, ContactStatus, MessageType, CampaignSettings
 )
-from waha_service import WahaService, replace_variables
+from waha_service import WahaService, compile_template
 from supabase_service import SupabaseService
 from email_service import get_email_service
+from event_bus import get_event_bus, publish_campaign_status
+from metrics import CAMPAIGN_WORKERS_ACTIVE, CAMPAIGN_MESSAGES
+from campaign_control import get_campaign_control
+from company_context import get_company_context
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
 # Global dict to track running campaigns with thread-safe access
 _campaigns_lock = asyncio.Lock()
 running_campaigns: Dict[str, asyncio.Task] = {}
+CAMPAIGN_WORKERS_ACTIVE.set_function(lambda: sum(1 for task in running_campaigns.values() if not task.done()))
 
 # Constants
-WAIT_CHECK_INTERVAL = 60  # seconds
-MAX_WAIT_CYCLES = 1440  # 24 hours (1440 minutes)
-
-
-def get_campaign_timezone(company_settings: dict) -> ZoneInfo:
-    """Get timezone for campaign based on company settings"""
-    # Pega o timezone configurado na empresa ou usa SP como padrão
-    tz_name = company_settings.get("timezone", "America/Sao_Paulo")
-    try:
-        return ZoneInfo(tz_name)
-    except Exception:
-        logger.warning(f"Invalid timezone {tz_name}, using America/Sao_Paulo")
-        return ZoneInfo("America/Sao_Paulo")
+# Tempo para o worker terminar o envio em andamento antes de ser cancelado
+STOP_GRACE_SECONDS = float(os.getenv('CAMPAIGN_STOP_GRACE_SECONDS', '10'))
 
 
 def sanitize_error_message(error_msg: str, max_length: int = 200) -> str:
@@ -61,48 +57,141 @@ def sanitize_error_message(error_msg: str, max_length: int = 200) -> str:
     return error_msg
 
 
+# Frontend envia: 0=Domingo, 1=Segunda, ..., 6=Sábado (padrão JavaScript)
+# Python weekday(): 0=Segunda, ..., 6=Domingo
+JS_TO_PYTHON_DAY = {0: 6, 1: 0, 2: 1, 3: 2, 4: 3, 5: 4, 6: 5}
+
+
+def _local_to_utc(local: datetime, tz: ZoneInfo) -> datetime:
+    """
+    Primeiro instante (UTC) em que o relógio local de `tz` marca `local` ou mais.
+    Horário repetido (fim do horário de verão): primeira ocorrência.
+    Horário inexistente (início do horário de verão): o instante da mudança.
+    """
+    first, second = sorted(
+        local.replace(tzinfo=tz, fold=fold).astimezone(timezone.utc) for fold in (0, 1)
+    )
+    if first.astimezone(tz).replace(tzinfo=None) == local:
+        return first
+    # Lacuna: busca binária pelo instante em que o relógio pula para depois de `local`
+    while (second - first) > timedelta(seconds=1):
+        middle = first + (second - first) / 2
+        if middle.astimezone(tz).replace(tzinfo=None) >= local:
+            second = middle
+        else:
+            first = middle
+    return second
+
+
+class WorkingSchedule:
+    """
+    Janela de envio de uma campanha, compilada uma vez por worker.
+
+    Dia útil D: aberto entre start_time e end_time (inclusive) de D; se a janela
+    cruza a meia-noite (ex.: 22:00-02:00), D fica aberto de 00:00 a end_time e de
+    start_time até 24:00. Sem horário configurado, o dia inteiro. Horário inválido
+    deixa sempre aberto (fail safe).
+    """
+
+    def __init__(
+        self,
+        tz: ZoneInfo,
+        working_days: List[int],
+        start: Optional[time] = None,
+        end: Optional[time] = None
+    ):
+        self.tz = tz
+        self.weekdays = frozenset(JS_TO_PYTHON_DAY.get(d, d) for d in working_days)
+        self.start = start
+        self.end = end
+        # Horários de abertura em cada dia útil
+        if start is None or end is None:
+            self._openings = (time(0, 0),)
+        elif start <= end:
+            self._openings = (start,)
+        else:
+            self._openings = (time(0, 0), start)
+
+    @classmethod
+    def from_settings(cls, settings: dict, tz: ZoneInfo) -> "WorkingSchedule":
+        working_days = settings.get("working_days", [1, 2, 3, 4, 5])  # Default: Seg-Sex em JS
+        start_time_str = settings.get("start_time")
+        end_time_str = settings.get("end_time")
+        if start_time_str and end_time_str:
+            try:
+                start = datetime.strptime(start_time_str, "%H:%M").time()
+                end = datetime.strptime(end_time_str, "%H:%M").time()
+                return cls(tz, working_days, start, end)
+            except ValueError as e:
+                logger.warning(f"Invalid time format in settings: {e}")
+                return cls(tz, list(JS_TO_PYTHON_DAY))  # Fail safe: allow sending
+        return cls(tz, working_days)
+
+    def is_open(self, now: Optional[datetime] = None) -> bool:
+        """Check if current time is within working hours - timezone aware"""
+        now = (now or datetime.now(timezone.utc)).astimezone(self.tz)
+        if now.weekday() not in self.weekdays:
+            return False
+        if self.start is None or self.end is None:
+            return True
+
+        current_time = now.time()
+        if self.start <= self.end:
+            # Normal hours (e.g., 09:00 to 18:00)
+            return self.start <= current_time <= self.end
+        # Crosses midnight (e.g., 22:00 to 02:00)
+        return current_time >= self.start or current_time <= self.end
+
+    def next_opening(self, now: Optional[datetime] = None) -> Optional[datetime]:
+        """Próxima abertura da janela depois de `now` (no fuso da campanha); None se nunca abre"""
+        now_utc = (now or datetime.now(timezone.utc)).astimezone(timezone.utc)
+        today = now_utc.astimezone(self.tz).date()
+        for offset in range(8):
+            day = today + timedelta(days=offset)
+            if day.weekday() not in self.weekdays:
+                continue
+            for opening in self._openings:
+                candidate = _local_to_utc(datetime.combine(day, opening), self.tz)
+                if candidate > now_utc:
+                    return candidate.astimezone(self.tz)
+        return None
+
+
 def is_within_working_hours(settings: dict, campaign_tz: ZoneInfo) -> bool:
     """Check if current time is within working hours - timezone aware"""
-    # Pega a hora atual no fuso da empresa
-    now = datetime.now(campaign_tz)
-    
-    # Check working days
-    # Frontend envia: 0=Domingo, 1=Segunda, ..., 6=Sábado (padrão JavaScript)
-    # Python weekday(): 0=Segunda, ..., 6=Domingo
-    # Precisamos converter: JS Sunday(0) -> Python Sunday(6), etc.
-    working_days_js = settings.get("working_days", [1, 2, 3, 4, 5])  # Default: Seg-Sex em JS
-    
-    # Converter de JS (0=Dom) para Python (0=Seg)
-    js_to_python_day = {0: 6, 1: 0, 2: 1, 3: 2, 4: 3, 5: 4, 6: 5}
-    working_days_python = [js_to_python_day.get(d, d) for d in working_days_js]
-    
-    if now.weekday() not in working_days_python:
-        return False
-    
-    # Check time range
-    start_time_str = settings.get("start_time")
-    end_time_str = settings.get("end_time")
-    
-    if start_time_str and end_time_str:
-        try:
-            start = datetime.strptime(start_time_str, "%H:%M").time()
-            end = datetime.strptime(end_time_str, "%H:%M").time()
-            current_time = now.time()
-            
-            if start <= end:
-                # Normal hours (e.g., 09:00 to 18:00)
-                is_time = start <= current_time <= end
-            else:
-                # Crosses midnight (e.g., 22:00 to 02:00)
-                is_time = current_time >= start or current_time <= end
-            
-            return is_time
+    return WorkingSchedule.from_settings(settings, campaign_tz).is_open()
 
-        except ValueError as e:
-            logger.warning(f"Invalid time format in settings: {e}")
-            return True # Fail safe: allow sending
-    
-    return True
+
+async def send_campaign_message(
+    waha_service: WahaService,
+    campaign_id: str,
+    cached_message: Dict[str, Any],
+    phone: str,
+    text: str
+) -> Dict[str, Any]:
+    """Send one campaign message through WAHA (traced as campaign.send)"""
+    message_type = cached_message["message_type"]
+    with span("campaign.send", {"campaign.id": campaign_id, "message.type": message_type}) as current:
+        if message_type == "text":
+            result = await waha_service.send_text_message(phone, text)
+        elif message_type == "image":
+            result = await waha_service.send_image_message(
+                phone,
+                text,
+                image_url=cached_message["media_url"]
+            )
+        elif message_type == "document":
+            result = await waha_service.send_document_message(
+                phone,
+                text,
+                document_url=cached_message["media_url"],
+                filename=cached_message["media_filename"] or "document"
+            )
+        else:
+            result = {"success": False, "error": "Unknown message type"}
+        if current is not None:
+            current.set_attribute("message.success", bool(result.get("success")))
+        return result
 
 
 async def process_campaign(
@@ -113,8 +202,10 @@ async def process_campaign(
     """Process a campaign - send messages to all pending contacts"""
     logger.info(f"Starting campaign worker for campaign {campaign_id}")
     
-    wait_cycles = 0
     campaign_tz = None
+    # Pausar/cancelar/excluir chegam por este sinal (sem consultar o status a cada iteração)
+    control = get_campaign_control()
+    stop_signal = control.register(campaign_id)
     
     try:
         # 1. Fetch campaign data once at start
@@ -123,13 +214,12 @@ async def process_campaign(
             logger.error(f"Campaign {campaign_id} not found")
             return
         
-        # 2. Fetch Company Settings (Timezone)
+        # 2. Contexto da empresa (cache: timezone já como ZoneInfo)
         company_id = campaign_data.get('company_id')
-        # Usa o novo método que criamos no supabase_service
-        company_settings = await db.get_company_settings_with_timezone(company_id)
+        company_context = await get_company_context(company_id)
         
         # 3. Define timezone da campanha (usa timezone da empresa)
-        campaign_tz = get_campaign_timezone(company_settings)
+        campaign_tz = company_context.timezone
         logger.info(f"Campaign {campaign_id} (Company {company_id}) using timezone: {campaign_tz}")
         
         # Cache settings that don't change
@@ -141,6 +231,7 @@ async def process_campaign(
             "interval_min": campaign_data.get("interval_min", 30),
             "interval_max": campaign_data.get("interval_max", 60)
         }
+        schedule = WorkingSchedule.from_settings(settings, campaign_tz)
 
         # Cache message template data (doesn't change during campaign execution)
         cached_message = {
@@ -149,50 +240,46 @@ async def process_campaign(
             "media_url": campaign_data.get("media_url"),
             "media_filename": campaign_data.get("media_filename"),
         }
+        compiled_message = compile_template(cached_message["message_text"])
+
+        # Local mirror of campaign counters, pushed to SSE subscribers
+        event_bus = get_event_bus()
+        counters = {
+            "total_contacts": campaign_data.get("total_contacts", 0),
+            "sent_count": campaign_data.get("sent_count", 0),
+            "error_count": campaign_data.get("error_count", 0),
+            "pending_count": campaign_data.get("pending_count", 0),
+        }
 
         # Track daily count locally to reduce COUNT queries
         daily_sent_count = await db.count_messages_sent_today(campaign_id)
         daily_count_date = datetime.now(campaign_tz).date()
 
         while True:
-            # Check campaign status (lightweight query)
-            status_result = db.client.table('campaigns')\
-                .select('status, pending_count')\
-                .eq('id', campaign_id)\
-                .single()\
-                .execute()
-
-            if not status_result.data:
-                logger.error(f"Campaign {campaign_id} not found - stopping worker")
-                break
-
-            # Check if campaign should continue
-            if status_result.data.get("status") != "running":
-                logger.info(f"Campaign {campaign_id} is no longer running (status: {status_result.data.get('status')})")
+            if stop_signal.stopped:
+                logger.info(f"Campaign {campaign_id} is no longer running (status: {stop_signal.status})")
                 break
 
-            pending_count = status_result.data.get("pending_count", 0)
-
             # 4. Check working hours (Timezone Aware)
-            if not is_within_working_hours(settings, campaign_tz):
-                wait_cycles += 1
-
-                # Timeout after 24h waiting (prevent zombies)
-                if wait_cycles >= MAX_WAIT_CYCLES:
-                    logger.warning(f"Campaign {campaign_id} waited 24h outside working hours - pausing")
+            now = datetime.now(timezone.utc)
+            if not schedule.is_open(now):
+                opening = schedule.next_opening(now)
+                if opening is None:
+                    # Nenhum dia útil configurado: a janela nunca abre (prevent zombies)
+                    logger.warning(f"Campaign {campaign_id} has no working window - pausing")
                     await db.update_campaign(campaign_id, {"status": "paused"})
+                    publish_campaign_status(company_id, campaign_id, "paused")
                     break
 
-                # Log only every 60 cycles (1 hour) to reduce noise
-                if wait_cycles % 60 == 1:
-                    logger.info(f"Campaign {campaign_id} outside working hours ({campaign_tz}), waiting... ({wait_cycles}/{MAX_WAIT_CYCLES})")
-
-                await asyncio.sleep(300)
+                # Dorme até a abertura exata da janela e revalida o status ao acordar
+                wait = (opening - now).total_seconds()
+                logger.info(
+                    f"Campaign {campaign_id} outside working hours ({campaign_tz}), "
+                    f"sleeping until {opening.isoformat(timespec='seconds')} ({wait:.0f}s)"
+                )
+                await control.sleep(stop_signal, wait)
                 continue
 
-            # Reset wait cycles when inside working hours
-            wait_cycles = 0
-
             # Check daily limit (using local counter, refresh from DB only on date change)
             current_date = datetime.now(campaign_tz).date()
             if current_date != daily_count_date:
@@ -208,21 +295,9 @@ async def process_campaign(
                 tomorrow = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
                 seconds_until_tomorrow = (tomorrow - now).total_seconds()
 
-                # Wait in chunks
-                chunks = int(seconds_until_tomorrow / WAIT_CHECK_INTERVAL)
-                for _ in range(max(chunks, 1)):
-                    await asyncio.sleep(WAIT_CHECK_INTERVAL)
-
-                    # Re-check status
-                    status_check = db.client.table('campaigns')\
-                        .select('status')\
-                        .eq('id', campaign_id)\
-                        .single()\
-                        .execute()
-
-                    if not status_check.data or status_check.data.get("status") != "running":
-                        logger.info(f"Campaign {campaign_id} status changed during daily limit wait")
-                        return
+                if await control.sleep(stop_signal, seconds_until_tomorrow):
+                    logger.info(f"Campaign {campaign_id} status changed during daily limit wait")
+                    return
 
                 # Reset daily counter after waiting for next day
                 daily_sent_count = 0
@@ -239,6 +314,7 @@ async def process_campaign(
                     "completed_at": datetime.now(campaign_tz).isoformat()
                 })
                 logger.info(f"Campaign {campaign_id} completed - all contacts processed")
+                publish_campaign_status(company_id, campaign_id, "completed")
 
                 # ENVIAR EMAIL DE CONCLUSÃO
                 try:
@@ -281,32 +357,12 @@ async def process_campaign(
                 **(extra_data if isinstance(extra_data, dict) else {})
             }
 
-            final_message = replace_variables(cached_message["message_text"], message_data)
+            final_message = compiled_message.render(message_data)
 
             # Send message based on type
-            message_type = cached_message["message_type"]
-            result: Dict[str, Any]
-
-            if message_type == "text":
-                result = await waha_service.send_text_message(
-                    contact_data["phone"],
-                    final_message
-                )
-            elif message_type == "image":
-                result = await waha_service.send_image_message(
-                    contact_data["phone"],
-                    final_message,
-                    image_url=cached_message["media_url"]
-                )
-            elif message_type == "document":
-                result = await waha_service.send_document_message(
-                    contact_data["phone"],
-                    final_message,
-                    document_url=cached_message["media_url"],
-                    filename=cached_message["media_filename"] or "document"
-                )
-            else:
-                result = {"success": False, "error": "Unknown message type"}
+            result = await send_campaign_message(
+                waha_service, campaign_id, cached_message, contact_data["phone"], final_message
+            )
 
             # Update contact status
             now_iso = datetime.now(campaign_tz).isoformat()
@@ -318,7 +374,9 @@ async def process_campaign(
                 # Atomic counter increments (no read-then-write race condition)
                 await db.increment_campaign_counter(campaign_id, "sent_count", 1)
                 await db.increment_campaign_counter(campaign_id, "pending_count", -1)
+                counters["sent_count"] += 1
                 daily_sent_count += 1
+                CAMPAIGN_MESSAGES.labels("sent").inc()
                 logger.info(f"Message sent to {contact_data['phone']} successfully")
             else:
                 new_status = "error"
@@ -330,6 +388,8 @@ async def process_campaign(
                 # Atomic counter increments
                 await db.increment_campaign_counter(campaign_id, "error_count", 1)
                 await db.increment_campaign_counter(campaign_id, "pending_count", -1)
+                counters["error_count"] += 1
+                CAMPAIGN_MESSAGES.labels("failed").inc()
 
             # Update contact
             await db.update_contact(contact_data["id"], {
@@ -351,17 +411,23 @@ async def process_campaign(
             }
             await db.create_message_log(log_data)
 
+            counters["pending_count"] = max(counters["pending_count"] - 1, 0)
+            event_bus.publish_to_company(company_id, "campaign_progress", {
+                "campaign_id": campaign_id,
+                **counters
+            })
+
             # Wait for random interval only if there are more contacts
-            if pending_count > 1:
+            if counters["pending_count"] > 0:
                 interval = random.randint(
                     settings.get("interval_min", 30),
                     settings.get("interval_max", 60)
                 )
-                logger.info(f"Waiting {interval} seconds before next message... ({pending_count - 1} remaining)")
-                await asyncio.sleep(interval)
+                logger.info(f"Waiting {interval} seconds before next message... ({counters['pending_count']} remaining)")
+                await control.sleep(stop_signal, interval)
             else:
                 logger.info("Last message sent, campaign will complete in next iteration")
-    
+
     except asyncio.CancelledError:
         logger.info(f"Campaign {campaign_id} worker cancelled")
         raise  # Re-raise to be handled in finally
@@ -375,6 +441,7 @@ async def process_campaign(
             
             campaign = await db.get_campaign(campaign_id)
             if campaign:
+                publish_campaign_status(campaign.get("company_id"), campaign_id, "paused")
                 await db.create_notification(
                     user_id=campaign.get("user_id"),
                     company_id=campaign.get("company_id"),
@@ -386,6 +453,7 @@ async def process_campaign(
         except Exception as notification_error:
             logger.error(f"Failed to create error notification: {notification_error}")
     finally:
+        control.unregister(campaign_id, stop_signal)
         # Always remove from tracking, even in case of error
         async with _campaigns_lock:
             if campaign_id in running_campaigns:
@@ -419,8 +487,13 @@ async def start_campaign_worker(
     return True, None
 
 
-async def stop_campaign_worker(campaign_id: str) -> bool:
-    """Stop a campaign worker task - thread-safe"""
+async def stop_campaign_worker(campaign_id: str, status: str = "stopped") -> bool:
+    """
+    Stop a campaign worker task - thread-safe
+
+    Sinaliza o worker (que para na próxima espera, sem interromper um envio em
+    andamento) e só cancela a task se ela não terminar em STOP_GRACE_SECONDS.
+    """
     task = None
     
     async with _campaigns_lock:
@@ -428,10 +501,18 @@ async def stop_campaign_worker(campaign_id: str) -> bool:
             return False
         
         task = running_campaigns[campaign_id]
-        task.cancel()
+        get_campaign_control().signal(campaign_id, status)
     
     try:
-        await task
+        await asyncio.wait_for(asyncio.shield(task), timeout=STOP_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error while stopping campaign {campaign_id}: {e}")
     except asyncio.CancelledError:
         pass
     except Exception as e:
@@ -8,7 +8,6 @@ sys.path.append('/app/backend')
 
 import os
 from dotenv import load_dotenv
-from supabase import create_client
 import asyncio
 
 load_dotenv('/app/backend/.env')
@@ -20,29 +19,27 @@ if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
     print("❌ Erro: SUPABASE_URL e SUPABASE_SERVICE_ROLE_KEY devem estar configurados")
     sys.exit(1)
 
-# Cliente com service_role (tem acesso a auth.users)
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-
-
-def get_auth_users():
-    """Busca todos os usuários de auth.users"""
-    try:
-        # Listar usuários do Auth (paginação manual se necessário)
-        response = supabase.auth.admin.list_users()
-        return response if isinstance(response, list) else []
-    except Exception as e:
-        print(f"❌ Erro ao buscar usuários do Auth: {e}")
-        return []
-
-
-def get_profile_user_ids():
-    """Busca todos os IDs de profiles"""
-    try:
-        result = supabase.table('profiles').select('id').execute()
-        return set([p['id'] for p in result.data]) if result.data else set()
-    except Exception as e:
-        print(f"❌ Erro ao buscar profiles: {e}")
-        return set()
+# Mesmo reconciliador dos endpoints admin (pagina auth.users, compara com profiles
+# em blocos e remove com concorrência limitada); o job fica registrado em admin_jobs
+from orphan_reconciler import get_orphan_reconciler
+
+
+async def run_job(dry_run):
+    """Executa um job de reconciliação mostrando o progresso"""
+    reconciler = get_orphan_reconciler()
+    job = await reconciler.start(dry_run=dry_run)
+    waiter = asyncio.ensure_future(reconciler.wait())
+    while not waiter.done():
+        await asyncio.wait([waiter], timeout=2)
+        progress = job['progress']
+        print(
+            f"   ... página {job['checkpoint'].get('page')} | "
+            f"{progress['users_scanned']} usuários | {progress['orphans_found']} órfãos | "
+            f"{progress['orphans_deleted']} deletados",
+            end='\r'
+        )
+    print()
+    return job
 
 
 def find_orphan_users():
@@ -52,87 +49,62 @@ def find_orphan_users():
     print("=" * 70)
     print()
     
-    # Buscar usuários do auth
-    print("📋 Buscando usuários de auth.users...")
-    auth_users = get_auth_users()
-    print(f"   Total em auth.users: {len(auth_users)}")
-    
-    # Buscar IDs de profiles
-    print("📋 Buscando usuários de profiles...")
-    profile_ids = get_profile_user_ids()
-    print(f"   Total em profiles: {len(profile_ids)}")
+    job = asyncio.run(run_job(dry_run=True))
+    if job['status'] != 'completed':
+        print(f"❌ Busca terminou com status {job['status']}: {job.get('error')}")
+        sys.exit(1)
+    print(f"   Total verificado em auth.users: {job['progress']['users_scanned']}")
     print()
-    
-    # Encontrar órfãos
-    orphans = []
-    for user in auth_users:
-        user_id = user.id if hasattr(user, 'id') else user.get('id')
-        if user_id not in profile_ids:
-            orphans.append(user)
-    
-    return orphans
+    return job
 
 
-def display_orphans(orphans):
+def display_orphans(job):
     """Exibe lista de usuários órfãos"""
+    orphans = job['result']['orphans']
     if not orphans:
         print("✅ Nenhum usuário órfão encontrado!")
         print("   O banco está limpo.")
         return
     
     print("=" * 70)
-    print(f"⚠️  ENCONTRADOS {len(orphans)} USUÁRIOS ÓRFÃOS")
+    print(f"⚠️  ENCONTRADOS {job['progress']['orphans_found']} USUÁRIOS ÓRFÃOS")
     print("=" * 70)
     print()
     print("Estes usuários existem em auth.users mas NÃO em profiles:")
     print()
     
     for i, user in enumerate(orphans, 1):
-        user_id = user.id if hasattr(user, 'id') else user.get('id')
-        email = user.email if hasattr(user, 'email') else user.get('email', 'N/A')
-        created_at = user.created_at if hasattr(user, 'created_at') else user.get('created_at', 'N/A')
-        
-        print(f"{i}. Email: {email}")
-        print(f"   ID: {user_id}")
-        print(f"   Criado em: {created_at}")
+        print(f"{i}. Email: {user['email']}")
+        print(f"   ID: {user['id']}")
+        print(f"   Criado em: {user['created_at']}")
+        print()
+    if job['result']['truncated']:
+        print(f"   ... lista truncada em {len(orphans)} usuários")
         print()
 
 
-def delete_orphan_users(orphans):
+def delete_orphan_users():
     """Deleta usuários órfãos de auth.users"""
-    if not orphans:
-        return 0
-    
     print("=" * 70)
     print("🗑️  DELETANDO USUÁRIOS ÓRFÃOS")
     print("=" * 70)
     print()
     
-    deleted_count = 0
-    failed_count = 0
-    
-    for user in orphans:
-        user_id = user.id if hasattr(user, 'id') else user.get('id')
-        email = user.email if hasattr(user, 'email') else user.get('email', 'N/A')
-        
-        try:
-            supabase.auth.admin.delete_user(user_id)
-            print(f"✅ Deletado: {email} (ID: {user_id})")
-            deleted_count += 1
-        except Exception as e:
-            print(f"❌ Erro ao deletar {email}: {e}")
-            failed_count += 1
+    job = asyncio.run(run_job(dry_run=False))
+    progress = job['progress']
     
     print()
     print("=" * 70)
     print("📊 RESUMO DA LIMPEZA")
     print("=" * 70)
-    print(f"✅ Deletados com sucesso: {deleted_count}")
-    if failed_count > 0:
-        print(f"❌ Falharam: {failed_count}")
+    print(f"✅ Deletados com sucesso: {progress['orphans_deleted']}")
+    if progress['delete_failures'] > 0:
+        print(f"❌ Falharam: {progress['delete_failures']}")
+    if job['status'] != 'completed':
+        print(f"⚠️  Job {job['id']} terminou com status {job['status']} (pode ser retomado pelo painel admin)")
     print()
     
-    return deleted_count
+    return progress['orphans_deleted']
 
 
 def main():
@@ -145,12 +117,12 @@ def main():
     print()
     
     # Buscar órfãos
-    orphans = find_orphan_users()
+    job = find_orphan_users()
     
     # Exibir lista
-    display_orphans(orphans)
+    display_orphans(job)
     
-    if not orphans:
+    if not job['result']['orphans']:
         return
     
     # Confirmar deleção
@@ -163,7 +135,7 @@ def main():
     
     if response.strip().upper() == "SIM":
         print()
-        deleted = delete_orphan_users(orphans)
+        deleted = delete_orphan_users()
         
         if deleted > 0:
             print("✅ Limpeza concluída com sucesso!")
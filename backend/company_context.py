@@ -0,0 +1,152 @@
+"""
+Company Context
+Contexto da empresa resolvido uma vez e reutilizado por workers e endpoints
+
+- timezone já como ZoneInfo, linha de company_settings, sessão/servidor WAHA e plano
+- LRU limitado com TTL (COMPANY_CONTEXT_CACHE_SIZE / COMPANY_CONTEXT_CACHE_TTL),
+  single-flight por empresa e métricas de acerto (cache_requests_total)
+- Invalidação por Supabase Realtime quando companies, company_settings ou
+  waha_configs mudam; o plano (user_quotas) se atualiza pelo TTL
+"""
+import os
+import logging
+from typing import Any, Dict, NamedTuple, Optional
+from zoneinfo import ZoneInfo
+
+from cache_utils import TTLCache, SingleFlight
+from metrics import record_cache
+from supabase_service import get_supabase_service
+from realtime_listener import get_realtime_listener
+from waha_session import WahaTarget, get_waha_session_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEZONE = "America/Sao_Paulo"
+
+# Plano da empresa = melhor plano entre os usuários dela
+_PLAN_RANK = {'avancado': 3, 'intermediario': 2, 'basico': 1}
+
+
+def resolve_timezone(tz_name: Optional[str]) -> ZoneInfo:
+    """ZoneInfo do timezone configurado, ou SP como padrão"""
+    try:
+        return ZoneInfo(tz_name or DEFAULT_TIMEZONE)
+    except Exception:
+        logger.warning(f"Invalid timezone {tz_name}, using {DEFAULT_TIMEZONE}")
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+class CompanyContext(NamedTuple):
+    company_id: str
+    name: Optional[str]
+    timezone: ZoneInfo
+    settings: Dict[str, Any]
+    waha: WahaTarget
+    plan: Optional[Dict[str, Any]]
+
+
+class CompanyContextCache:
+    """company_id -> CompanyContext"""
+
+    def __init__(self):
+        self._cache = TTLCache(
+            maxsize=int(os.getenv('COMPANY_CONTEXT_CACHE_SIZE', '5000')),
+            ttl=float(os.getenv('COMPANY_CONTEXT_CACHE_TTL', '300')),
+            name="company_context"
+        )
+        self._loading = SingleFlight()
+        self.loads = 0
+
+    async def get(self, company_id: str) -> CompanyContext:
+        context = self._cache.get(company_id)
+        record_cache("company_context", context is not None)
+        if context is not None:
+            return context
+        return await self._loading.run(company_id, lambda: self._load(company_id))
+
+    async def _load(self, company_id: str) -> CompanyContext:
+        self.loads += 1
+        db = get_supabase_service()
+
+        company: Dict[str, Any] = {}
+        try:
+            # '*': a coluna timezone é opcional (sem ela vale o padrão)
+            result = db.client.table('companies')\
+                .select('*')\
+                .eq('id', company_id)\
+                .limit(1)\
+                .execute()
+            if result.data:
+                company = result.data[0]
+        except Exception as e:
+            logger.error(f"Error fetching company {company_id}: {e}")
+
+        settings = await db.get_company_settings(company_id) or {}
+        waha = await get_waha_session_cache().resolve(company_id, company.get('name'))
+
+        plan = None
+        try:
+            result = db.client.table('user_quotas')\
+                .select('plan_type, plan_name, subscription_status, plan_expires_at')\
+                .eq('company_id', company_id)\
+                .execute()
+            if result.data:
+                plan = max(result.data, key=lambda quota: _PLAN_RANK.get(quota.get('plan_type'), 0))
+        except Exception as e:
+            logger.error(f"Error fetching company plan {company_id}: {e}")
+
+        context = CompanyContext(
+            company_id=company_id,
+            name=company.get('name'),
+            timezone=resolve_timezone(company.get('timezone')),
+            settings=settings,
+            waha=waha,
+            plan=plan
+        )
+        self._cache.set(company_id, context)
+        return context
+
+    def invalidate(self, company_id: Optional[str] = None) -> None:
+        """Descarta o contexto da empresa (ou todos, sem company_id)"""
+        if company_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(company_id)
+
+    def start(self) -> None:
+        """Registra a invalidação por mudanças em companies / company_settings / waha_configs"""
+        listener = get_realtime_listener()
+        listener.on_change('companies', ['UPDATE', 'DELETE'], self._on_company_change)
+        listener.on_change('company_settings', ['*'], self._on_settings_change)
+        # A sessão WAHA embutida no contexto também vem de waha_configs
+        listener.on_change('waha_configs', ['*'], self._on_settings_change)
+        listener.on_connect(self._on_reconnect)
+
+    def _on_company_change(self, event_type: str, record: Dict[str, Any], old_record: Dict[str, Any]) -> None:
+        self.invalidate(record.get('id') or old_record.get('id'))
+
+    def _on_settings_change(self, event_type: str, record: Dict[str, Any], old_record: Dict[str, Any]) -> None:
+        self.invalidate(record.get('company_id') or old_record.get('company_id'))
+
+    async def _on_reconnect(self) -> None:
+        self.invalidate()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._cache.stats(), "loads": self.loads, "loading": len(self._loading)}
+
+
+# Singleton global
+_company_context_cache: Optional[CompanyContextCache] = None
+
+
+def get_company_context_cache() -> CompanyContextCache:
+    """Retorna instância singleton do CompanyContextCache"""
+    global _company_context_cache
+    if _company_context_cache is None:
+        _company_context_cache = CompanyContextCache()
+    return _company_context_cache
+
+
+async def get_company_context(company_id: str) -> CompanyContext:
+    """Atalho para get_company_context_cache().get(company_id)"""
+    return await get_company_context_cache().get(company_id)
@@ -0,0 +1,280 @@
+"""
+Diagnostics
+Watchdog de bloqueio do event loop e profiler sob demanda
+
+- EventLoopWatchdog: uma tarefa no loop atualiza um heartbeat; uma thread
+  separada percebe quando ele para de andar por mais que o limite, captura a
+  stack da thread do loop (quem está bloqueando) e conta por call site
+- capture_profile(): perfil com tempo limitado do processo em execução
+    sampling  stacks amostradas por uma thread, no formato "collapsed"
+              (py-spy --format raw / flamegraph.pl / speedscope)
+    cprofile  cProfile na thread do loop (todas as corrotinas), pstats em texto
+"""
+import os
+import io
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from metrics import EVENT_LOOP_BLOCKS
+
+logger = logging.getLogger(__name__)
+
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _short_path(filename: str) -> str:
+    if filename.startswith(_BACKEND_DIR):
+        return os.path.relpath(filename, _BACKEND_DIR)
+    marker = 'site-packages' + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    return os.path.basename(filename)
+
+
+def _is_app_frame(filename: str) -> bool:
+    return filename.startswith(_BACKEND_DIR) and os.path.abspath(filename) != os.path.abspath(__file__)
+
+
+def _call_site(frame) -> str:
+    """Frame mais interno do próprio backend (ou o mais interno, se não houver)"""
+    innermost = frame
+    while frame is not None:
+        if _is_app_frame(frame.f_code.co_filename):
+            return f"{_short_path(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    code = innermost.f_code
+    return f"{_short_path(code.co_filename)}:{innermost.f_lineno} {code.co_name}"
+
+
+# ========== Watchdog ==========
+
+class EventLoopWatchdog:
+    """Detecta callbacks que bloqueiam o event loop e registra onde"""
+
+    def __init__(self):
+        self.enabled = os.getenv('EVENT_LOOP_WATCHDOG_ENABLED', 'true').lower() == 'true'
+        self.tick = float(os.getenv('EVENT_LOOP_WATCHDOG_TICK', '0.1'))
+        self.threshold = float(os.getenv('EVENT_LOOP_BLOCK_THRESHOLD', '0.3'))
+        self.stack_depth = int(os.getenv('EVENT_LOOP_WATCHDOG_STACK_DEPTH', '25'))
+
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # Evento capturado pela thread, ainda sem duração (o loop fecha ao acordar)
+        self._open_event: Optional[Dict[str, Any]] = None
+
+        self.blocks_total = 0
+        self.max_block = 0.0
+        self._sites: Dict[str, Dict[str, Any]] = {}
+        self._recent = deque(maxlen=int(os.getenv('EVENT_LOOP_WATCHDOG_HISTORY', '50')))
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    # --- Lado do event loop ---
+
+    async def _beat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.tick
+            await asyncio.sleep(self.tick)
+            lag = max(0.0, loop.time() - expected)
+            self._heartbeat = time.monotonic()
+            if self._open_event is not None:
+                self._close_event(lag)
+
+    def _close_event(self, lag: float) -> None:
+        with self._lock:
+            event, self._open_event = self._open_event, None
+            if event is None:
+                return
+            event['duration_ms'] = round(lag * 1000, 1)
+            site = self._sites[event['site']]
+            site['total_ms'] = round(site['total_ms'] + event['duration_ms'], 1)
+            site['max_ms'] = max(site['max_ms'], event['duration_ms'])
+            self.max_block = max(self.max_block, lag)
+
+    # --- Thread de vigilância ---
+
+    def _watch(self) -> None:
+        reported_heartbeat = None
+        while not self._stop.wait(self.tick / 2):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.tick
+            if stalled < self.threshold or heartbeat == reported_heartbeat:
+                continue
+            reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._record(frame, stalled)
+
+    def _record(self, frame, stalled: float) -> None:
+        site = _call_site(frame)
+        stack = traceback.format_stack(frame, limit=self.stack_depth)
+        event = {
+            'at': datetime.utcnow().isoformat(),
+            'site': site,
+            'duration_ms': None,
+            'stack': [line.rstrip() for line in stack],
+        }
+        with self._lock:
+            self.blocks_total += 1
+            entry = self._sites.setdefault(site, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_seen': None})
+            entry['count'] += 1
+            entry['last_seen'] = event['at']
+            self._recent.append(event)
+            self._open_event = event
+        EVENT_LOOP_BLOCKS.labels(site).inc()
+        logger.warning(
+            f"🐢 Event loop bloqueado há {stalled * 1000:.0f}ms em {site}\n" + ''.join(stack)
+        )
+
+    # --- Ciclo de vida ---
+
+    def start(self) -> None:
+        if not self.enabled or self.is_running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"🐕 Watchdog do event loop iniciado (limite {self.threshold * 1000:.0f}ms)")
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def stats(self, recent: int = 10) -> Dict[str, Any]:
+        with self._lock:
+            sites = sorted(self._sites.items(), key=lambda item: item[1]['count'], reverse=True)
+            return {
+                'running': self.is_running,
+                'threshold_ms': round(self.threshold * 1000, 1),
+                'blocks_total': self.blocks_total,
+                'max_block_ms': round(self.max_block * 1000, 1),
+                'sites': [{'site': site, **data} for site, data in sites],
+                'recent': list(self._recent)[-recent:] if recent else []
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.blocks_total = 0
+            self.max_block = 0.0
+            self._sites.clear()
+            self._recent.clear()
+
+
+# Singleton global
+_event_loop_watchdog: Optional[EventLoopWatchdog] = None
+
+
+def get_event_loop_watchdog() -> EventLoopWatchdog:
+    """Retorna instância singleton do EventLoopWatchdog"""
+    global _event_loop_watchdog
+    if _event_loop_watchdog is None:
+        _event_loop_watchdog = EventLoopWatchdog()
+    return _event_loop_watchdog
+
+
+# ========== Profiler ==========
+
+PROFILER_MODES = ('sampling', 'cprofile')
+PROFILER_MAX_SECONDS = float(os.getenv('PROFILER_MAX_SECONDS', '60'))
+
+_profile_lock = threading.Lock()
+
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        labels.append(f"{code.co_name} ({_short_path(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def _sample(stop: threading.Event, interval: float, thread_ids: Optional[set], samples: Counter) -> None:
+    own_id = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    while not stop.wait(interval):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or (thread_ids is not None and thread_id not in thread_ids):
+                continue
+            samples[f"{names.get(thread_id, thread_id)};{_collapse(frame)}"] += 1
+
+
+async def capture_profile(
+    seconds: float,
+    mode: str = 'sampling',
+    interval: float = 0.005,
+    all_threads: bool = False,
+    top: int = 60
+) -> str:
+    """
+    Perfila o processo por `seconds` e devolve o resultado em texto.
+
+    Raises:
+        ValueError: Modo ou duração inválidos
+        RuntimeError: Já existe um perfil em andamento
+    """
+    if mode not in PROFILER_MODES:
+        raise ValueError(f"Modo inválido: {mode} (use {', '.join(PROFILER_MODES)})")
+    if not 0 < seconds <= PROFILER_MAX_SECONDS:
+        raise ValueError(f"Duração deve estar entre 0 e {PROFILER_MAX_SECONDS:.0f}s")
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("Já existe um perfil em andamento")
+
+    try:
+        logger.info(f"🔬 Perfil {mode} iniciado ({seconds}s)")
+        if mode == 'cprofile':
+            import cProfile
+            import pstats
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(top)
+            return output.getvalue()
+
+        samples: Counter = Counter()
+        stop = threading.Event()
+        thread_ids = None if all_threads else {threading.get_ident()}
+        sampler = threading.Thread(
+            target=_sample, args=(stop, max(interval, 0.001), thread_ids, samples),
+            name="profiler-sampler", daemon=True
+        )
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+        return ''.join(f"{stack} {count}\n" for stack, count in samples.most_common())
+    finally:
+        _profile_lock.release()
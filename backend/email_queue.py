@@ -0,0 +1,312 @@
+"""
+Email Queue
+Fila assíncrona de emails com conexão SMTP reaproveitada
+
+- enqueue() é O(1) e não toca na rede (webhook e campaign_worker só enfileiram)
+- Um worker envia reutilizando a mesma conexão SMTP autenticada
+- Falhas são re-tentadas com backoff exponencial
+- Fila cheia ou desligamento do servidor: mensagens vão para a tabela email_outbox,
+  que é relida pelo worker (nada se perde em restart)
+- O outbox é lido com claim atômico (RPC claim_email_outbox): cada email vai para
+  uma única réplica; 'queued' só volta a ser lido depois de EMAIL_OUTBOX_LEASE
+"""
+import os
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class EmailQueue:
+    """Fila de saída de emails"""
+
+    def __init__(self, email_service):
+        self.email_service = email_service
+        self.max_size = int(os.getenv('EMAIL_QUEUE_SIZE', '500'))
+        self.max_retries = int(os.getenv('EMAIL_MAX_RETRIES', '4'))
+        self.retry_backoff = float(os.getenv('EMAIL_RETRY_BACKOFF', '2'))
+        self.idle_timeout = float(os.getenv('EMAIL_SMTP_IDLE_TIMEOUT', '60'))
+        self.outbox_poll_interval = float(os.getenv('EMAIL_OUTBOX_POLL_INTERVAL', '30'))
+        self.outbox_batch_size = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', '50'))
+        # Tempo até um email 'queued' de uma réplica que caiu ser lido de novo (s)
+        self.outbox_lease = int(os.getenv('EMAIL_OUTBOX_LEASE', '1800'))
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._smtp = None
+        self._smtp_last_used = 0.0
+        self.sent = 0
+        self.failed = 0
+
+    @property
+    def is_running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        if not self.email_service.is_configured:
+            logger.warning("📬 SMTP não configurado - fila de emails não iniciada")
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._worker = asyncio.create_task(self._run())
+        logger.info(f"📬 Fila de emails iniciada (capacidade {self.max_size})")
+
+    async def stop(self) -> None:
+        """Para o worker e salva no outbox o que ainda estiver na fila"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        remaining = []
+        while self._queue is not None and not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        # Mensagens vindas do outbox já estão persistidas: só liberam o claim
+        claimed = [m['outbox_id'] for m in remaining if m.get('outbox_id')]
+        if claimed:
+            self._outbox_release(claimed)
+        remaining = [m for m in remaining if not m.get('outbox_id')]
+        if remaining:
+            await self._spill(remaining)
+            logger.info(f"📬 {len(remaining)} emails salvos no outbox no desligamento")
+
+        await self._close_connection()
+
+    async def enqueue(
+        self,
+        to_email: str,
+        subject: str,
+        html_body: str,
+        plain_body: Optional[str] = None
+    ) -> bool:
+        """Enfileira email para envio em background"""
+        message = {
+            'to_email': to_email,
+            'subject': subject,
+            'html_body': html_body,
+            'plain_body': plain_body,
+        }
+        if self._queue is None:
+            return await self._spill([message])
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            logger.warning("📬 Fila de emails cheia - salvando no outbox")
+            return await self._spill([message])
+
+    # ========== Worker ==========
+
+    async def _run(self) -> None:
+        await self._refill_from_outbox()
+        while True:
+            try:
+                message = await asyncio.wait_for(self._queue.get(), timeout=self.outbox_poll_interval)
+            except asyncio.TimeoutError:
+                await self._close_idle_connection()
+                await self._refill_from_outbox()
+                continue
+
+            try:
+                await self._deliver(message)
+            except asyncio.CancelledError:
+                if not message.get('outbox_id'):
+                    await self._spill([message])
+                raise
+            except Exception as e:
+                logger.error(f"❌ Erro inesperado no worker de emails: {e}", exc_info=True)
+
+            if self._queue.empty():
+                await self._close_idle_connection()
+                await self._refill_from_outbox()
+
+    async def _deliver(self, message: Dict[str, Any]) -> None:
+        mime = self.email_service.build_message(
+            message['to_email'],
+            message['subject'],
+            message['html_body'],
+            message.get('plain_body')
+        )
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+            try:
+                smtp = await self._get_connection()
+                await smtp.send_message(mime)
+                self._smtp_last_used = time.monotonic()
+                self.sent += 1
+                logger.info(f"✅ Email enviado com sucesso para {message['to_email']}")
+                if message.get('outbox_id'):
+                    self._outbox_delete(message['outbox_id'])
+                return
+            except Exception as e:
+                last_error = str(e)
+                logger.warning(f"⚠️ Falha ao enviar email para {message['to_email']} (tentativa {attempt + 1}): {e}")
+                # Conexão pode ter caído: força reconexão na próxima tentativa
+                await self._close_connection()
+
+        self.failed += 1
+        logger.error(f"❌ Email para {message['to_email']} falhou após {self.max_retries + 1} tentativas")
+        self._outbox_mark_failed(message, last_error)
+
+    # ========== SMTP connection ==========
+
+    async def _get_connection(self):
+        if self._smtp is not None and self._smtp.is_connected:
+            return self._smtp
+        self._smtp = await self.email_service.connect()
+        self._smtp_last_used = time.monotonic()
+        return self._smtp
+
+    async def _close_idle_connection(self) -> None:
+        if self._smtp is not None and time.monotonic() - self._smtp_last_used >= self.idle_timeout:
+            await self._close_connection()
+
+    async def _close_connection(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            if smtp.is_connected:
+                await smtp.quit()
+        except Exception:
+            smtp.close()
+
+    # ========== Outbox (email_outbox) ==========
+
+    def _db(self):
+        from supabase_service import get_supabase_service
+        return get_supabase_service()
+
+    async def _spill(self, messages: List[Dict[str, Any]]) -> bool:
+        try:
+            now = datetime.utcnow().isoformat()
+            rows = [{
+                'to_email': m['to_email'],
+                'subject': m['subject'],
+                'html_body': m['html_body'],
+                'plain_body': m.get('plain_body'),
+                'status': 'pending',
+                'attempts': 0,
+                'created_at': now,
+                'updated_at': now
+            } for m in messages]
+            self._db().client.table('email_outbox').insert(rows).execute()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Erro ao salvar emails no outbox: {e}")
+            return False
+
+    async def _claim_outbox(self, limit: int) -> List[Dict[str, Any]]:
+        """Marca até `limit` emails como 'queued' para esta réplica e os devolve"""
+        db = self._db()
+        try:
+            result = db.client.rpc('claim_email_outbox', {
+                'p_limit': limit,
+                'p_lease_seconds': self.outbox_lease
+            }).execute()
+            return result.data or []
+        except Exception as rpc_err:
+            logger.warning(f"RPC claim_email_outbox indisponível, usando claim condicional: {rpc_err}")
+
+        # Fallback: lease vencido volta para 'pending' e o UPDATE condicional só
+        # devolve as linhas que esta réplica marcou
+        now = datetime.utcnow()
+        db.client.table('email_outbox')\
+            .update({'status': 'pending', 'updated_at': now.isoformat()})\
+            .eq('status', 'queued')\
+            .lt('updated_at', (now - timedelta(seconds=self.outbox_lease)).isoformat())\
+            .execute()
+        due = db.client.table('email_outbox')\
+            .select('id')\
+            .eq('status', 'pending')\
+            .order('created_at')\
+            .limit(limit)\
+            .execute()
+        ids = [row['id'] for row in (due.data or [])]
+        if not ids:
+            return []
+        claimed = db.client.table('email_outbox')\
+            .update({'status': 'queued', 'updated_at': now.isoformat()})\
+            .in_('id', ids)\
+            .eq('status', 'pending')\
+            .execute()
+        return sorted(claimed.data or [], key=lambda row: row['created_at'])
+
+    async def _refill_from_outbox(self) -> None:
+        free = self._queue.maxsize - self._queue.qsize()
+        if free <= 0:
+            return
+        try:
+            rows = await self._claim_outbox(min(free, self.outbox_batch_size))
+            if not rows:
+                return
+
+            for row in rows:
+                self._queue.put_nowait({
+                    'outbox_id': row['id'],
+                    'to_email': row['to_email'],
+                    'subject': row['subject'],
+                    'html_body': row['html_body'],
+                    'plain_body': row.get('plain_body'),
+                })
+            logger.info(f"📬 {len(rows)} emails recarregados do outbox")
+        except Exception as e:
+            logger.warning(f"Não foi possível ler email_outbox: {e}")
+
+    def _outbox_release(self, outbox_ids: List[str]) -> None:
+        """Devolve para 'pending' emails desta réplica que não chegaram a ser enviados"""
+        try:
+            self._db().client.table('email_outbox')\
+                .update({'status': 'pending', 'updated_at': datetime.utcnow().isoformat()})\
+                .in_('id', outbox_ids)\
+                .eq('status', 'queued')\
+                .execute()
+        except Exception as e:
+            logger.warning(f"Não foi possível liberar emails do outbox: {e}")
+
+    def _outbox_delete(self, outbox_id: str) -> None:
+        try:
+            self._db().client.table('email_outbox').delete().eq('id', outbox_id).execute()
+        except Exception as e:
+            logger.warning(f"Não foi possível remover email {outbox_id} do outbox: {e}")
+
+    def _outbox_mark_failed(self, message: Dict[str, Any], error: Optional[str]) -> None:
+        try:
+            table = self._db().client.table('email_outbox')
+            data = {
+                'status': 'failed',
+                'attempts': self.max_retries + 1,
+                'last_error': (error or '')[:500],
+                'updated_at': datetime.utcnow().isoformat()
+            }
+            if message.get('outbox_id'):
+                table.update(data).eq('id', message['outbox_id']).execute()
+            else:
+                table.insert({
+                    'to_email': message['to_email'],
+                    'subject': message['subject'],
+                    'html_body': message['html_body'],
+                    'plain_body': message.get('plain_body'),
+                    **data
+                }).execute()
+        except Exception as e:
+            logger.error(f"❌ Erro ao registrar falha de email no outbox: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.is_running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "sent": self.sent,
+            "failed": self.failed,
+            "smtp_connected": bool(self._smtp is not None and self._smtp.is_connected)
+        }
@@ -0,0 +1,146 @@
+"""
+Event Bus
+Pub/sub em memória para eventos em tempo real (SSE)
+
+Publicadores (campaign_worker, endpoints, notificações) chamam publish_to_company /
+publish_to_user; cada conexão SSE mantém uma fila própria e limitada.
+"""
+import os
+import json
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Fila limitada de eventos de uma conexão SSE"""
+
+    def __init__(self, user_id: str, company_id: Optional[str], max_queue_size: int):
+        self.user_id = user_id
+        self.company_id = company_id
+        self.max_queue_size = max_queue_size
+        self.dropped = 0
+        self.closed = False
+        self._events: deque = deque()
+        self._ready = asyncio.Event()
+
+    def push(self, event: Dict[str, Any]) -> None:
+        """Enfileira evento; se a fila estiver cheia descarta o mais antigo (backpressure)"""
+        if self.closed:
+            return
+        if len(self._events) >= self.max_queue_size:
+            self._events.popleft()
+            self.dropped += 1
+        self._events.append(event)
+        self._ready.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Aguarda o próximo evento.
+
+        Raises:
+            asyncio.TimeoutError: Nenhum evento dentro do timeout
+        Returns:
+            Evento, ou None se a assinatura foi encerrada
+        """
+        if not self._events and not self.closed:
+            self._ready.clear()
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        if self._events:
+            return self._events.popleft()
+        return None
+
+
+class EventBus:
+    """Pub/sub em processo com fan-out limitado por usuário"""
+
+    def __init__(self):
+        self.max_queue_size = int(os.getenv('SSE_MAX_QUEUE_SIZE', '100'))
+        self.max_subscriptions_per_user = int(os.getenv('SSE_MAX_CONNECTIONS_PER_USER', '5'))
+        # Lista por usuário em ordem de criação (a primeira é a mais antiga)
+        self._by_user: Dict[str, List[Subscription]] = {}
+        self._by_company: Dict[str, Set[Subscription]] = {}
+
+    def subscribe(self, user_id: str, company_id: Optional[str] = None) -> Subscription:
+        """Registra uma nova conexão. Excedido o limite, a conexão mais antiga do usuário é encerrada."""
+        user_subs = self._by_user.setdefault(user_id, [])
+        while len(user_subs) >= self.max_subscriptions_per_user:
+            logger.info(f"📡 Limite de conexões SSE atingido para {user_id} - encerrando a mais antiga")
+            self.unsubscribe(user_subs[0])
+            user_subs = self._by_user.setdefault(user_id, [])
+
+        subscription = Subscription(user_id, company_id, self.max_queue_size)
+        user_subs.append(subscription)
+        if company_id:
+            self._by_company.setdefault(company_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscription.close()
+        user_subs = self._by_user.get(subscription.user_id)
+        if user_subs is not None and subscription in user_subs:
+            user_subs.remove(subscription)
+            if not user_subs:
+                del self._by_user[subscription.user_id]
+        if subscription.company_id:
+            company_subs = self._by_company.get(subscription.company_id)
+            if company_subs is not None:
+                company_subs.discard(subscription)
+                if not company_subs:
+                    del self._by_company[subscription.company_id]
+
+    def publish_to_user(self, user_id: Optional[str], event_type: str, data: Dict[str, Any]) -> None:
+        if user_id:
+            self._publish(self._by_user.get(user_id), event_type, data)
+
+    def publish_to_company(self, company_id: Optional[str], event_type: str, data: Dict[str, Any]) -> None:
+        if company_id:
+            self._publish(self._by_company.get(company_id), event_type, data)
+
+    def connection_count(self) -> int:
+        return sum(len(subs) for subs in self._by_user.values())
+
+    def _publish(self, subscriptions, event_type: str, data: Dict[str, Any]) -> None:
+        if not subscriptions:
+            return
+        event = {
+            "type": event_type,
+            "data": data,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        for subscription in list(subscriptions):
+            subscription.push(event)
+
+
+def publish_campaign_status(company_id: Optional[str], campaign_id: str, status: str) -> None:
+    """Atalho para transições de status de campanha"""
+    get_event_bus().publish_to_company(company_id, "campaign_status", {
+        "campaign_id": campaign_id,
+        "status": status
+    })
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Serializa um evento no formato text/event-stream"""
+    payload = json.dumps(event["data"], default=str)
+    return f"event: {event['type']}\ndata: {payload}\n\n"
+
+
+# Singleton global
+_event_bus: Optional[EventBus] = None
+
+
+def get_event_bus() -> EventBus:
+    """Retorna instância singleton do EventBus"""
+    global _event_bus
+    if _event_bus is None:
+        _event_bus = EventBus()
+    return _event_bus
@@ -7,6 +7,7 @@ from fastapi import APIRouter, HTTPException, Request, Header
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 import os
+import json
 import hmac
 import hashlib
 import logging
@@ -19,8 +20,9 @@ from dotenv import load_dotenv
 # Carregar variáveis de ambiente
 load_dotenv()
 
-from supabase_service import SupabaseService
+from supabase_service import get_supabase_service
 from email_service import get_email_service
+from webhook_queue import WebhookEventQueue
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +31,8 @@ webhook_router = APIRouter(prefix="/api")
 
 # Configuração Kiwify
 KIWIFY_WEBHOOK_SECRET = os.environ.get('KIWIFY_WEBHOOK_SECRET', '')
+# Tempo máximo esperando o trigger do banco criar o profile de um usuário novo
+KIWIFY_PROFILE_WAIT_TIMEOUT = float(os.environ.get('KIWIFY_PROFILE_WAIT_TIMEOUT', '10'))
 
 # Mapeamento por nome do plano (como aparece no Kiwify)
 PLAN_NAME_MAP = {
@@ -114,7 +118,7 @@ def generate_temporary_password(length=12):
 async def get_user_by_email(email: str) -> Optional[Dict]:
     """Busca usuário pelo email"""
     try:
-        db = SupabaseService()
+        db = get_supabase_service()
         result = db.client.table('profiles').select('*').eq('email', email).maybe_single().execute()
         return result.data
     except Exception as e:
@@ -127,7 +131,7 @@ async def create_new_user(email: str, name: str) -> Dict:
     Cria um novo usuário no Supabase Auth e retorna os dados
     """
     try:
-        db = SupabaseService()
+        db = get_supabase_service()
         password = generate_temporary_password()
         
         logger.info(f"🆕 Criando novo usuário para: {email}")
@@ -147,9 +151,6 @@ async def create_new_user(email: str, name: str) -> Dict:
         # O objeto retornado tem user dentro
         new_user = auth_response.user
         
-        # Pequeno delay para garantir que triggers de banco (se houver) rodem
-        await asyncio.sleep(1)
-        
         return {
             "id": new_user.id,
             "email": email,
@@ -162,19 +163,43 @@ async def create_new_user(email: str, name: str) -> Dict:
         raise e
 
 
+async def reset_temporary_password(user_id: str) -> str:
+    """Gera nova senha temporária (retentativa de um evento cujo email de credenciais não saiu)"""
+    db = get_supabase_service()
+    password = generate_temporary_password()
+    db.client.auth.admin.update_user_by_id(user_id, {"password": password})
+    return password
+
+
+async def wait_for_profile(user_id: str, timeout: float = KIWIFY_PROFILE_WAIT_TIMEOUT) -> bool:
+    """Aguarda o profile criado pelo trigger de signup (polling com backoff curto)"""
+    db = get_supabase_service()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = 0.1
+    while True:
+        result = db.client.table('profiles').select('id').eq('id', user_id).limit(1).execute()
+        if result.data:
+            return True
+        if loop.time() + delay > deadline:
+            return False
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
+
+
 async def upgrade_user_to_plan(user_id: str, plan: str, subscription_id: str, order_id: str):
     """
     Upgrade do plano do usuário (Usando UPSERT para garantir criação)
     """
     try:
-        db = SupabaseService()
+        db = get_supabase_service()
         
         # Calcular data de expiração (30 dias para planos pagos)
         valid_until = (datetime.now() + timedelta(days=30)).isoformat()
         
         # Buscar configuração do plano
         plan_key = plan.lower()
-        plan_config = PLAN_LIMITS.get(plan_key, PLAN_LIMITS['demo'])
+        plan_config = PLAN_LIMITS.get(plan_key, PLAN_LIMITS['basico'])
         
         # Dados para atualização/inserção
         quota_data = {
@@ -192,6 +217,7 @@ async def upgrade_user_to_plan(user_id: str, plan: str, subscription_id: str, or
         
         # UPSERT: Atualiza se existir, Cria se não existir
         db.client.table('user_quotas').upsert(quota_data, on_conflict='user_id').execute()
+        get_supabase_service().invalidate_user_quota(user_id)
         
         logger.info(f"✅ Usuário {user_id} atualizado/criado com plano {plan_config['name']}")
         
@@ -203,7 +229,7 @@ async def upgrade_user_to_plan(user_id: str, plan: str, subscription_id: str, or
 async def downgrade_user_to_suspended(user_id: str, reason: str):
     """Suspende a conta do usuário (sem acesso a nenhuma funcionalidade)"""
     try:
-        db = SupabaseService()
+        db = get_supabase_service()
         
         # Usar plan_type='suspended' como marcador (não temos coluna subscription_status)
         db.client.table('user_quotas').update({
@@ -215,6 +241,7 @@ async def downgrade_user_to_suspended(user_id: str, reason: str):
             'subscription_id': None,
             'updated_at': datetime.now().isoformat()
         }).eq('user_id', user_id).execute()
+        get_supabase_service().invalidate_user_quota(user_id)
         
         logger.info(f"⚠️ Usuário {user_id} suspenso. Motivo: {reason}")
         
@@ -226,7 +253,7 @@ async def downgrade_user_to_suspended(user_id: str, reason: str):
 async def log_webhook_event(event_type: str, payload: Dict[str, Any], status: str, error: Optional[str] = None):
     """Registra evento de webhook para auditoria"""
     try:
-        db = SupabaseService()
+        db = get_supabase_service()
         db.client.table('webhook_logs').insert({
             'event_type': event_type,
             'payload': payload,
@@ -238,143 +265,191 @@ async def log_webhook_event(event_type: str, payload: Dict[str, Any], status: st
         logger.error(f"Erro ao logar webhook: {e}")
 
 
-@webhook_router.post("/webhook/kiwify")
-async def kiwify_webhook(
-    request: Request,
-    x_kiwify_signature: Optional[str] = Header(None)
-):
+def resolve_plan_key(product_name: str) -> str:
+    """Plano a partir do nome do produto no Kiwify (padrão: basico)"""
+    product_name_lower = product_name.lower().strip()
+    plan_key = PLAN_NAME_MAP.get(product_name_lower)
+    
+    if not plan_key:
+        for name, key in PLAN_NAME_MAP.items():
+            if name in product_name_lower:
+                plan_key = key
+                break
+    
+    return plan_key or 'basico'
+
+
+async def process_kiwify_event(event: Dict[str, Any], save_state) -> Dict[str, Any]:
     """
-    Endpoint para receber webhooks do Kiwify
+    Processa um evento da fila (chamado pelo worker, com retentativas).
+    event['state'] guarda o progresso de tentativas anteriores (usuário criado,
+    email enviado), então repetir o evento não duplica efeitos.
     """
-    try:
-        body = await request.body()
-        
-        if not x_kiwify_signature:
-            logger.warning("⚠️ Webhook Kiwify sem assinatura - rejeitado")
-            await log_webhook_event('missing_signature', {}, 'failed', 'Missing signature header')
-            raise HTTPException(status_code=401, detail="Missing X-Kiwify-Signature header")
-        
-        if not verify_kiwify_signature(body, x_kiwify_signature):
-            logger.warning("⚠️ Assinatura inválida do webhook Kiwify")
-            await log_webhook_event('invalid_signature', {}, 'failed', 'Invalid signature')
-            raise HTTPException(status_code=401, detail="Invalid signature")
-        
-        payload_dict = await request.json()
-        payload = KiwifyWebhookPayload(**payload_dict)
-        
-        logger.info(f"📩 Webhook recebido: {payload.event_type} - {payload.customer_email}")
-        
-        # 1. Tentar buscar usuário existente
-        existing_user = await get_user_by_email(payload.customer_email)
-        
-        user_id = None
-        new_password = None
-        is_new_user = False
-        
-        if existing_user:
-            user_id = existing_user['id']
-            logger.info(f"👤 Usuário existente encontrado: {user_id}")
+    payload_dict = event['payload']
+    payload = KiwifyWebhookPayload(**payload_dict)
+    state = event['state']
+    
+    logger.info(f"📩 Processando webhook: {payload.event_type} - {payload.customer_email}")
+    
+    # 1. Tentar buscar usuário existente
+    existing_user = await get_user_by_email(payload.customer_email)
+    
+    user_id = state.get('user_id')
+    new_password = None
+    is_new_user = bool(state.get('created_user'))
+    
+    if existing_user:
+        user_id = existing_user['id']
+        logger.info(f"👤 Usuário existente encontrado: {user_id}")
+    elif not user_id:
+        # 2. Se não existe e for pagamento aprovado, criar conta!
+        if payload.event_type == 'order.paid':
+            new_user_data = await create_new_user(payload.customer_email, payload.customer_name)
+            user_id = new_user_data['id']
+            new_password = new_user_data['password']
+            is_new_user = True
+            await save_state({'user_id': user_id, 'created_user': True})
+            logger.info(f"✨ Nova conta criada com sucesso: {user_id}")
         else:
-            # 2. Se não existe e for pagamento aprovado, criar conta!
-            if payload.event_type == 'order.paid':
-                try:
-                    new_user_data = await create_new_user(payload.customer_email, payload.customer_name)
-                    user_id = new_user_data['id']
-                    new_password = new_user_data['password']
-                    is_new_user = True
-                    logger.info(f"✨ Nova conta criada com sucesso: {user_id}")
-                except Exception as e:
-                    logger.error(f"Falha crítica ao criar usuário: {e}")
-                    raise HTTPException(status_code=500, detail="Failed to create user account")
-            else:
-                # Se for cancelamento/reembolso de user que não existe, ignora
-                logger.warning(f"⚠️ Evento {payload.event_type} para usuário inexistente ignorado.")
-                return {"status": "ignored", "message": "User not found"}
+            # Se for cancelamento/reembolso de user que não existe, ignora
+            logger.warning(f"⚠️ Evento {payload.event_type} para usuário inexistente ignorado.")
+            await log_webhook_event(payload.event_type, payload_dict, 'ignored', 'User not found')
+            return {"status": "ignored", "reason": "User not found"}
+    
+    if is_new_user:
+        # Trigger de signup cria o profile; espera ele aparecer em vez de um sleep fixo
+        if not await wait_for_profile(user_id):
+            logger.warning(f"⚠️ Profile de {user_id} não apareceu em {KIWIFY_PROFILE_WAIT_TIMEOUT}s - seguindo")
+    
+    # Processar evento
+    if payload.event_type == 'order.paid':
+        # PAGAMENTO APROVADO - UPGRADE
+        plan_key = resolve_plan_key(payload.product_name)
         
-        # Processar evento
-        if payload.event_type == 'order.paid':
-            # PAGAMENTO APROVADO - UPGRADE
-            product_name_lower = payload.product_name.lower().strip()
-            plan_key = PLAN_NAME_MAP.get(product_name_lower)
+        # Atualiza ou Insere a cota (Upsert)
+        await upgrade_user_to_plan(
+            user_id=user_id,
+            plan=plan_key,
+            subscription_id=payload.subscription_id or payload.order_id,
+            order_id=payload.order_id
+        )
+        
+        # ENVIAR EMAIL (uma vez por evento)
+        if not state.get('email_sent'):
+            if is_new_user and not new_password:
+                # Conta criada numa tentativa anterior: a senha gerada se perdeu
+                new_password = await reset_temporary_password(user_id)
+            plan_config = PLAN_LIMITS.get(plan_key, {})
+            features = []
             
-            if not plan_key:
-                for name, key in PLAN_NAME_MAP.items():
-                    if name in product_name_lower:
-                        plan_key = key
-                        break
+            # SE FOR NOVO USUÁRIO, COLOCAR AS CREDENCIAIS NO TOPO
+            if is_new_user and new_password:
+                features.append("🔐 === SUAS CREDENCIAIS DE ACESSO ===")
+                features.append(f"📧 Login: {payload.customer_email}")
+                features.append(f"🔑 Senha Temporária: {new_password}")
+                features.append("==================================")
+                features.append("⚠️ Recomendamos trocar sua senha ao entrar.")
+                features.append("") # Linha em branco
             
-            if not plan_key:
-                plan_key = 'basico'
+            features.append(f"✓ Plano: {plan_config.get('name', plan_key)}")
             
-            # Atualiza ou Insere a cota (Upsert)
-            await upgrade_user_to_plan(
-                user_id=user_id,
-                plan=plan_key,
-                subscription_id=payload.subscription_id or payload.order_id,
-                order_id=payload.order_id
-            )
+            if plan_config.get('leads_limit') == -1:
+                features.append("✓ Buscas de leads ilimitadas")
             
-            # ENVIAR EMAIL
-            try:
-                plan_config = PLAN_LIMITS.get(plan_key, {})
-                features = []
-                
-                # SE FOR NOVO USUÁRIO, COLOCAR AS CREDENCIAIS NO TOPO
-                if is_new_user and new_password:
-                    features.append("🔐 === SUAS CREDENCIAIS DE ACESSO ===")
-                    features.append(f"📧 Login: {payload.customer_email}")
-                    features.append(f"🔑 Senha Temporária: {new_password}")
-                    features.append("==================================")
-                    features.append("⚠️ Recomendamos trocar sua senha ao entrar.")
-                    features.append("") # Linha em branco
-                
-                features.append(f"✓ Plano: {plan_config.get('name', plan_key)}")
-                
-                if plan_config.get('leads_limit') == -1:
-                    features.append("✓ Buscas de leads ilimitadas")
-                
-                if plan_config.get('campaigns_limit', 0) == -1:
-                    features.append("✓ Disparador WhatsApp ilimitado")
-                
-                email_service = get_email_service()
-                
-                # Usa o método existente de confirmação, mas agora com credenciais se necessário
-                await email_service.send_purchase_confirmation(
-                    user_email=payload.customer_email,
-                    user_name=payload.customer_name,
-                    plan_name=plan_config.get('name', plan_key),
-                    plan_features=features,
-                    order_id=payload.order_id
-                )
-                logger.info(f"📧 Email enviado para {payload.customer_email}")
-                
-            except Exception as e:
-                logger.error(f"❌ Erro ao enviar email: {e}")
+            if plan_config.get('campaigns_limit', 0) == -1:
+                features.append("✓ Disparador WhatsApp ilimitado")
             
-            await log_webhook_event(payload.event_type, payload_dict, 'success')
+            email_service = get_email_service()
             
-            return {
-                "status": "success",
-                "message": "User processed successfully",
-                "is_new_user": is_new_user
-            }
-        
-        elif payload.event_type in ['order.refunded', 'subscription.canceled']:
-            # REEMBOLSO/CANCELAMENTO - SUSPENDER CONTA
-            await downgrade_user_to_suspended(
-                user_id=user_id,
-                reason=f'Evento: {payload.event_type}'
+            # Usa o método existente de confirmação, mas agora com credenciais se necessário
+            sent = await email_service.send_purchase_confirmation(
+                user_email=payload.customer_email,
+                user_name=payload.customer_name,
+                plan_name=plan_config.get('name', plan_key),
+                plan_features=features,
+                order_id=payload.order_id
             )
-            await log_webhook_event(payload.event_type, payload_dict, 'success')
-            return {"status": "success", "message": "User suspended"}
-        
-        else:
-            return {"status": "ignored", "message": f"Unknown event: {payload.event_type}"}
+            if not sent:
+                # Sem email o cliente novo não recebe as credenciais: a fila tenta de novo
+                # (a senha é regenerada acima na próxima tentativa)
+                raise RuntimeError(f"Email de confirmação para {payload.customer_email} não enviado")
+            await save_state({'email_sent': True})
+            logger.info(f"📧 Email enviado para {payload.customer_email}")
+
+        await log_webhook_event(payload.event_type, payload_dict, 'success')
+        return {"status": "done", "user_id": user_id, "is_new_user": is_new_user, "plan": plan_key}
     
+    elif payload.event_type in ['order.refunded', 'subscription.canceled']:
+        # REEMBOLSO/CANCELAMENTO - SUSPENDER CONTA
+        await downgrade_user_to_suspended(
+            user_id=user_id,
+            reason=f'Evento: {payload.event_type}'
+        )
+        await log_webhook_event(payload.event_type, payload_dict, 'success')
+        return {"status": "done", "user_id": user_id, "suspended": True}
+    
+    else:
+        await log_webhook_event(payload.event_type, payload_dict, 'ignored', 'Unknown event')
+        return {"status": "ignored", "reason": f"Unknown event: {payload.event_type}"}
+
+
+# Singleton global
+_kiwify_event_queue: Optional[WebhookEventQueue] = None
+
+
+def get_kiwify_event_queue() -> WebhookEventQueue:
+    """Retorna a fila de eventos do Kiwify (processados por process_kiwify_event)"""
+    global _kiwify_event_queue
+    if _kiwify_event_queue is None:
+        _kiwify_event_queue = WebhookEventQueue('kiwify', process_kiwify_event)
+    return _kiwify_event_queue
+
+
+@webhook_router.post("/webhook/kiwify")
+async def kiwify_webhook(
+    request: Request,
+    x_kiwify_signature: Optional[str] = Header(None)
+):
+    """
+    Endpoint para receber webhooks do Kiwify
+    
+    Só valida a assinatura e grava o evento na fila (idempotente por
+    order_id + event_type); o processamento acontece no worker.
+    """
+    body = await request.body()
+    
+    if not x_kiwify_signature:
+        logger.warning("⚠️ Webhook Kiwify sem assinatura - rejeitado")
+        await log_webhook_event('missing_signature', {}, 'failed', 'Missing signature header')
+        raise HTTPException(status_code=401, detail="Missing X-Kiwify-Signature header")
+    
+    if not verify_kiwify_signature(body, x_kiwify_signature):
+        logger.warning("⚠️ Assinatura inválida do webhook Kiwify")
+        await log_webhook_event('invalid_signature', {}, 'failed', 'Invalid signature')
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    
+    try:
+        payload_dict = json.loads(body)
+        payload = KiwifyWebhookPayload(**payload_dict)
+    except Exception as e:
+        logger.warning(f"⚠️ Payload inválido do webhook Kiwify: {e}")
+        await log_webhook_event('invalid_payload', {}, 'failed', str(e)[:500])
+        raise HTTPException(status_code=400, detail="Invalid payload")
+    
+    event_key = f"{payload.order_id}:{payload.event_type}"
+    try:
+        event = await get_kiwify_event_queue().enqueue(event_key, payload.event_type, payload_dict)
     except Exception as e:
-        logger.error(f"❌ Erro no webhook: {e}")
-        await log_webhook_event('error', {}, 'failed', str(e))
-        raise HTTPException(status_code=500, detail=str(e))
+        # Sem gravar o evento não há como processar: erro faz o Kiwify reenviar
+        logger.error(f"❌ Erro ao enfileirar webhook {event_key}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to enqueue event")
+    
+    if event is None:
+        logger.info(f"🔁 Webhook duplicado ignorado: {event_key}")
+        return {"status": "duplicate", "event_key": event_key}
+    
+    logger.info(f"📩 Webhook enfileirado: {payload.event_type} - {payload.customer_email}")
+    return {"status": "queued", "event_key": event_key, "event_id": event['id']}
 
 @webhook_router.get("/webhook/test")
 async def test_webhook():
@@ -0,0 +1,184 @@
+"""
+Maintenance Scheduler
+Jobs periódicos de retenção e compactação das tabelas de log
+
+- login_attempts, audit_logs e webhook_logs: delete em lotes (RPC purge_old_rows)
+- message_logs: linhas antigas viram contagens diárias em message_log_daily_stats
+- Retenção configurável por tabela (0 desativa o job); métricas de cada execução
+  disponíveis em /api/admin/maintenance/jobs
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+from supabase_service import get_supabase_service
+from audit_service import get_audit_service
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledJob:
+    """Job periódico com métricas da última execução"""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable[int]]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run_at = 0.0
+        self.runs = 0
+        self.failures = 0
+        self.rows_total = 0
+        self.last_rows: Optional[int] = None
+        self.last_run_at: Optional[str] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.running = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "interval_seconds": self.interval,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "rows_total": self.rows_total,
+            "last_rows": self.last_rows,
+            "last_run_at": self.last_run_at,
+            "last_duration_seconds": self.last_duration,
+            "last_error": self.last_error
+        }
+
+
+class MaintenanceScheduler:
+    """Agendador em processo dos jobs de manutenção"""
+
+    def __init__(self):
+        self.interval = float(os.getenv('RETENTION_JOB_INTERVAL_HOURS', '24')) * 3600
+        self.initial_delay = float(os.getenv('RETENTION_JOB_INITIAL_DELAY', '300'))
+        self.batch_size = int(os.getenv('RETENTION_BATCH_SIZE', '5000'))
+        self.retention_days = {
+            'login_attempts': int(os.getenv('LOGIN_ATTEMPTS_RETENTION_DAYS', '7')),
+            'audit_logs': int(os.getenv('AUDIT_LOG_RETENTION_DAYS', '90')),
+            'webhook_logs': int(os.getenv('WEBHOOK_LOG_RETENTION_DAYS', '30')),
+            'message_logs': int(os.getenv('MESSAGE_LOG_RETENTION_DAYS', '90')),
+        }
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._register_default_jobs()
+
+    def _register_default_jobs(self) -> None:
+        days = self.retention_days
+        if days['login_attempts'] > 0:
+            self.register('login_attempts_retention', self._purge_login_attempts)
+        if days['audit_logs'] > 0:
+            self.register('audit_logs_retention', self._purge_audit_logs)
+        if days['webhook_logs'] > 0:
+            self.register('webhook_logs_retention', self._purge_webhook_logs)
+        if days['message_logs'] > 0:
+            self.register('message_logs_compaction', self._compact_message_logs)
+
+    def register(self, name: str, func: Callable[[], Awaitable[int]], interval: Optional[float] = None) -> None:
+        self.jobs[name] = ScheduledJob(name, interval or self.interval, func)
+
+    # ========== Jobs ==========
+
+    def _cutoff(self, table: str) -> datetime:
+        return datetime.utcnow() - timedelta(days=self.retention_days[table])
+
+    async def _purge_login_attempts(self) -> int:
+        return await get_supabase_service().purge_old_rows('login_attempts', self._cutoff('login_attempts'), self.batch_size)
+
+    async def _purge_audit_logs(self) -> int:
+        # Grava o buffer antes para não competir com o delete
+        await get_audit_service().flush()
+        count = await get_supabase_service().purge_old_rows('audit_logs', self._cutoff('audit_logs'), self.batch_size)
+        if count:
+            get_audit_service().invalidate_stats()
+        return count
+
+    async def _purge_webhook_logs(self) -> int:
+        return await get_supabase_service().purge_old_rows('webhook_logs', self._cutoff('webhook_logs'), self.batch_size)
+
+    async def _compact_message_logs(self) -> int:
+        return await get_supabase_service().compact_message_logs(self._cutoff('message_logs'), self.batch_size)
+
+    # ========== Execução ==========
+
+    async def run_job(self, name: str) -> Dict[str, Any]:
+        """Executa um job imediatamente e retorna suas métricas"""
+        job = self.jobs.get(name)
+        if job is None:
+            raise KeyError(name)
+        if job.running:
+            return job.stats()
+
+        job.running = True
+        started = time.monotonic()
+        job.last_run_at = datetime.utcnow().isoformat()
+        try:
+            rows = await job.func()
+            job.last_rows = rows
+            job.rows_total += rows or 0
+            job.last_error = None
+            logger.info(f"🧹 Job {name}: {rows} linhas processadas em {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)[:500]
+            logger.error(f"❌ Job de manutenção {name} falhou: {e}", exc_info=True)
+        finally:
+            job.runs += 1
+            job.last_duration = round(time.monotonic() - started, 3)
+            job.next_run_at = time.monotonic() + job.interval
+            job.running = False
+        return job.stats()
+
+    async def _run(self) -> None:
+        first_run = time.monotonic() + self.initial_delay
+        for job in self.jobs.values():
+            job.next_run_at = first_run
+        while True:
+            now = time.monotonic()
+            for job in list(self.jobs.values()):
+                if job.next_run_at <= now:
+                    await self.run_job(job.name)
+            next_due = min((job.next_run_at for job in self.jobs.values()), default=time.monotonic() + self.interval)
+            await asyncio.sleep(max(1.0, next_due - time.monotonic()))
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if not self.is_running and self.jobs:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🧹 Scheduler de manutenção iniciado ({len(self.jobs)} jobs, a cada {self.interval / 3600:g}h)")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.is_running,
+            "retention_days": self.retention_days,
+            "jobs": [job.stats() for job in self.jobs.values()]
+        }
+
+
+# Singleton global
+_maintenance_scheduler: Optional[MaintenanceScheduler] = None
+
+
+def get_maintenance_scheduler() -> MaintenanceScheduler:
+    """Retorna instância singleton do MaintenanceScheduler"""
+    global _maintenance_scheduler
+    if _maintenance_scheduler is None:
+        _maintenance_scheduler = MaintenanceScheduler()
+    return _maintenance_scheduler
@@ -0,0 +1,296 @@
+"""
+Metrics
+Métricas Prometheus do backend (expostas em /metrics)
+
+- Latência HTTP por rota (middleware ASGI, sem BaseHTTPMiddleware)
+- Latência e status das chamadas WAHA por sessão (transport httpx instrumentado;
+  a sessão vira um hash curto, pois o nome contém o nome da empresa)
+- Latência das consultas Supabase/PostgREST por tabela e operação
+- Workers de campanha ativos, mensagens enviadas/falhas, lag e bloqueios do event loop
+- Mensagens recebidas pelo agente de IA (webhook WAHA) e profundidade da fila
+- Taxa de acerto do cache de tokens de autenticação e dos caches de empresa/sessão WAHA
+"""
+import os
+import time
+import hashlib
+import asyncio
+import logging
+from typing import Optional
+from urllib.parse import urlparse
+
+import httpx
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+)
+
+from tracing import inject_headers, span
+
+logger = logging.getLogger(__name__)
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Rotas de longa duração (SSE) ou da própria coleta ficam fora do histograma
+EXCLUDED_ROUTES = {"/metrics", "/api/events"}
+
+HTTP_REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Latência das requisições HTTP",
+    ["method", "route"], buckets=_LATENCY_BUCKETS
+)
+HTTP_RESPONSES = Counter(
+    "http_responses_total", "Respostas HTTP por rota e status",
+    ["method", "route", "status"]
+)
+WAHA_REQUEST_LATENCY = Histogram(
+    "waha_request_duration_seconds", "Latência das chamadas ao WAHA",
+    ["session", "operation"], buckets=_LATENCY_BUCKETS
+)
+WAHA_RESPONSES = Counter(
+    "waha_responses_total", "Respostas do WAHA por sessão e status (error = falha de rede)",
+    ["session", "status"]
+)
+SUPABASE_QUERY_LATENCY = Histogram(
+    "supabase_query_duration_seconds", "Latência das consultas PostgREST",
+    ["table", "operation"], buckets=_LATENCY_BUCKETS
+)
+SUPABASE_QUERY_ERRORS = Counter(
+    "supabase_query_errors_total", "Consultas PostgREST com erro de rede ou HTTP >= 400",
+    ["table", "operation"]
+)
+CAMPAIGN_WORKERS_ACTIVE = Gauge(
+    "campaign_workers_active", "Workers de campanha em execução"
+)
+CAMPAIGN_MESSAGES = Counter(
+    "campaign_messages_total", "Mensagens processadas pelos workers de campanha",
+    ["status"]
+)
+AGENT_MESSAGES = Counter(
+    "agent_inbound_messages_total", "Mensagens do webhook WAHA por destino no agente de IA",
+    ["result"]
+)
+AGENT_QUEUE_DEPTH = Gauge(
+    "agent_queue_depth", "Mensagens aguardando encaminhamento para o n8n"
+)
+EVENT_LOOP_LAG = Gauge(
+    "event_loop_lag_seconds", "Atraso do event loop na última medição"
+)
+EVENT_LOOP_LAG_HISTOGRAM = Histogram(
+    "event_loop_lag_distribution_seconds", "Distribuição do atraso do event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+EVENT_LOOP_BLOCKS = Counter(
+    "event_loop_blocks_total", "Bloqueios do event loop acima do limite, por call site",
+    ["site"]
+)
+AUTH_CACHE_REQUESTS = Counter(
+    "auth_token_cache_requests_total", "Consultas ao cache de tokens JWT",
+    ["result"]
+)
+AUTH_CACHE_HIT_RATIO = Gauge(
+    "auth_token_cache_hit_ratio", "Taxa de acerto do cache de tokens JWT"
+)
+
+_auth_cache_counts = {"hit": 0, "miss": 0}
+AUTH_CACHE_HIT_RATIO.set_function(
+    lambda: _auth_cache_counts["hit"] / max(1, _auth_cache_counts["hit"] + _auth_cache_counts["miss"])
+)
+
+
+def record_auth_cache(hit: bool) -> None:
+    result = "hit" if hit else "miss"
+    _auth_cache_counts[result] += 1
+    AUTH_CACHE_REQUESTS.labels(result).inc()
+
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Consultas aos caches em memória (contexto de empresa, sessões WAHA)",
+    ["cache", "result"]
+)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def render_metrics() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# ========== HTTP ==========
+
+class PrometheusMiddleware:
+    """Middleware ASGI que mede a latência por rota (template, não URL)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            if path not in EXCLUDED_ROUTES:
+                method = scope.get("method", "GET")
+                HTTP_REQUEST_LATENCY.labels(method, path).observe(time.perf_counter() - start)
+                HTTP_RESPONSES.labels(method, path, str(status_holder[0])).inc()
+
+
+# ========== WAHA ==========
+
+def session_label(session_name: str) -> str:
+    """Rótulo estável da sessão nas métricas sem expor o nome das empresas"""
+    return hashlib.sha256(session_name.encode()).hexdigest()[:12]
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Transport httpx que mede (e traça) cada chamada ao WAHA"""
+
+    def __init__(self, session_name: str):
+        self.session_name = session_name
+        self.session_label = session_label(session_name)
+        self._transport = httpx.AsyncHTTPTransport()
+
+    def _operation(self, request: httpx.Request) -> str:
+        # /api/sessions/<nome>/start -> /api/sessions/{session}/start
+        return request.url.path.replace(f"/{self.session_name}", "/{session}")
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        operation = self._operation(request)
+        start = time.perf_counter()
+        with span(f"WAHA {request.method} {operation}", {
+            "http.method": request.method,
+            "http.route": operation,
+            "waha.session": self.session_name
+        }, kind="client") as current:
+            inject_headers(request.headers)
+            try:
+                response = await self._transport.handle_async_request(request)
+            except Exception:
+                WAHA_RESPONSES.labels(self.session_label, "error").inc()
+                raise
+            finally:
+                WAHA_REQUEST_LATENCY.labels(self.session_label, operation).observe(time.perf_counter() - start)
+            if current is not None:
+                current.set_attribute("http.status_code", response.status_code)
+        WAHA_RESPONSES.labels(self.session_label, str(response.status_code)).inc()
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+# ========== Supabase (PostgREST) ==========
+
+_HTTP_OPERATIONS = {
+    "GET": "select",
+    "HEAD": "count",
+    "POST": "insert",
+    "PATCH": "update",
+    "DELETE": "delete",
+}
+
+
+def _postgrest_labels(path, http_method: str, headers) -> tuple[str, str]:
+    segments = urlparse(str(path)).path.rstrip('/').split('/')
+    if len(segments) >= 2 and segments[-2] == "rpc":
+        return f"rpc:{segments[-1]}", "rpc"
+    operation = _HTTP_OPERATIONS.get(http_method, http_method.lower())
+    if operation == "insert" and "resolution=" in (headers.get("prefer") or ""):
+        operation = "upsert"
+    return segments[-1], operation
+
+
+_postgrest_instrumented = False
+
+
+def instrument_postgrest() -> None:
+    """
+    Mede (e traça) todas as requisições síncronas do cliente PostgREST
+    (SupabaseService e acessos diretos a db.client). Idempotente.
+    """
+    global _postgrest_instrumented
+    if _postgrest_instrumented:
+        return
+    try:
+        from postgrest.base_request_builder import RequestConfig
+    except ImportError:
+        logger.warning("⚠️ postgrest sem RequestConfig - consultas Supabase não serão medidas")
+        return
+
+    original_send = RequestConfig.send
+
+    def send(self):
+        if not isinstance(self.session, httpx.Client):
+            return original_send(self)
+        table, operation = _postgrest_labels(self.path, self.http_method, self.headers)
+        start = time.perf_counter()
+        with span(f"postgrest {operation} {table}", {"db.operation": operation, "db.sql.table": table}, kind="client"):
+            try:
+                response = original_send(self)
+            except Exception:
+                SUPABASE_QUERY_ERRORS.labels(table, operation).inc()
+                raise
+            finally:
+                SUPABASE_QUERY_LATENCY.labels(table, operation).observe(time.perf_counter() - start)
+        if response.status_code >= 400:
+            SUPABASE_QUERY_ERRORS.labels(table, operation).inc()
+        return response
+
+    RequestConfig.send = send
+    _postgrest_instrumented = True
+
+
+# ========== Event loop ==========
+
+class EventLoopLagMonitor:
+    """Mede quanto o event loop atrasa para acordar um sleep curto"""
+
+    def __init__(self):
+        self.interval = float(os.getenv('EVENT_LOOP_LAG_INTERVAL', '0.5'))
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            EVENT_LOOP_LAG.set(lag)
+            EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Singleton global
+_event_loop_monitor: Optional[EventLoopLagMonitor] = None
+
+
+def get_event_loop_monitor() -> EventLoopLagMonitor:
+    """Retorna instância singleton do EventLoopLagMonitor"""
+    global _event_loop_monitor
+    if _event_loop_monitor is None:
+        _event_loop_monitor = EventLoopLagMonitor()
+    return _event_loop_monitor
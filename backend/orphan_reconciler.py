@@ -0,0 +1,308 @@
+"""
+Orphan Reconciler
+Reconciliação de usuários órfãos (existem em auth.users mas não em profiles)
+
+- Percorre auth.users página por página (a admin API só devolve uma página por chamada)
+- Cada página é comparada com profiles em blocos ordenados de ids (in_), então a
+  memória fica limitada ao tamanho da página, não ao total de usuários
+- Remoções em paralelo com concorrência limitada
+- Roda como job em background gravado em admin_jobs: progresso consultável,
+  cancelamento e retomada a partir da última página concluída
+"""
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from supabase_service import get_supabase_service
+
+logger = logging.getLogger(__name__)
+
+JOB_KIND = 'orphan_reconcile'
+RESUMABLE_STATUSES = ('cancelled', 'interrupted', 'failed')
+
+
+def _attr(user: Any, name: str) -> Any:
+    value = getattr(user, name, None) if not isinstance(user, dict) else user.get(name)
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class OrphanReconciler:
+    """Job (um por vez) que lista ou remove usuários órfãos do Supabase Auth"""
+
+    def __init__(self):
+        self.page_size = int(os.getenv('ORPHAN_PAGE_SIZE', '500'))
+        self.chunk_size = int(os.getenv('ORPHAN_PROFILE_CHUNK', '100'))
+        self.delete_concurrency = int(os.getenv('ORPHAN_DELETE_CONCURRENCY', '5'))
+        # Cadastro em andamento: o profile pode ainda não ter sido criado
+        self.min_age = timedelta(minutes=float(os.getenv('ORPHAN_MIN_AGE_MINUTES', '10')))
+        # Quantos órfãos (id/email) ficam guardados no resultado do job
+        self.report_limit = int(os.getenv('ORPHAN_REPORT_LIMIT', '500'))
+
+        self.job: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._cancel_requested = False
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # --- API do job ---
+
+    async def start(self, dry_run: bool = True, requested_by: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Inicia um novo job.
+
+        Raises:
+            RuntimeError: Já existe um job em execução
+        """
+        if self.is_running:
+            raise RuntimeError("Já existe uma reconciliação de órfãos em execução")
+        now = datetime.utcnow().isoformat()
+        job = {
+            'id': str(uuid.uuid4()),
+            'kind': JOB_KIND,
+            'status': 'running',
+            'params': {'dry_run': dry_run, 'page_size': self.page_size},
+            'progress': {
+                'pages': 0,
+                'users_scanned': 0,
+                'skipped_recent': 0,
+                'orphans_found': 0,
+                'orphans_deleted': 0,
+                'delete_failures': 0
+            },
+            'checkpoint': {'page': 1},
+            'result': {'orphans': [], 'failed': [], 'truncated': False},
+            'error': None,
+            'requested_by': (requested_by or {}).get('user_id'),
+            'requested_by_email': (requested_by or {}).get('email'),
+            'created_at': now,
+            'finished_at': None
+        }
+        self._launch(job)
+        return job
+
+    async def resume(self, job_id: str) -> Dict[str, Any]:
+        """
+        Retoma um job cancelado/interrompido a partir do checkpoint.
+
+        Raises:
+            KeyError: Job não encontrado
+            ValueError: Job não pode ser retomado (concluído ou em execução)
+            RuntimeError: Outro job em execução
+        """
+        if self.is_running:
+            raise RuntimeError("Já existe uma reconciliação de órfãos em execução")
+        job = await self.get_job(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        # 'running' sem tarefa local = processo reiniciado no meio do job
+        stale = job['status'] == 'running' and job is not self.job
+        if job['status'] not in RESUMABLE_STATUSES and not stale:
+            raise ValueError(f"Job com status {job['status']} não pode ser retomado")
+        job.update({'status': 'running', 'error': None, 'finished_at': None})
+        self._launch(job)
+        return job
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        """
+        Pede o cancelamento do job em execução (efetivo ao fim da página atual).
+
+        Raises:
+            KeyError: Job não está em execução neste processo
+        """
+        if not self.is_running or self.job is None or self.job['id'] != job_id:
+            raise KeyError(job_id)
+        self._cancel_requested = True
+        return self.job
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if self.job is not None and self.job['id'] == job_id:
+            return self.job
+        return await get_supabase_service().get_admin_job(job_id)
+
+    async def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        jobs = await get_supabase_service().list_admin_jobs(JOB_KIND, limit)
+        if self.job is not None:
+            # A cópia em memória é mais recente que a gravada
+            jobs = [self.job] + [job for job in jobs if job['id'] != self.job['id']]
+        return jobs[:limit]
+
+    async def wait(self) -> Optional[Dict[str, Any]]:
+        """Aguarda o job atual terminar (usado pelos scripts de linha de comando)"""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+        return self.job
+
+    async def stop(self) -> None:
+        """Shutdown: interrompe o job atual, que pode ser retomado depois"""
+        if not self.is_running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    # --- Execução ---
+
+    def _launch(self, job: Dict[str, Any]) -> None:
+        self.job = job
+        self._cancel_requested = False
+        self._task = asyncio.create_task(self._run(job))
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        db = get_supabase_service()
+        dry_run = job['params'].get('dry_run', True)
+        page = job['checkpoint'].get('page', 1)
+        previous_ids: set = set()
+        mode = 'listagem' if dry_run else 'limpeza'
+        logger.info(f"🧹 Reconciliação de órfãos ({mode}) {job['id']} a partir da página {page}")
+        await db.save_admin_job(job)
+
+        try:
+            while not self._cancel_requested:
+                users = await asyncio.to_thread(
+                    db.client.auth.admin.list_users, page=page, per_page=self.page_size
+                )
+                users = users if isinstance(users, list) else []
+                deleted = await self._process_page(job, users, previous_ids, dry_run)
+
+                # Remoções puxam os usuários da próxima página para esta: relê a mesma
+                # página até ela não ter mais órfãos removíveis
+                if len(users) < self.page_size:
+                    job['status'] = 'completed'
+                    break
+                if deleted:
+                    previous_ids = {_attr(user, 'id') for user in users}
+                else:
+                    page += 1
+                    previous_ids = set()
+                job['checkpoint'] = {'page': page}
+                await db.save_admin_job(job)
+            else:
+                job['status'] = 'cancelled'
+        except asyncio.CancelledError:
+            job['status'] = 'interrupted'
+            raise
+        except Exception as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            logger.error(f"❌ Reconciliação de órfãos {job['id']} falhou na página {page}: {e}")
+        finally:
+            if job['status'] != 'interrupted':
+                job['finished_at'] = datetime.utcnow().isoformat()
+            await db.save_admin_job(job)
+            progress = job['progress']
+            logger.info(
+                f"🧹 Reconciliação de órfãos {job['id']} {job['status']}: "
+                f"{progress['users_scanned']} usuários, {progress['orphans_found']} órfãos, "
+                f"{progress['orphans_deleted']} removidos"
+            )
+
+    async def _process_page(
+        self,
+        job: Dict[str, Any],
+        users: List[Any],
+        previous_ids: set,
+        dry_run: bool
+    ) -> int:
+        progress = job['progress']
+        progress['pages'] += 1
+        cutoff = datetime.now(timezone.utc) - self.min_age
+
+        candidates = {}
+        for user in users:
+            user_id = _attr(user, 'id')
+            if user_id in previous_ids:
+                # Já visto na leitura anterior desta página (órfão que falhou ao remover)
+                continue
+            progress['users_scanned'] += 1
+            created_at = _parse_datetime(_attr(user, 'created_at'))
+            if created_at is not None and created_at > cutoff:
+                progress['skipped_recent'] += 1
+                continue
+            candidates[user_id] = {
+                'id': user_id,
+                'email': _attr(user, 'email'),
+                'created_at': _attr(user, 'created_at')
+            }
+
+        orphans = await self._find_orphans(candidates)
+        progress['orphans_found'] += len(orphans)
+        self._report(job, 'orphans', orphans)
+        if dry_run or not orphans:
+            return 0
+        return await self._delete(job, orphans)
+
+    async def _find_orphans(self, candidates: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Ids da página sem profile, consultados em blocos ordenados"""
+        db = get_supabase_service()
+        ids = sorted(candidates)
+        orphans = []
+        for start in range(0, len(ids), self.chunk_size):
+            chunk = ids[start:start + self.chunk_size]
+            result = await asyncio.to_thread(
+                db.client.table('profiles').select('id').in_('id', chunk).execute
+            )
+            existing = {row['id'] for row in (result.data or [])}
+            orphans.extend(candidates[user_id] for user_id in chunk if user_id not in existing)
+        return orphans
+
+    async def _delete(self, job: Dict[str, Any], orphans: List[Dict[str, Any]]) -> int:
+        db = get_supabase_service()
+        semaphore = asyncio.Semaphore(self.delete_concurrency)
+
+        async def delete(orphan: Dict[str, Any]) -> Optional[str]:
+            async with semaphore:
+                try:
+                    await asyncio.to_thread(db.client.auth.admin.delete_user, orphan['id'])
+                    logger.info(f"✅ Órfão deletado: {orphan['email']} (ID: {orphan['id']})")
+                    return None
+                except Exception as e:
+                    if "not found" in str(e).lower():
+                        return None
+                    logger.error(f"❌ Erro ao deletar órfão {orphan['email']}: {e}")
+                    return str(e)
+
+        errors = await asyncio.gather(*(delete(orphan) for orphan in orphans))
+        failed = [
+            {'id': orphan['id'], 'email': orphan['email'], 'error': error}
+            for orphan, error in zip(orphans, errors) if error is not None
+        ]
+        deleted = len(orphans) - len(failed)
+        job['progress']['orphans_deleted'] += deleted
+        job['progress']['delete_failures'] += len(failed)
+        self._report(job, 'failed', failed)
+        return deleted
+
+    def _report(self, job: Dict[str, Any], key: str, entries: List[Dict[str, Any]]) -> None:
+        reported = job['result'][key]
+        room = self.report_limit - len(reported)
+        reported.extend(entries[:max(0, room)])
+        if len(entries) > room:
+            job['result']['truncated'] = True
+
+
+# Singleton global
+_orphan_reconciler: Optional[OrphanReconciler] = None
+
+
+def get_orphan_reconciler() -> OrphanReconciler:
+    """Retorna instância singleton do OrphanReconciler"""
+    global _orphan_reconciler
+    if _orphan_reconciler is None:
+        _orphan_reconciler = OrphanReconciler()
+    return _orphan_reconciler
@@ -0,0 +1,175 @@
+"""
+Quota Ledger
+Cache local de user_quotas com incrementos acumulados e gravados em lote
+
+- Leituras de quota vêm de um cache por usuário com TTL (Kiwify/admin invalidam)
+- increment_quota acumula em memória e o flusher grava periodicamente
+  via RPC increment_quota_batch (fallback: increment_quota_atomic por item)
+- Geração por usuário: um reset (invalidate com discard_pending) descarta os
+  incrementos anteriores mesmo que um flush já os tenha retirado do ledger
+"""
+import os
+import asyncio
+import itertools
+import logging
+from typing import Any, Dict, Optional
+
+from cache_utils import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaLedger:
+    """Ledger de quotas em memória"""
+
+    def __init__(self, db):
+        self.db = db
+        self.flush_interval = float(os.getenv('QUOTA_FLUSH_INTERVAL', '5'))
+        self.max_pending_users = int(os.getenv('QUOTA_FLUSH_MAX_PENDING', '500'))
+        self._cache = TTLCache(
+            maxsize=int(os.getenv('QUOTA_CACHE_SIZE', '10000')),
+            ttl=float(os.getenv('QUOTA_CACHE_TTL', '60')),
+            name="user_quotas"
+        )
+        # user_id -> {used_field: amount} ainda não gravado no banco
+        self._pending: Dict[str, Dict[str, int]] = {}
+        # Incrementos retirados pelo flush em andamento (ainda podem não estar no banco)
+        self._inflight: Dict[str, Dict[str, int]] = {}
+        # user_id -> geração do último reset; ausente = 0
+        self._generation: Dict[str, int] = {}
+        self._generations = itertools.count(1)
+        # Muda no início e no fim de cada flush
+        self._flush_seq = 0
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    async def get_quota(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Retorna a quota (com incrementos pendentes já aplicados)"""
+        quota = self._cache.get(user_id)
+        if quota is not None:
+            return dict(quota)
+
+        generation = self._generation.get(user_id, 0)
+        flush_seq = self._flush_seq
+        quota = await self.db.fetch_user_quota(user_id)
+        if not quota:
+            return None
+
+        # Incrementos de um flush em andamento podem ou não estar na linha lida:
+        # soma os dois (nunca subestima o uso) e só cacheia se não houve
+        # flush nem reset durante a leitura
+        quota = dict(quota)
+        for increments in (self._pending.get(user_id, {}), self._inflight.get(user_id, {})):
+            for field, amount in increments.items():
+                quota[field] = (quota.get(field) or 0) + amount
+        if (
+            flush_seq == self._flush_seq
+            and generation == self._generation.get(user_id, 0)
+            and user_id not in self._inflight
+        ):
+            self._cache.set(user_id, quota)
+        return dict(quota)
+
+    def record_increment(self, user_id: str, field: str, amount: int = 1) -> None:
+        """Acumula incremento em memória e reflete no valor cacheado"""
+        user_pending = self._pending.setdefault(user_id, {})
+        user_pending[field] = user_pending.get(field, 0) + amount
+
+        quota = self._cache.get(user_id)
+        if quota is not None:
+            quota = dict(quota)
+            quota[field] = (quota.get(field) or 0) + amount
+            self._cache.replace(user_id, quota)
+
+        if len(self._pending) >= self.max_pending_users:
+            self._schedule_flush()
+
+    def invalidate(self, user_id: str, discard_pending: bool = False) -> None:
+        """
+        Remove a quota do cache (plano alterado por webhook/admin).
+
+        Args:
+            discard_pending: Descarta incrementos pendentes (ex: uso zerado pelo admin)
+        """
+        self._cache.pop(user_id)
+        if discard_pending:
+            self._pending.pop(user_id, None)
+            self._inflight.pop(user_id, None)
+            self._generation[user_id] = next(self._generations)
+
+    async def flush(self) -> int:
+        """Grava incrementos pendentes no banco. Retorna quantidade de itens gravados."""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            pending, self._pending = self._pending, {}
+            generations = {user_id: self._generation.get(user_id, 0) for user_id in pending}
+            items = [
+                {'user_id': user_id, 'field': field, 'amount': amount}
+                for user_id, fields in pending.items()
+                for field, amount in fields.items()
+                if amount
+            ]
+
+            self._inflight = {user_id: dict(fields) for user_id, fields in pending.items()}
+            self._flush_seq += 1
+            try:
+                failed = await self.db.apply_quota_increments(items)
+            finally:
+                self._inflight = {}
+                self._flush_seq += 1
+
+            for item in failed:
+                # Reset durante o flush: incrementos anteriores a ele são descartados
+                if self._generation.get(item['user_id'], 0) != generations[item['user_id']]:
+                    continue
+                # Devolve ao ledger para a próxima tentativa
+                user_pending = self._pending.setdefault(item['user_id'], {})
+                user_pending[item['field']] = user_pending.get(item['field'], 0) + item['amount']
+
+            # Gerações só importam enquanto há incrementos anteriores ao reset
+            for user_id in list(self._generation):
+                if user_id not in self._pending:
+                    del self._generation[user_id]
+
+            flushed = len(items) - len(failed)
+            if flushed:
+                logger.debug(f"Quota ledger: {flushed} incrementos gravados")
+            return flushed
+
+    def _schedule_flush(self) -> None:
+        try:
+            asyncio.get_running_loop().create_task(self.flush())
+        except RuntimeError:
+            pass
+
+    async def _run_flusher(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"❌ Erro ao gravar incrementos de quota: {e}")
+
+    def start(self) -> None:
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run_flusher())
+            logger.info(f"📒 Quota ledger iniciado (flush a cada {self.flush_interval}s)")
+
+    async def stop(self) -> None:
+        """Para o flusher e grava o que estiver pendente"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._cache.stats(),
+            "pending_users": len(self._pending)
+        }
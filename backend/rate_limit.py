@@ -0,0 +1,232 @@
+"""
+Rate Limit
+Limiter (slowapi) com chave por usuário/IP real e storage compartilhável
+
+- Chave: user_id autenticado (request.state.user_id) ou IP do cliente,
+  lendo X-Forwarded-For apenas quando a conexão vem de um proxy confiável
+  (Traefik/Coolify)
+- RATE_LIMIT_STORAGE_URI:
+    memory://      contadores por processo (padrão)
+    supabase://    janelas fixas na tabela rate_limit_counters, com hits
+                   acumulados localmente e gravados em lote
+    redis://...    qualquer storage suportado pela biblioteca limits
+"""
+import os
+import time
+import asyncio
+import logging
+import ipaddress
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request
+from limits.storage import Storage
+from slowapi import Limiter
+
+from supabase_service import get_supabase_service
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_TRUSTED_PROXIES = "127.0.0.0/8,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,::1/128,fc00::/7"
+
+
+def _parse_networks(value: str) -> List[Any]:
+    networks = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            logger.warning(f"⚠️ TRUSTED_PROXIES: rede inválida ignorada: {item}")
+    return networks
+
+
+TRUSTED_PROXIES = _parse_networks(os.getenv('TRUSTED_PROXIES', _DEFAULT_TRUSTED_PROXIES))
+
+
+def _is_trusted_proxy(host: Optional[str]) -> bool:
+    if not host:
+        return False
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def get_client_ip(request: Request) -> str:
+    """
+    IP real do cliente. X-Forwarded-For só é considerado quando a conexão
+    vem de um proxy confiável; usa o endereço mais à direita que não é proxy.
+    """
+    peer = request.client.host if request.client else None
+    if not _is_trusted_proxy(peer):
+        return peer or "unknown"
+
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+        for hop in reversed(hops):
+            if not _is_trusted_proxy(hop):
+                return hop
+        if hops:
+            return hops[0]
+
+    return request.headers.get("x-real-ip") or peer or "unknown"
+
+
+def rate_limit_key(request: Request) -> str:
+    """Chave do limiter: usuário autenticado ou IP real"""
+    user_id = getattr(request.state, "user_id", None)
+    if user_id:
+        return f"user:{user_id}"
+    return f"ip:{get_client_ip(request)}"
+
+
+class _Counter:
+    __slots__ = ("remote", "pending", "expires_at", "expiry")
+
+    def __init__(self, expiry: int):
+        self.remote = 0
+        self.pending = 0
+        self.expiry = expiry
+        self.expires_at = time.time() + expiry
+
+
+class SupabaseRateLimitStorage(Storage):
+    """
+    Storage de janela fixa compartilhado via Postgres (RPC rate_limit_hit_batch).
+
+    incr() é local e O(1): soma ao último total conhecido do banco os hits
+    ainda não gravados. O flusher envia os hits pendentes em lote e recebe os
+    totais globais, então réplicas convergem a cada RATE_LIMIT_SYNC_INTERVAL.
+    """
+
+    STORAGE_SCHEME = ["supabase"]
+
+    def __init__(self, uri: Optional[str] = None, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.sync_interval = float(os.getenv('RATE_LIMIT_SYNC_INTERVAL', '1'))
+        self.cleanup_interval = float(os.getenv('RATE_LIMIT_CLEANUP_INTERVAL', '600'))
+        self._counters: Dict[str, _Counter] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_cleanup = time.monotonic()
+        global _active_storage
+        _active_storage = self
+
+    @property
+    def base_exceptions(self):
+        return Exception
+
+    def _counter(self, key: str) -> Optional[_Counter]:
+        counter = self._counters.get(key)
+        if counter is not None and time.time() >= counter.expires_at:
+            del self._counters[key]
+            return None
+        return counter
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        counter = self._counter(key)
+        if counter is None:
+            counter = self._counters[key] = _Counter(expiry)
+        counter.pending += amount
+        self._ensure_flusher()
+        return counter.remote + counter.pending
+
+    def get(self, key: str) -> int:
+        counter = self._counter(key)
+        return counter.remote + counter.pending if counter is not None else 0
+
+    def get_expiry(self, key: str) -> float:
+        counter = self._counter(key)
+        return counter.expires_at if counter is not None else time.time()
+
+    def check(self) -> bool:
+        return True
+
+    def reset(self) -> Optional[int]:
+        count = len(self._counters)
+        self._counters.clear()
+        return count
+
+    def clear(self, key: str) -> None:
+        self._counters.pop(key, None)
+
+    # ========== Sincronização em lote ==========
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is not None and not self._flusher.done():
+            return
+        try:
+            self._flusher = asyncio.get_running_loop().create_task(self._run_flusher())
+        except RuntimeError:
+            pass
+
+    async def _run_flusher(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Envia hits pendentes e atualiza os totais globais"""
+        now = time.time()
+        for key in [k for k, c in self._counters.items() if now >= c.expires_at]:
+            del self._counters[key]
+
+        sent = {key: c.pending for key, c in self._counters.items() if c.pending}
+        if sent:
+            items = [
+                {'key': key, 'amount': amount, 'expiry': self._counters[key].expiry}
+                for key, amount in sent.items()
+            ]
+            try:
+                result = get_supabase_service().client.rpc('rate_limit_hit_batch', {'p_items': items}).execute()
+                for row in (result.data or []):
+                    counter = self._counters.get(row['key'])
+                    if counter is None:
+                        continue
+                    counter.pending -= sent.get(row['key'], 0)
+                    counter.remote = row['count']
+                    counter.expires_at = datetime.fromisoformat(
+                        row['expires_at'].replace('Z', '+00:00')
+                    ).timestamp()
+            except Exception as e:
+                # Hits continuam pendentes: o limite segue valendo localmente
+                logger.warning(f"⚠️ Falha ao sincronizar rate limit ({len(items)} chaves): {e}")
+                return 0
+
+        if time.monotonic() - self._last_cleanup >= self.cleanup_interval:
+            self._last_cleanup = time.monotonic()
+            try:
+                get_supabase_service().client.rpc('cleanup_rate_limit_counters').execute()
+            except Exception as e:
+                logger.warning(f"⚠️ Falha ao limpar rate_limit_counters: {e}")
+
+        return len(sent)
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+
+_active_storage: Optional[SupabaseRateLimitStorage] = None
+
+
+def create_limiter() -> Limiter:
+    storage_uri = os.getenv('RATE_LIMIT_STORAGE_URI', 'memory://')
+    logger.info(f"🚦 Rate limit storage: {storage_uri.split('://')[0]}")
+    return Limiter(key_func=rate_limit_key, storage_uri=storage_uri)
+
+
+async def stop_rate_limit_storage() -> None:
+    """Grava hits pendentes no desligamento (storage supabase://)"""
+    if _active_storage is not None:
+        await _active_storage.stop()
@@ -0,0 +1,186 @@
+"""
+Realtime Listener
+Uma conexão Supabase Realtime compartilhada para mudanças no banco feitas por
+outras réplicas ou direto pelo frontend
+
+- Consumidores registram on_change(tabela, eventos, callback) e on_connect(callback)
+  antes do start; um canal por tabela, para que uma tabela ausente da publicação
+  (ex: waha_configs) não derrube as assinaturas das outras
+- O estado de cada canal vem do callback do subscribe (SUBSCRIBED/CHANNEL_ERROR/...);
+  is_subscribed(tabela) diz se as mudanças daquela tabela estão chegando
+- Reconecta com intervalo fixo; on_connect roda a cada (re)conexão para o
+  consumidor conferir o que mudou enquanto estava desconectado
+- Callbacks rodam no event loop e devem ser O(1) (invalidar cache, setar evento)
+"""
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# callback(tipo do evento, record novo, record antigo)
+ChangeCallback = Callable[[str, Dict[str, Any], Dict[str, Any]], None]
+
+
+class RealtimeListener:
+    """Assinaturas postgres_changes do schema public"""
+
+    def __init__(self):
+        self.enabled = os.getenv('SUPABASE_REALTIME_ENABLED', 'true').lower() == 'true'
+        self.reconnect_interval = float(os.getenv('SUPABASE_REALTIME_RECONNECT_INTERVAL', '30'))
+        self._subscriptions: List[Tuple[str, str, Optional[str], ChangeCallback]] = []
+        self._on_connect: List[Callable[[], Awaitable[None]]] = []
+        self.join_timeout = float(os.getenv('SUPABASE_REALTIME_JOIN_TIMEOUT', '10'))
+        self._task: Optional[asyncio.Task] = None
+        self._channel_states: Dict[str, str] = {}
+        self.events = 0
+
+    def on_change(
+        self,
+        table: str,
+        events: List[str],
+        callback: ChangeCallback,
+        filter: Optional[str] = None
+    ) -> None:
+        for event in events:
+            subscription = (table, event, filter, callback)
+            if subscription not in self._subscriptions:
+                self._subscriptions.append(subscription)
+
+    def on_connect(self, callback: Callable[[], Awaitable[None]]) -> None:
+        if callback not in self._on_connect:
+            self._on_connect.append(callback)
+
+    def is_subscribed(self, table: str) -> bool:
+        return self._channel_states.get(table) == 'SUBSCRIBED'
+
+    @property
+    def connected(self) -> bool:
+        """Todos os canais confirmados pelo servidor"""
+        tables = {subscription[0] for subscription in self._subscriptions}
+        return bool(tables) and all(self.is_subscribed(table) for table in tables)
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.is_running or not self.enabled or not self._subscriptions:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        from realtime import AsyncRealtimeClient
+
+        url = os.getenv('SUPABASE_URL')
+        key = os.getenv('SUPABASE_KEY')
+        if not url or not key:
+            logger.warning("Supabase Realtime desativado: SUPABASE_URL/SUPABASE_KEY ausentes")
+            return
+
+        while True:
+            client = AsyncRealtimeClient(f"{url.rstrip('/')}/realtime/v1", key, auto_reconnect=False)
+            try:
+                await client.connect()
+                tables: Dict[str, List[Tuple[str, Optional[str], ChangeCallback]]] = {}
+                for table, event, filter, callback in self._subscriptions:
+                    tables.setdefault(table, []).append((event, filter, callback))
+
+                joined = {table: asyncio.Event() for table in tables}
+                for table, subscriptions in tables.items():
+                    channel = client.channel(f'backend-{table}')
+                    for event, filter, callback in subscriptions:
+                        channel.on_postgres_changes(
+                            event, self._dispatch(callback), table=table, schema='public', filter=filter
+                        )
+                    await channel.subscribe(self._on_state(table, joined[table]))
+                try:
+                    await asyncio.wait_for(
+                        asyncio.gather(*(event.wait() for event in joined.values())), self.join_timeout
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+                subscribed = [table for table in tables if self.is_subscribed(table)]
+                if not subscribed:
+                    raise RuntimeError("nenhum canal confirmado pelo servidor")
+                logger.info(f"📡 Supabase Realtime conectado ({', '.join(subscribed)})")
+                for table in tables:
+                    if not self.is_subscribed(table):
+                        logger.warning(
+                            f"⚠️ Realtime sem assinatura para {table} "
+                            f"({self._channel_states.get(table, 'sem resposta')}) - tabela está na publicação?"
+                        )
+                for callback in self._on_connect:
+                    try:
+                        await callback()
+                    except Exception as e:
+                        logger.warning(f"⚠️ Erro ao sincronizar após conectar ao Realtime: {e}")
+                while client.is_connected:
+                    await asyncio.sleep(5)
+                logger.warning("⚠️ Conexão Supabase Realtime perdida - reconectando")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Supabase Realtime indisponível: {e}")
+            finally:
+                self._channel_states.clear()
+                try:
+                    await client.close()
+                except Exception:
+                    pass
+            await asyncio.sleep(self.reconnect_interval)
+
+    def _on_state(self, table: str, joined: asyncio.Event) -> Callable[[Any, Optional[Exception]], None]:
+        def handle(state: Any, error: Optional[Exception]) -> None:
+            state = str(getattr(state, 'value', state))
+            previous = self._channel_states.get(table)
+            self._channel_states[table] = state
+            joined.set()
+            if state != 'SUBSCRIBED':
+                logger.warning(f"⚠️ Canal Realtime de {table}: {state}{f' ({error})' if error else ''}")
+            elif previous not in (None, 'SUBSCRIBED'):
+                logger.info(f"📡 Canal Realtime de {table} reassinado")
+        return handle
+
+    def _dispatch(self, callback: ChangeCallback) -> Callable[[Dict[str, Any]], None]:
+        def handle(payload: Dict[str, Any]) -> None:
+            data = payload.get('data') or {}
+            self.events += 1
+            try:
+                event_type = getattr(data.get('type'), 'value', data.get('type'))
+                callback(str(event_type), data.get('record') or {}, data.get('old_record') or {})
+            except Exception as e:
+                logger.error(f"❌ Erro ao processar mudança Realtime em {data.get('table')}: {e}")
+        return handle
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "connected": self.connected,
+            "channels": dict(self._channel_states),
+            "subscriptions": len(self._subscriptions),
+            "events": self.events
+        }
+
+
+# Singleton global
+_realtime_listener: Optional[RealtimeListener] = None
+
+
+def get_realtime_listener() -> RealtimeListener:
+    """Retorna instância singleton do RealtimeListener"""
+    global _realtime_listener
+    if _realtime_listener is None:
+        _realtime_listener = RealtimeListener()
+    return _realtime_listener
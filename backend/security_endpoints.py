@@ -206,18 +206,8 @@ async def validate_login(
                     "turnstile_error": turnstile_result.get("error")
                 }
         else:
-            # Buscar tentativas recentes para decidir se exige Turnstile
-            recent_attempts = await brute_force.get_recent_attempts(
-                email=data.email,
-                limit=10
-            )
-            
-            # Contar falhas recentes
-            recent_failures = sum(1 for a in recent_attempts if not a['success'])
-            
-            # Exigir Turnstile após 3 tentativas falhas
-            if recent_failures >= 3:
-                turnstile_required = True
+            # Exigir Turnstile após N tentativas falhas recentes (janela em memória)
+            turnstile_required = brute_force.captcha_required(data.email)
         
         return {
             "allowed": True,
@@ -11,6 +11,8 @@ from typing import Optional, Dict, Any
 from urllib.parse import urlparse
 from fastapi import HTTPException, Request, Depends
 from supabase import create_client
+from metrics import record_auth_cache
+from tracing import traced
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +51,7 @@ async def get_authenticated_user(request: Request) -> dict:
     if token_hash in _token_cache:
         user_data, expiry = _token_cache[token_hash]
         if current_time < expiry:
+            record_auth_cache(hit=True)
             # Cache ainda válido, MAS precisa verificar session_token
             if client_session_token:
                 # Verificar se o session_token ainda é válido no banco
@@ -78,11 +81,13 @@ async def get_authenticated_user(request: Request) -> dict:
                 except Exception as e:
                     logger.warning(f"Error checking session token: {e}")
             
+            request.state.user_id = user_data.get("user_id")
             return user_data
         else:
             # Cache expirado, remover
             del _token_cache[token_hash]
     
+    record_auth_cache(hit=False)
     logger.info(f"Validating token for request to {request.url.path}")
     
     try:
@@ -273,6 +278,8 @@ async def get_authenticated_user(request: Request) -> dict:
             # Armazenar no cache
             _token_cache[token_hash] = (user_data, current_time + TOKEN_CACHE_TTL)
             
+            # Usado como chave do rate limiter
+            request.state.user_id = user_id
             return user_data
         
         except pyjwt.DecodeError as e:
@@ -529,6 +536,7 @@ def handle_error(
 
 # ========== OWNERSHIP VALIDATION ==========
 
+@traced("validate_campaign_ownership")
 async def validate_campaign_ownership(
     campaign_id: str,
     company_id: str,
@@ -561,6 +569,7 @@ async def validate_campaign_ownership(
 
 # ========== QUOTA VALIDATION ==========
 
+@traced("validate_quota_for_action")
 async def validate_quota_for_action(
     user_id: str,
     action: str,
@@ -648,8 +657,8 @@ async def validate_quota_for_action(
                        f"Seu plano atual: {user_plan_display}. Faça upgrade para acessar."
             )
     
-    # Verificar limite de uso
-    quota_check = await db.check_quota(user_id, action)
+    # Verificar limite de uso (reaproveita a quota já carregada)
+    quota_check = await db.check_quota(user_id, action, quota=quota)
     if not quota_check.get("allowed", False):
         reason = quota_check.get("reason", "Limite atingido")
         raise HTTPException(
@@ -1,17 +1,17 @@
 from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, BackgroundTasks, Request, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.exceptions import RequestValidationError
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 import os
+import hmac
+import asyncio
 import logging
 from pathlib import Path
 from typing import List, Optional
 from datetime import datetime
-import time as time_module
 import pandas as pd
 import io
 import uuid
@@ -35,9 +35,26 @@ from security_utils import (
     validate_campaign_ownership,
     validate_quota_for_action
 )
-from kiwify_webhook import webhook_router
+from kiwify_webhook import webhook_router, get_kiwify_event_queue
+from waha_webhook import waha_webhook_router
+from agent_service import get_agent_service
 from admin_endpoints import admin_router
 from security_endpoints import security_router
+from event_bus import get_event_bus, publish_campaign_status, format_sse
+from email_service import get_email_service
+from audit_service import get_audit_service
+from anti_brute_force_service import get_anti_brute_force_service
+from maintenance_scheduler import get_maintenance_scheduler
+from campaign_control import get_campaign_control
+from waha_session import get_waha_session_cache, WahaTarget
+from company_context import get_company_context, get_company_context_cache
+from realtime_listener import get_realtime_listener
+from orphan_reconciler import get_orphan_reconciler
+from user_deletion import get_user_deletion_service
+from rate_limit import create_limiter, stop_rate_limit_storage
+from metrics import PrometheusMiddleware, get_event_loop_monitor, render_metrics
+from diagnostics import get_event_loop_watchdog
+from tracing import TracingMiddleware, init_tracing, shutdown_tracing, traced
 
 # --- CORREÇÃO DO LOAD DOTENV ---
 CURRENT_DIR = Path(__file__).parent
@@ -54,8 +71,8 @@ app = FastAPI(title="Lead Dispatcher API")
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Configure rate limiter
-limiter = Limiter(key_func=get_remote_address)
+# Configure rate limiter (chave por usuário/IP real, storage via RATE_LIMIT_STORAGE_URI)
+limiter = create_limiter()
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
@@ -83,65 +100,20 @@ def get_db() -> SupabaseService:
     return get_supabase_service()
 
 
-# ========== In-memory cache for session names (Problem 3 fix) ==========
-# Cache: company_id -> (session_name, timestamp)
-_session_name_cache: dict[str, tuple[str, float]] = {}
-_SESSION_CACHE_TTL = 300  # 5 minutes
-
-
+@traced("get_session_name_for_company")
 async def get_session_name_for_company(company_id: str, company_name: str = None) -> str:
     """
     Define o nome da sessão do WhatsApp de forma segura.
     Formato: nome_empresa_id (ex: "acme_corp_efdaca5d")
-    Uses in-memory cache with 5-minute TTL to avoid repeated DB queries.
+    Usa o WahaSessionCache (LRU com TTL, invalidado quando company_settings muda).
     """
-    import re
-
-    # Check cache first
-    if company_id in _session_name_cache:
-        cached_name, cached_time = _session_name_cache[company_id]
-        if (time_module.time() - cached_time) < _SESSION_CACHE_TTL:
-            return cached_name
-
-    logger.info(f"Buscando sessão para company_id: {company_id} (cache miss)")
-
-    session_name = None
-    try:
-        db = get_db()
-        config = await db.get_waha_config(company_id)
+    target = await get_waha_session_cache().resolve(company_id, company_name)
+    return target.session_name
 
-        if config and config.get("session_name"):
-            session_name = config.get("session_name")
-            logger.info(f"Usando sessão do banco: {session_name}")
-        else:
-            if not company_name:
-                try:
-                    company_result = db.client.table('companies')\
-                        .select('name')\
-                        .eq('id', company_id)\
-                        .single()\
-                        .execute()
-                    if company_result.data:
-                        company_name = company_result.data.get('name')
-                except Exception as e:
-                    logger.warning(f"Não encontrou nome da empresa: {e}")
-
-            if company_name:
-                safe_name = re.sub(r'[^a-zA-Z0-9]', '_', company_name.lower())
-                safe_name = re.sub(r'_+', '_', safe_name).strip('_')[:30]
-                short_id = company_id.split('-')[0] if company_id else 'unknown'
-                session_name = f"{safe_name}_{short_id}"
-            else:
-                session_name = f"company_{company_id.split('-')[0] if company_id else 'unknown'}"
-                logger.warning(f"Usando fallback: {session_name}")
 
-    except Exception as e:
-        logger.warning(f"Usando sessão padrão devido a erro: {e}")
-        session_name = f"company_{company_id.split('-')[0] if company_id else 'unknown'}"
-
-    # Store in cache
-    _session_name_cache[company_id] = (session_name, time_module.time())
-    return session_name
+async def get_waha_target(company_id: str) -> WahaTarget:
+    """URL, chave e sessão do WAHA da empresa (cache)"""
+    return await get_waha_session_cache().resolve(company_id)
 
 
 def calculate_campaign_stats(campaign: dict) -> CampaignStats:
@@ -214,33 +186,19 @@ async def debug_whatsapp_session(
     company_id = auth_user.get("company_id")
     user_id = auth_user.get("user_id")
     
-    db = get_db()
-    
-    # Buscar dados da empresa
-    company_data = None
-    try:
-        company_result = db.client.table('companies')\
-            .select('id, name')\
-            .eq('id', company_id)\
-            .single()\
-            .execute()
-        company_data = company_result.data
-    except Exception as e:
-        company_data = {"error": str(e)}
-    
-    # Buscar config da sessão
-    waha_config = await db.get_waha_config(company_id)
-    
-    # Calcular nome da sessão que seria gerado
-    session_name = await get_session_name_for_company(company_id)
+    # Contexto da empresa (cache; invalidado quando companies/company_settings mudam)
+    context = await get_company_context(company_id)
+    waha_session = context.settings.get("waha_session")
     
     return {
         "user_id": user_id,
         "company_id": company_id,
-        "company_data": company_data,
-        "waha_config_from_db": waha_config,
-        "computed_session_name": session_name,
-        "waha_url": os.getenv('WAHA_DEFAULT_URL'),
+        "company_data": {"id": company_id, "name": context.name} if context.name else None,
+        "waha_config_from_db": {"session_name": waha_session} if waha_session else None,
+        "computed_session_name": context.waha.session_name,
+        "waha_url": context.waha.waha_url,
+        "timezone": str(context.timezone),
+        "plan_type": (context.plan or {}).get("plan_type"),
     }
 
 
@@ -255,13 +213,11 @@ async def get_whatsapp_status(
     if not company_id:
         return {"status": "DISCONNECTED", "connected": False, "error": "Company ID não encontrado"}
 
-    waha_url = os.getenv('WAHA_DEFAULT_URL')
-    waha_key = os.getenv('WAHA_MASTER_KEY')
+    waha_url, waha_key, session_name = await get_waha_target(company_id)
     
     if not waha_url:
         return {"status": "DISCONNECTED", "connected": False, "error": "Server config error"}
 
-    session_name = await get_session_name_for_company(company_id)
     waha = WahaService(waha_url, waha_key, session_name)
     
     conn = await waha.check_connection()
@@ -295,9 +251,7 @@ async def start_whatsapp_session(
     if not company_id:
         raise HTTPException(status_code=400, detail="Company ID não encontrado")
     
-    waha_url = os.getenv('WAHA_DEFAULT_URL')
-    waha_key = os.getenv('WAHA_MASTER_KEY')
-    session_name = await get_session_name_for_company(company_id)
+    waha_url, waha_key, session_name = await get_waha_target(company_id)
     
     logger.info(f"🚀 Iniciando sessão: {session_name} para empresa: {company_id}")
 
@@ -317,9 +271,7 @@ async def stop_whatsapp_session(
     if not company_id:
         raise HTTPException(status_code=400, detail="Company ID não encontrado")
     
-    waha_url = os.getenv('WAHA_DEFAULT_URL')
-    waha_key = os.getenv('WAHA_MASTER_KEY')
-    session_name = await get_session_name_for_company(company_id)
+    waha_url, waha_key, session_name = await get_waha_target(company_id)
 
     waha = WahaService(waha_url, waha_key, session_name)
     success = await waha.stop_session()
@@ -334,9 +286,7 @@ async def logout_whatsapp_session(
     if not company_id:
         raise HTTPException(status_code=400, detail="Company ID não encontrado")
     
-    waha_url = os.getenv('WAHA_DEFAULT_URL')
-    waha_key = os.getenv('WAHA_MASTER_KEY')
-    session_name = await get_session_name_for_company(company_id)
+    waha_url, waha_key, session_name = await get_waha_target(company_id)
 
     waha = WahaService(waha_url, waha_key, session_name)
     success = await waha.logout_session()
@@ -351,9 +301,7 @@ async def get_whatsapp_qr(
     if not company_id:
         raise HTTPException(status_code=400, detail="Company ID não encontrado")
     
-    waha_url = os.getenv('WAHA_DEFAULT_URL')
-    waha_key = os.getenv('WAHA_MASTER_KEY')
-    session_name = await get_session_name_for_company(company_id)
+    waha_url, waha_key, session_name = await get_waha_target(company_id)
 
     waha = WahaService(waha_url, waha_key, session_name)
     return await waha.get_qr_code()
@@ -379,9 +327,7 @@ async def validate_leads_batch(
         company_id = auth_user["company_id"]
         
         # 1. Configurar WAHA
-        waha_url = os.getenv('WAHA_DEFAULT_URL')
-        waha_key = os.getenv('WAHA_MASTER_KEY')
-        session_name = await get_session_name_for_company(company_id)
+        waha_url, waha_key, session_name = await get_waha_target(company_id)
         waha = WahaService(waha_url, waha_key, session_name)
         
         # 2. Verificar conexão
@@ -704,12 +650,12 @@ async def delete_campaign(
             auth_user["company_id"],
             db
         )
-        await stop_campaign_worker(campaign_id)
-        await db.delete_contacts_by_campaign(campaign_id)
-        await db.delete_message_logs_by_campaign(campaign_id)
-        result = await db.delete_campaign(campaign_id)
-        if not result:
+        await stop_campaign_worker(campaign_id, "deleted")
+        # Logs, contatos e campanha em uma transação
+        deleted = await db.delete_campaigns_cascade([campaign_id])
+        if not deleted.get('campaigns'):
             raise HTTPException(status_code=404, detail="Campanha não encontrada")
+        publish_campaign_status(auth_user["company_id"], campaign_id, "deleted")
         return {"success": True, "message": "Campanha excluída com sucesso"}
     except HTTPException:
         raise
@@ -780,6 +726,8 @@ async def upload_contacts(
                 detail=f"Coluna de telefone não encontrada. Colunas disponíveis: {list(df.columns)}"
             )
         
+        # Lista nova: um worker em execução não pode continuar enviando
+        await stop_campaign_worker(campaign_id, "ready")
         await db.delete_contacts_by_campaign(campaign_id)
         
         contacts = []
@@ -823,6 +771,7 @@ async def upload_contacts(
             "error_count": 0,
             "status": "ready"
         })
+        publish_campaign_status(auth_user["company_id"], campaign_id, "ready")
         
         return {
             "success": True,
@@ -890,8 +839,10 @@ async def start_campaign(
         if campaign_data.get("total_contacts", 0) == 0:
             raise HTTPException(status_code=400, detail="Campanha não tem contatos. Faça upload primeiro.")
         
-        final_waha_url = os.getenv('WAHA_DEFAULT_URL') or waha_url
-        final_waha_key = os.getenv('WAHA_MASTER_KEY') or waha_api_key
+        target_company_id = auth_user["company_id"]
+        target = await get_waha_target(target_company_id)
+        final_waha_url = target.waha_url or waha_url
+        final_waha_key = target.waha_key or waha_api_key
         
         if not final_waha_url or not final_waha_key:
             raise HTTPException(
@@ -899,11 +850,10 @@ async def start_campaign(
                 detail="Erro de configuração: WAHA_DEFAULT_URL não configurada no servidor."
             )
         
-        target_company_id = auth_user["company_id"]
         if waha_session and waha_session != "default":
             final_session = waha_session
         else:
-            final_session = await get_session_name_for_company(target_company_id)
+            final_session = target.session_name
 
         waha = WahaService(final_waha_url, final_waha_key, final_session)
         connection = await waha.check_connection()
@@ -923,6 +873,7 @@ async def start_campaign(
             await db.update_campaign(campaign_id, {"status": "ready"})
             raise HTTPException(status_code=400, detail=error or "Campanha já em execução")
         
+        publish_campaign_status(target_company_id, campaign_id, "running")
         await db.increment_quota(auth_user["user_id"], "start_campaign")
         return {"success": True, "message": "Campanha iniciada com sucesso"}
     except HTTPException:
@@ -943,8 +894,9 @@ async def pause_campaign(
             auth_user["company_id"],
             db
         )
-        await stop_campaign_worker(campaign_id)
+        await stop_campaign_worker(campaign_id, "paused")
         await db.update_campaign(campaign_id, {"status": "paused"})
+        publish_campaign_status(auth_user["company_id"], campaign_id, "paused")
         return {"success": True, "message": "Campanha pausada"}
     except HTTPException:
         raise
@@ -964,8 +916,9 @@ async def cancel_campaign(
             auth_user["company_id"],
             db
         )
-        await stop_campaign_worker(campaign_id)
+        await stop_campaign_worker(campaign_id, "cancelled")
         await db.update_campaign(campaign_id, {"status": "cancelled"})
+        publish_campaign_status(auth_user["company_id"], campaign_id, "cancelled")
         return {"success": True, "message": "Campanha cancelada"}
     except HTTPException:
         raise
@@ -985,7 +938,7 @@ async def reset_campaign(
             auth_user["company_id"],
             db
         )
-        await stop_campaign_worker(campaign_id)
+        await stop_campaign_worker(campaign_id, "reset")
         await db.reset_contacts_status(campaign_id)
         total = await db.count_contacts(campaign_id)
         await db.update_campaign(campaign_id, {
@@ -998,6 +951,7 @@ async def reset_campaign(
             "completed_at": None
         })
         await db.delete_message_logs_by_campaign(campaign_id)
+        publish_campaign_status(auth_user["company_id"], campaign_id, "ready")
         return {"success": True, "message": "Campanha resetada"}
     except HTTPException:
         raise
@@ -1041,6 +995,50 @@ async def get_dashboard_stats(auth_user: dict = Depends(get_authenticated_user))
         raise handle_error(e, "Erro ao buscar estatísticas")
 
 
+# ========== Real-time Events (SSE) ==========
+SSE_HEARTBEAT_INTERVAL = 15  # seconds
+
+
+@api_router.get("/events")
+async def stream_events(
+    request: Request,
+    auth_user: dict = Depends(get_authenticated_user)
+):
+    """
+    Stream Server-Sent Events com progresso de campanhas, mudanças de status
+    e novas notificações. Substitui o polling dos endpoints de campanhas/notificações.
+    """
+    bus = get_event_bus()
+    subscription = bus.subscribe(auth_user["user_id"], auth_user.get("company_id"))
+
+    async def event_stream():
+        try:
+            yield "retry: 5000\n\n"
+            while not subscription.closed:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event = await subscription.get(timeout=SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if event is None:
+                    break
+                yield format_sse(event)
+        finally:
+            bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
 @api_router.get("/notifications")
 async def get_notifications(
     auth_user: dict = Depends(get_authenticated_user),
@@ -1143,9 +1141,54 @@ async def increment_quota_endpoint(
         raise handle_error(e, "Erro ao incrementar quota")
 
 
+# ========== Lifecycle ==========
+@app.on_event("startup")
+async def start_background_services():
+    try:
+        init_tracing()
+        get_event_loop_monitor().start()
+        get_event_loop_watchdog().start()
+        get_db().quota_ledger.start()
+        get_email_service().queue.start()
+        get_kiwify_event_queue().start()
+        get_agent_service().start()
+        get_campaign_control().start()
+        get_waha_session_cache().start()
+        get_company_context_cache().start()
+        get_realtime_listener().start()
+        get_audit_service().start()
+        get_anti_brute_force_service().start()
+        get_maintenance_scheduler().start()
+    except Exception as e:
+        logger.error(f"❌ Erro ao iniciar serviços em background: {e}")
+
+
+@app.on_event("shutdown")
+async def stop_background_services():
+    try:
+        await get_maintenance_scheduler().stop()
+        await get_orphan_reconciler().stop()
+        await get_user_deletion_service().stop()
+        await stop_rate_limit_storage()
+        await get_anti_brute_force_service().stop()
+        await get_audit_service().stop()
+        await get_campaign_control().stop()
+        await get_realtime_listener().stop()
+        await get_agent_service().stop()
+        await get_kiwify_event_queue().stop()
+        await get_email_service().queue.stop()
+        await get_db().quota_ledger.stop()
+        await get_event_loop_watchdog().stop()
+        await get_event_loop_monitor().stop()
+        shutdown_tracing()
+    except Exception as e:
+        logger.error(f"❌ Erro ao finalizar serviços em background: {e}")
+
+
 # Include the router in the main app
 app.include_router(api_router)
 app.include_router(webhook_router)
+app.include_router(waha_webhook_router)
 app.include_router(admin_router)
 app.include_router(security_router)
 
@@ -1171,4 +1214,23 @@ async def add_security_headers(request: Request, call_next):
     response.headers["X-Frame-Options"] = "DENY"
     response.headers["X-XSS-Protection"] = "1; mode=block"
     response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-    return response
\ No newline at end of file
+    return response
+
+
+# Latência por rota (mede também os outros middlewares)
+app.add_middleware(PrometheusMiddleware)
+# Span por requisição (mais externo; no-op sem OTEL_ENABLED)
+app.add_middleware(TracingMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """Métricas Prometheus. Exige Bearer METRICS_TOKEN; sem token configurado, 404."""
+    metrics_token = os.environ.get('METRICS_TOKEN')
+    if not metrics_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    authorization = request.headers.get("Authorization") or ""
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {metrics_token}".encode()):
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
\ No newline at end of file
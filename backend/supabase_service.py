@@ -3,13 +3,33 @@ Supabase Database Service
 Handles all database operations using Supabase REST API
 """
 import os
+import asyncio
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 from supabase import create_client, Client
 import logging
+from event_bus import get_event_bus
+from cache_utils import TTLCache
+from quota_ledger import QuotaLedger
+from metrics import instrument_postgrest
+from tracing import trace_public_methods
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+
+
+def _postgrest_quote(value: Any) -> str:
+    """Double-quoted value for or()/and() filters, so , . ( ) are taken literally"""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _ilike_contains(text: str) -> str:
+    """Quoted ILIKE 'contains' pattern with the user's wildcards escaped
+    (PostgREST turns every * into %, so a literal * can only match as _)"""
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace('*', '_')
+    return _postgrest_quote(f'*{escaped}*')
+
 
 class SupabaseService:
     
@@ -21,23 +41,51 @@ class SupabaseService:
         if not self.url or not self.key:
             raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY (or SUPABASE_KEY) must be set")
         
+        instrument_postgrest()
         self.client: Client = create_client(self.url, self.key)
 
+        # Contadores de notificações não lidas por usuário. Mantidos pelas escritas
+        # (create/mark read) e reconciliados com o banco quando a entrada expira.
+        self._unread_counts = TTLCache(
+            maxsize=int(os.environ.get('UNREAD_COUNT_CACHE_SIZE', '10000')),
+            ttl=float(os.environ.get('UNREAD_COUNT_CACHE_TTL', '120')),
+            name="unread_notifications"
+        )
+
+        # Cache de quotas + incrementos acumulados (gravados em lote)
+        self.quota_ledger = QuotaLedger(self)
+
+        # agent_configs por empresa (lido a cada mensagem recebida pelo agente de IA)
+        self._agent_configs = TTLCache(
+            maxsize=int(os.environ.get('AGENT_CONFIG_CACHE_SIZE', '5000')),
+            ttl=float(os.environ.get('AGENT_CONFIG_CACHE_TTL', '60')),
+            name="agent_configs"
+        )
+
     # ... (dentro da classe SupabaseService)
 
     async def get_agent_config(self, company_id: str) -> Optional[dict]:
-        """Busca a configuração do agente da empresa"""
+        """Busca a configuração do agente da empresa (cache com TTL, inclusive ausência)"""
+        cached = self._agent_configs.get(company_id, _MISSING)
+        if cached is not _MISSING:
+            return cached
         try:
             response = self.client.table("agent_configs")\
                 .select("*")\
                 .eq("company_id", company_id)\
-                .single()\
+                .limit(1)\
                 .execute()
-            return response.data
+            config = response.data[0] if response.data else None
         except Exception as e:
-            # Se não encontrar (erro da API), retorna None
+            # Erro da API: retorna None sem cachear
             # O frontend tratará criando um default
             return None
+        self._agent_configs.set(company_id, config)
+        return config
+
+    def invalidate_agent_config(self, company_id: str) -> None:
+        """Chamado quando agent_configs da empresa muda"""
+        self._agent_configs.pop(company_id)
 
     async def upsert_agent_config(self, company_id: str, config_data: dict) -> dict:
         """Cria ou atualiza a configuração do agente"""
@@ -53,6 +101,7 @@ class SupabaseService:
             response = self.client.table("agent_configs")\
                 .upsert(config_data, on_conflict="company_id")\
                 .execute()
+            self.invalidate_agent_config(company_id)
             
             if response.data:
                 return response.data[0]
@@ -79,7 +128,11 @@ class SupabaseService:
                 session = result.data[0].get('waha_session')
                 # Ignorar "default" - significa que não foi configurado corretamente
                 if session and session.lower() != 'default':
-                    return {"session_name": session}
+                    return {
+                        "session_name": session,
+                        "waha_api_url": result.data[0].get('waha_api_url'),
+                        "waha_api_key": result.data[0].get('waha_api_key')
+                    }
             
             # 2. Fallback: Tenta buscar na tabela 'waha_configs' (legado)
             try:
@@ -133,6 +186,24 @@ class SupabaseService:
         """Delete a campaign"""
         result = self.client.table('campaigns').delete().eq('id', campaign_id).execute()
         return len(result.data) > 0 if result.data else False
+
+    async def delete_campaigns_cascade(self, campaign_ids: List[str]) -> Dict[str, int]:
+        """
+        Delete campaigns with their message_logs and contacts in one transaction
+        (RPC delete_campaigns_cascade). Returns deleted row counts per table.
+        """
+        if not campaign_ids:
+            return {'message_logs': 0, 'campaign_contacts': 0, 'campaigns': 0}
+        try:
+            result = self.client.rpc('delete_campaigns_cascade', {'p_campaign_ids': campaign_ids}).execute()
+            return result.data
+        except Exception as e:
+            logger.warning(f"RPC delete_campaigns_cascade unavailable, using set-based deletes: {e}")
+        counts = {}
+        for table, column in (('message_logs', 'campaign_id'), ('campaign_contacts', 'campaign_id'), ('campaigns', 'id')):
+            result = self.client.table(table).delete().in_(column, campaign_ids).execute()
+            counts[table] = len(result.data) if result.data else 0
+        return counts
     
     async def increment_campaign_counter(self, campaign_id: str, field: str, value: int = 1) -> None:
         """Increment a campaign counter atomically (sent_count, error_count, pending_count)"""
@@ -280,6 +351,63 @@ class SupabaseService:
         
         return result.count or 0
     
+    # ========== Retention ==========
+    async def purge_old_rows(self, table: str, before: datetime, batch_size: int = 5000) -> int:
+        """
+        Delete rows with created_at < before in chunks (RPC purge_old_rows).
+        Falls back to select-ids + delete when the RPC is not installed.
+        """
+        total = 0
+        while True:
+            try:
+                result = self.client.rpc('purge_old_rows', {
+                    'p_table': table,
+                    'p_before': before.isoformat(),
+                    'p_batch_size': batch_size
+                }).execute()
+                deleted = result.data or 0
+            except Exception as e:
+                if total:
+                    raise
+                logger.warning(f"RPC purge_old_rows unavailable, using chunked delete for {table}: {e}")
+                return await self._purge_old_rows_fallback(table, before, batch_size)
+            total += deleted
+            if deleted < batch_size:
+                return total
+            await asyncio.sleep(0)
+
+    async def _purge_old_rows_fallback(self, table: str, before: datetime, batch_size: int) -> int:
+        total = 0
+        while True:
+            result = self.client.table(table)\
+                .select('id')\
+                .lt('created_at', before.isoformat())\
+                .order('created_at')\
+                .limit(batch_size)\
+                .execute()
+            ids = [row['id'] for row in (result.data or [])]
+            if not ids:
+                return total
+            self.client.table(table).delete().in_('id', ids).execute()
+            total += len(ids)
+            if len(ids) < batch_size:
+                return total
+            await asyncio.sleep(0)
+
+    async def compact_message_logs(self, before: datetime, batch_size: int = 5000) -> int:
+        """Roll message_logs older than `before` into message_log_daily_stats and delete them"""
+        total = 0
+        while True:
+            result = self.client.rpc('compact_message_logs', {
+                'p_before': before.isoformat(),
+                'p_batch_size': batch_size
+            }).execute()
+            compacted = result.data or 0
+            total += compacted
+            if compacted < batch_size:
+                return total
+            await asyncio.sleep(0)
+    
     # ========== Dashboard Stats ==========
     async def get_dashboard_stats(self, company_id: str) -> Dict[str, Any]:
         """Get dashboard statistics for a company"""
@@ -345,13 +473,19 @@ class SupabaseService:
         return result.data or []
     
     async def get_unread_notification_count(self, user_id: str) -> int:
-        """Get unread notification count"""
+        """Get unread notification count (cached per user, reconciled on TTL expiry)"""
+        cached = self._unread_counts.get(user_id)
+        if cached is not None:
+            return cached
+
         result = self.client.table('notifications')\
             .select('id', count='exact')\
             .eq('user_id', user_id)\
             .eq('read', False)\
             .execute()
-        return result.count or 0
+        count = result.count or 0
+        self._unread_counts.set(user_id, count)
+        return count
     
     async def mark_notification_read(self, notification_id: str) -> bool:
         """Mark notification as read"""
@@ -360,7 +494,11 @@ class SupabaseService:
                 .update({'read': True, 'read_at': datetime.utcnow().isoformat()})\
                 .eq('id', notification_id)\
                 .execute()
-            return len(result.data) > 0 if result.data else False
+            if not result.data:
+                return False
+            # Não sabemos se já estava lida: invalida e deixa o próximo GET recontar
+            self._unread_counts.pop(result.data[0].get('user_id'))
+            return True
         except Exception as e:
             logger.error(f"Error marking notification as read: {e}")
             return False
@@ -373,6 +511,7 @@ class SupabaseService:
                 .eq('user_id', user_id)\
                 .eq('read', False)\
                 .execute()
+            self._unread_counts.set(user_id, 0)
             return True
         except Exception as e:
             logger.error(f"Error marking all notifications as read: {e}")
@@ -401,14 +540,27 @@ class SupabaseService:
                 'read': False
             }
             result = self.client.table('notifications').insert(notification_data).execute()
-            return result.data[0]['id'] if result.data else None
+            if not result.data:
+                return None
+            cached = self._unread_counts.get(user_id)
+            if cached is not None:
+                self._unread_counts.replace(user_id, cached + 1)
+            get_event_bus().publish_to_user(user_id, "notification", result.data[0])
+            return result.data[0]['id']
         except Exception as e:
             logger.error(f"Error creating notification: {e}")
             return None
     
     # ========== Quotas ==========
-    async def get_user_quota(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """Get user quota"""
+    QUOTA_ACTION_FIELDS = {
+        'create_campaign': ('campaigns_limit', 'campaigns_used'),
+        'send_message': ('messages_limit', 'messages_used'),
+        'search_leads': ('leads_limit', 'leads_used'),
+        'start_campaign': ('campaigns_limit', 'campaigns_used'),
+    }
+
+    async def fetch_user_quota(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get user quota directly from the database (bypasses the ledger cache)"""
         try:
             result = self.client.table('user_quotas')\
                 .select('*')\
@@ -419,29 +571,34 @@ class SupabaseService:
         except Exception as e:
             logger.error(f"Error getting user quota: {e}")
             return None
+
+    async def get_user_quota(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get user quota (cached, including increments not yet flushed)"""
+        try:
+            return await self.quota_ledger.get_quota(user_id)
+        except Exception as e:
+            logger.error(f"Error getting user quota: {e}")
+            return None
+
+    def invalidate_user_quota(self, user_id: str, discard_pending: bool = False) -> None:
+        """Drop cached quota after plan/limit changes (Kiwify webhook, admin endpoints)"""
+        self.quota_ledger.invalidate(user_id, discard_pending=discard_pending)
     
-    async def check_quota(self, user_id: str, action: str) -> Dict[str, Any]:
+    async def check_quota(self, user_id: str, action: str, quota: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Check if user can perform action based on quota limits"""
         try:
-            # Buscar quota do usuário diretamente (evita problema de função RPC duplicada)
-            quota = await self.get_user_quota(user_id)
+            # Reutiliza a quota já carregada pelo chamador, se houver
+            if quota is None:
+                quota = await self.get_user_quota(user_id)
             
             if not quota:
                 return {'allowed': False, 'reason': 'Quota não encontrada'}
             
-            # Mapear ação para campo de limite e uso
-            action_map = {
-                'create_campaign': ('campaigns_limit', 'campaigns_used'),
-                'send_message': ('messages_limit', 'messages_used'),
-                'search_leads': ('leads_limit', 'leads_used'),
-                'start_campaign': ('campaigns_limit', 'campaigns_used'),
-            }
-            
-            if action not in action_map:
+            if action not in self.QUOTA_ACTION_FIELDS:
                 # Ação não mapeada - permitir por padrão
                 return {'allowed': True, 'reason': 'OK'}
             
-            limit_field, used_field = action_map[action]
+            limit_field, used_field = self.QUOTA_ACTION_FIELDS[action]
             limit = quota.get(limit_field, 0)
             used = quota.get(used_field, 0)
             
@@ -465,45 +622,59 @@ class SupabaseService:
             return {'allowed': True, 'reason': 'Erro na verificação (permitido por padrão)'}
     
     async def increment_quota(self, user_id: str, action: str, amount: int = 1) -> bool:
-        """Increment quota usage atomically via RPC to prevent race conditions"""
+        """Record quota usage in the ledger; flushed to the database in batches"""
         try:
-            action_map = {
-                'create_campaign': 'campaigns_used',
-                'send_message': 'messages_used',
-                'search_leads': 'leads_used',
-                'start_campaign': 'campaigns_used',
-            }
-
-            used_field = action_map.get(action)
-            if not used_field:
+            fields = self.QUOTA_ACTION_FIELDS.get(action)
+            if not fields:
                 logger.warning(f"Action {action} not mapped for quota increment")
                 return True
 
-            # Use atomic RPC function (prevents race conditions)
-            try:
-                self.client.rpc('increment_quota_atomic', {
-                    'p_user_id': user_id,
-                    'p_field': used_field,
-                    'p_amount': amount,
-                }).execute()
-                return True
-            except Exception as rpc_err:
-                # Fallback: direct update if RPC not yet deployed
-                logger.warning(f"RPC increment_quota_atomic not available, using fallback: {rpc_err}")
-                quota = await self.get_user_quota(user_id)
-                if not quota:
-                    return False
-                current_value = quota.get(used_field, 0) or 0
-                new_value = current_value + amount
-                self.client.table('user_quotas')\
-                    .update({used_field: new_value})\
-                    .eq('user_id', user_id)\
-                    .execute()
-                return True
+            self.quota_ledger.record_increment(user_id, fields[1], amount)
+            return True
 
         except Exception as e:
             logger.error(f"Error incrementing quota: {e}")
             return False
+
+    async def apply_quota_increments(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Apply accumulated quota increments atomically.
+        items: [{'user_id', 'field', 'amount'}]. Returns the items that failed.
+        """
+        if not items:
+            return []
+
+        try:
+            self.client.rpc('increment_quota_batch', {'p_items': items}).execute()
+            return []
+        except Exception as batch_err:
+            logger.warning(f"RPC increment_quota_batch not available, applying one by one: {batch_err}")
+
+        failed = []
+        for item in items:
+            try:
+                # Use atomic RPC function (prevents race conditions)
+                try:
+                    self.client.rpc('increment_quota_atomic', {
+                        'p_user_id': item['user_id'],
+                        'p_field': item['field'],
+                        'p_amount': item['amount'],
+                    }).execute()
+                except Exception as rpc_err:
+                    # Fallback: direct update if RPC not yet deployed
+                    logger.warning(f"RPC increment_quota_atomic not available, using fallback: {rpc_err}")
+                    quota = await self.fetch_user_quota(item['user_id'])
+                    if not quota:
+                        continue
+                    current_value = quota.get(item['field'], 0) or 0
+                    self.client.table('user_quotas')\
+                        .update({item['field']: current_value + item['amount']})\
+                        .eq('user_id', item['user_id'])\
+                        .execute()
+            except Exception as e:
+                logger.error(f"Error incrementing quota: {e}")
+                failed.append(item)
+        return failed
     
     async def upgrade_plan(self, user_id: str, plan_type: str, plan_name: str) -> bool:
         """Upgrade user plan"""
@@ -518,6 +689,211 @@ class SupabaseService:
             logger.error(f"Error upgrading plan: {e}")
             return False
     
+    # ========== Admin ==========
+    ADMIN_USER_SORTS = ('created_at', 'email', 'plan_type', 'status', 'expires_at')
+
+    async def list_users_admin(
+        self,
+        limit: int = 50,
+        sort: str = 'created_at',
+        descending: bool = True,
+        plan_type: Optional[str] = None,
+        status: Optional[str] = None,
+        expires_before: Optional[datetime] = None,
+        expires_after: Optional[datetime] = None,
+        search: Optional[str] = None,
+        cursor: Optional[tuple] = None,
+        offset: int = 0,
+        include_total: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Page of profiles joined with user_quotas in one round trip (RPC admin_list_users).
+        cursor: (sort_key, id) of the last row of the previous page (keyset pagination).
+        Returns {'users': [...], 'total': int | None}; each user carries 'sort_key'.
+        """
+        params = {
+            'p_limit': limit,
+            'p_sort': sort,
+            'p_desc': descending,
+            'p_plan_type': plan_type,
+            'p_status': status,
+            'p_expires_before': expires_before.isoformat() if expires_before else None,
+            'p_expires_after': expires_after.isoformat() if expires_after else None,
+            'p_search': search,
+            'p_cursor_value': str(cursor[0]) if cursor else None,
+            'p_cursor_id': cursor[1] if cursor else None,
+            'p_offset': 0 if cursor else offset,
+            'p_include_total': include_total,
+        }
+        try:
+            result = self.client.rpc('admin_list_users', params).execute()
+            return result.data or {'users': [], 'total': None}
+        except Exception as e:
+            logger.warning(f"RPC admin_list_users unavailable, using two-query fallback: {e}")
+            return await self._list_users_admin_fallback(params)
+
+    ADMIN_FALLBACK_MAX_PAGES = 20
+
+    async def _list_users_admin_fallback(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        profiles pages + one batched user_quotas query per page. Quota filters run
+        here, so more pages are read until the page is full (up to
+        ADMIN_FALLBACK_MAX_PAGES); 'next' is the (sort_key, id) to continue from.
+        """
+        sort = params['p_sort'] if params['p_sort'] in ('created_at', 'email') else 'created_at'
+        descending = params['p_desc']
+        limit = params['p_limit']
+        op = 'lt' if descending else 'gt'
+
+        search_filter = None
+        if params['p_search']:
+            pattern = _ilike_contains(params['p_search'])
+            search_filter = f"email.ilike.{pattern},full_name.ilike.{pattern}"
+        cursor = None
+        if params['p_cursor_value'] is not None and params['p_sort'] == sort:
+            cursor = (params['p_cursor_value'], params['p_cursor_id'])
+        offset = params['p_offset']
+
+        users: List[Dict[str, Any]] = []
+        next_cursor = None
+        for _ in range(self.ADMIN_FALLBACK_MAX_PAGES):
+            query = self.client.table('profiles')\
+                .select('id, email, full_name, company_id, created_at')\
+                .order(sort, desc=descending)\
+                .order('id', desc=descending)
+            filters = [search_filter] if search_filter else []
+            if cursor:
+                value, last_id = _postgrest_quote(cursor[0]), _postgrest_quote(cursor[1])
+                filters.append(f"{sort}.{op}.{value},and({sort}.eq.{value},id.{op}.{last_id})")
+            if len(filters) == 1:
+                query = query.or_(filters[0])
+            elif filters:
+                # Two or() params are not guaranteed to be ANDed: combine them explicitly
+                query = query.or_(f"and({','.join(f'or({f})' for f in filters)})")
+            result = query.range(offset, offset + limit - 1).execute()
+            profiles = result.data or []
+
+            quotas = {}
+            if profiles:
+                quota_result = self.client.table('user_quotas')\
+                    .select('user_id, plan_type, plan_name, subscription_status, plan_expires_at')\
+                    .in_('user_id', [p['id'] for p in profiles])\
+                    .execute()
+                quotas = {q['user_id']: q for q in (quota_result.data or [])}
+
+            for profile in profiles:
+                quota = quotas.get(profile['id'], {})
+                user = {
+                    **profile,
+                    'plan_type': quota.get('plan_type'),
+                    'plan_name': quota.get('plan_name'),
+                    'subscription_status': quota.get('subscription_status'),
+                    'plan_expires_at': quota.get('plan_expires_at'),
+                    'sort_key': profile.get(sort),
+                }
+                expires_at = user['plan_expires_at']
+                if params['p_plan_type'] and (user['plan_type'] or 'sem_plano') != params['p_plan_type']:
+                    continue
+                if params['p_status'] and (user['subscription_status'] or 'inactive') != params['p_status']:
+                    continue
+                if params['p_expires_before'] and not (expires_at and expires_at < params['p_expires_before']):
+                    continue
+                if params['p_expires_after'] and not (expires_at and expires_at >= params['p_expires_after']):
+                    continue
+                users.append(user)
+
+            if len(users) >= limit:
+                users = users[:limit]
+                next_cursor = (users[-1]['sort_key'], users[-1]['id'])
+                break
+            if len(profiles) < limit:
+                # Last page
+                next_cursor = None
+                break
+            cursor = (str(profiles[-1].get(sort)), profiles[-1]['id'])
+            offset = 0
+            next_cursor = (profiles[-1].get(sort), profiles[-1]['id'])
+
+        total = None
+        filtered = any(params[k] for k in ('p_plan_type', 'p_status', 'p_expires_before', 'p_expires_after', 'p_search'))
+        if params['p_include_total'] and not filtered:
+            total = self.client.table('profiles').select('id', count='exact').limit(1).execute().count
+        return {'users': users, 'total': total, 'next': next_cursor}
+
+    USER_OWNED_TABLES = (
+        ('user_quotas', 'user_id'),
+        ('user_roles', 'user_id'),
+        ('leads', 'user_id'),
+        ('search_history', 'user_id'),
+        ('notifications', 'user_id'),
+        ('profiles', 'id'),
+    )
+
+    async def get_user_campaign_sizes(self, user_id: str) -> List[Dict[str, Any]]:
+        """Campaign ids of a user with their contact totals (sizes a cascading delete)"""
+        result = self.client.table('campaigns')\
+            .select('id, total_contacts')\
+            .eq('user_id', user_id)\
+            .order('id')\
+            .execute()
+        return result.data or []
+
+    async def delete_user_cascade(self, user_id: str) -> Dict[str, int]:
+        """
+        Delete everything a user owns (campaigns and their rows, quotas, roles, leads,
+        search history, notifications, profile) in one transaction (RPC delete_user_cascade).
+        auth.users is not touched. Returns deleted row counts per table.
+        """
+        try:
+            result = self.client.rpc('delete_user_cascade', {'p_user_id': user_id}).execute()
+            return result.data
+        except Exception as e:
+            logger.warning(f"RPC delete_user_cascade unavailable, using set-based deletes: {e}")
+        campaigns = await self.get_user_campaign_sizes(user_id)
+        counts = await self.delete_campaigns_cascade([c['id'] for c in campaigns])
+        for table, column in self.USER_OWNED_TABLES:
+            result = self.client.table(table).delete().eq(column, user_id).execute()
+            counts[table] = len(result.data) if result.data else 0
+        return counts
+
+    # ========== Admin Jobs ==========
+    async def save_admin_job(self, job: Dict[str, Any]) -> bool:
+        """Upsert of a background admin job row (progress/checkpoint snapshot)"""
+        try:
+            self.client.table('admin_jobs').upsert({
+                **job,
+                'updated_at': datetime.utcnow().isoformat()
+            }, on_conflict='id').execute()
+            return True
+        except Exception as e:
+            logger.warning(f"Error saving admin job {job.get('id')}: {e}")
+            return False
+
+    async def get_admin_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            result = self.client.table('admin_jobs')\
+                .select('*')\
+                .eq('id', job_id)\
+                .limit(1)\
+                .execute()
+            return result.data[0] if result.data else None
+        except Exception as e:
+            logger.error(f"Error fetching admin job {job_id}: {e}")
+            return None
+
+    async def list_admin_jobs(self, kind: str, limit: int = 20) -> List[Dict[str, Any]]:
+        try:
+            result = self.client.table('admin_jobs')\
+                .select('*')\
+                .eq('kind', kind)\
+                .order('created_at', desc=True)\
+                .limit(limit)\
+                .execute()
+            return result.data or []
+        except Exception as e:
+            logger.error(f"Error listing admin jobs: {e}")
+            return []
+
     # ========== Company Settings ==========
     async def get_company_settings(self, company_id: str) -> Optional[Dict[str, Any]]:
         """Get company settings including SERP API key"""
@@ -533,29 +909,9 @@ class SupabaseService:
             logger.error(f"Error fetching company settings: {e}")
             return None
 
-    # ========== NOVO MÉTODO PARA TIMEZONE ==========
-    async def get_company_settings_with_timezone(self, company_id: str) -> Dict[str, Any]:
-        """
-        Busca configurações da empresa incluindo o timezone da tabela 'companies'.
-        Retorna um dicionário com keys seguras.
-        """
-        try:
-            # Busca timezone na tabela companies
-            company_result = self.client.table('companies')\
-                .select('timezone')\
-                .eq('id', company_id)\
-                .limit(1)\
-                .execute()
-            
-            timezone = "America/Sao_Paulo"
-            if company_result.data:
-                timezone = company_result.data[0].get('timezone', "America/Sao_Paulo")
-            
-            return {"timezone": timezone}
-        except Exception as e:
-            logger.error(f"Error fetching company timezone: {e}")
-            return {"timezone": "America/Sao_Paulo"}
 
+# Um span por método público (no-op sem OTEL_ENABLED)
+trace_public_methods(SupabaseService, "supabase")
 
 # Global instance
 _supabase_service: Optional[SupabaseService] = None
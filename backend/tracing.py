@@ -0,0 +1,167 @@
+"""
+Tracing
+Spans OpenTelemetry para rotas, SupabaseService, chamadas WAHA e o loop do worker
+
+Desativado por padrão (OTEL_ENABLED=false): span() devolve um contexto vazio
+compartilhado e os wrappers só verificam uma flag, sem importar o SDK.
+
+- OTEL_EXPORTER: otlp (OTEL_EXPORTER_OTLP_ENDPOINT) | file (OTEL_TRACES_FILE) | console
+- OTEL_SAMPLE_RATIO: fração de traces amostrados (respeita a decisão do pai)
+- OTEL_SERVICE_NAME: nome do serviço nos traces
+"""
+import os
+import sys
+import logging
+import functools
+import inspect
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_enabled = False
+_tracer = None
+_SpanKind = None
+_NOOP = nullcontext()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def init_tracing() -> bool:
+    """Configura o provider a partir das variáveis OTEL_* (chamado no startup)"""
+    global _enabled, _tracer, _SpanKind
+    if _enabled or os.getenv('OTEL_ENABLED', 'false').lower() != 'true':
+        return _enabled
+
+    try:
+        from opentelemetry import trace
+        from opentelemetry.trace import SpanKind
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    except ImportError:
+        logger.warning("⚠️ OTEL_ENABLED=true mas opentelemetry-sdk não está instalado - tracing desativado")
+        return False
+
+    exporter_name = os.getenv('OTEL_EXPORTER', 'otlp').lower()
+    if exporter_name == 'otlp':
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.warning("⚠️ opentelemetry-exporter-otlp-proto-http não instalado - tracing desativado")
+            return False
+        exporter = OTLPSpanExporter()
+    elif exporter_name == 'file':
+        traces_file = open(os.getenv('OTEL_TRACES_FILE', 'traces.jsonl'), 'a', buffering=1)
+        exporter = ConsoleSpanExporter(
+            out=traces_file,
+            formatter=lambda span: span.to_json(indent=None) + "\n"
+        )
+    else:
+        exporter = ConsoleSpanExporter(out=sys.stdout)
+
+    sample_ratio = float(os.getenv('OTEL_SAMPLE_RATIO', '1.0'))
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": os.getenv('OTEL_SERVICE_NAME', 'lead-dispatcher-api')}),
+        sampler=ParentBased(TraceIdRatioBased(sample_ratio))
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+    _tracer = trace.get_tracer("lead-dispatcher")
+    _SpanKind = SpanKind
+    _enabled = True
+    logger.info(f"🔭 Tracing ativado (exporter={exporter_name}, amostragem={sample_ratio})")
+    return True
+
+
+def shutdown_tracing() -> None:
+    """Exporta spans pendentes"""
+    if not _enabled:
+        return
+    from opentelemetry import trace
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "shutdown"):
+        provider.shutdown()
+
+
+def span(name: str, attributes: Optional[Dict[str, Any]] = None, kind: str = "internal", context=None):
+    """Context manager de span; no-op quando o tracing está desativado"""
+    if not _enabled:
+        return _NOOP
+    return _tracer.start_as_current_span(
+        name,
+        context=context,
+        kind=getattr(_SpanKind, kind.upper()),
+        attributes={k: v for k, v in (attributes or {}).items() if v is not None}
+    )
+
+
+def inject_headers(headers) -> None:
+    """Propaga o contexto atual (traceparent) em requisições de saída"""
+    if _enabled:
+        from opentelemetry.propagate import inject
+        inject(headers)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator para funções async: cria um span por chamada quando ativado"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not _enabled:
+                return await func(*args, **kwargs)
+            with span(span_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_public_methods(cls, prefix: Optional[str] = None):
+    """Aplica @traced a todos os métodos async públicos da classe"""
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith('_') or not inspect.iscoroutinefunction(value):
+            continue
+        setattr(cls, attr, traced(f"{prefix or cls.__name__}.{attr}")(value))
+    return cls
+
+
+class TracingMiddleware:
+    """Middleware ASGI: um span SERVER por requisição, nomeado pela rota"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not _enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        from opentelemetry.propagate import extract
+        from opentelemetry.trace import Status, StatusCode
+
+        carrier = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope.get("headers", [])}
+        method = scope.get("method", "GET")
+
+        with span(f"{method} {scope.get('path', '')}", {"http.method": method, "http.target": scope.get("path")},
+                  kind="server", context=extract(carrier)) as current:
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    current.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        current.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                if getattr(route, "path", None):
+                    current.update_name(f"{method} {route.path}")
+                    current.set_attribute("http.route", route.path)
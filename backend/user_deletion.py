@@ -0,0 +1,222 @@
+"""
+User Deletion
+Remoção completa de usuários com deletes em conjunto (RPC delete_user_cascade)
+
+- Contas pequenas: uma única transação remove campanhas (logs + contatos), quotas,
+  roles, leads, histórico, notificações e profile; depois o usuário sai do Auth
+- Contas grandes: job em background (admin_jobs) que remove as campanhas em lotes
+  (cada lote uma transação, delete_campaigns_cascade) com progresso consultável,
+  e termina com o mesmo delete_user_cascade. Repetir o job é seguro: cada etapa
+  só apaga o que ainda existe
+"""
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from supabase_service import get_supabase_service
+from audit_service import get_audit_service
+
+logger = logging.getLogger(__name__)
+
+JOB_KIND = 'user_delete'
+
+
+def _add_counts(total: Dict[str, int], counts: Optional[Dict[str, int]]) -> None:
+    for table, count in (counts or {}).items():
+        total[table] = total.get(table, 0) + (count or 0)
+
+
+class UserDeletionService:
+    """Executa a remoção em cascata, inline ou como job em background"""
+
+    def __init__(self):
+        # Linhas estimadas (contatos + logs) acima das quais a remoção vai para background
+        self.background_threshold = int(os.getenv('USER_DELETE_BACKGROUND_ROWS', '20000'))
+        # Campanhas por transação no modo em background
+        self.campaign_batch = int(os.getenv('USER_DELETE_CAMPAIGN_BATCH', '10'))
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def estimate(self, user_id: str) -> Dict[str, Any]:
+        """Campanhas do usuário e linhas estimadas (contatos + um log por contato)"""
+        campaigns = await get_supabase_service().get_user_campaign_sizes(user_id)
+        contacts = sum(c.get('total_contacts') or 0 for c in campaigns)
+        return {'campaigns': [c['id'] for c in campaigns], 'estimated_rows': contacts * 2}
+
+    async def delete_user(
+        self,
+        user_id: str,
+        user_email: Optional[str],
+        requested_by: Dict[str, Any],
+        context: Optional[Dict[str, Any]] = None,
+        on_deleted: Optional[Callable[[], None]] = None
+    ) -> Dict[str, int]:
+        """Remoção inline (uma transação + Auth); devolve as linhas removidas por tabela"""
+        counts = await get_supabase_service().delete_user_cascade(user_id)
+        await self._finish(user_id, user_email, counts, requested_by, context, on_deleted)
+        return counts
+
+    def start(
+        self,
+        user_id: str,
+        user_email: Optional[str],
+        requested_by: Dict[str, Any],
+        campaign_ids: List[str],
+        context: Optional[Dict[str, Any]] = None,
+        on_deleted: Optional[Callable[[], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Inicia a remoção em background.
+
+        Raises:
+            RuntimeError: Já existe uma remoção em andamento para o usuário
+        """
+        for job in self.jobs.values():
+            if job['params']['user_id'] == user_id and job['status'] == 'running':
+                raise RuntimeError(f"Remoção do usuário já em andamento (job {job['id']})")
+
+        job = {
+            'id': str(uuid.uuid4()),
+            'kind': JOB_KIND,
+            'status': 'running',
+            'params': {'user_id': user_id, 'user_email': user_email},
+            'progress': {
+                'stage': 'campaigns',
+                'campaigns_total': len(campaign_ids),
+                'campaigns_deleted': 0
+            },
+            'checkpoint': {},
+            'result': {'deleted': {}},
+            'error': None,
+            'requested_by': requested_by.get('user_id'),
+            'requested_by_email': requested_by.get('email'),
+            'created_at': datetime.utcnow().isoformat(),
+            'finished_at': None
+        }
+        self._prune()
+        self.jobs[job['id']] = job
+        self._tasks[job['id']] = asyncio.create_task(
+            self._run(job, campaign_ids, requested_by, context, on_deleted)
+        )
+        return job
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if job_id in self.jobs:
+            return self.jobs[job_id]
+        return await get_supabase_service().get_admin_job(job_id)
+
+    async def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        stored = await get_supabase_service().list_admin_jobs(JOB_KIND, limit)
+        local = sorted(self.jobs.values(), key=lambda job: job['created_at'], reverse=True)
+        local_ids = {job['id'] for job in local}
+        return (local + [job for job in stored if job['id'] not in local_ids])[:limit]
+
+    async def stop(self) -> None:
+        """Shutdown: interrompe os jobs em andamento (repetir a remoção continua de onde parou)"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # --- Execução ---
+
+    async def _run(
+        self,
+        job: Dict[str, Any],
+        campaign_ids: List[str],
+        requested_by: Dict[str, Any],
+        context: Optional[Dict[str, Any]],
+        on_deleted: Optional[Callable[[], None]]
+    ) -> None:
+        db = get_supabase_service()
+        user_id = job['params']['user_id']
+        deleted = job['result']['deleted']
+        logger.info(f"🗑️ Remoção em background do usuário {user_id} ({len(campaign_ids)} campanhas) - job {job['id']}")
+        await db.save_admin_job(job)
+
+        try:
+            for start in range(0, len(campaign_ids), self.campaign_batch):
+                batch = campaign_ids[start:start + self.campaign_batch]
+                _add_counts(deleted, await db.delete_campaigns_cascade(batch))
+                job['progress']['campaigns_deleted'] += len(batch)
+                await db.save_admin_job(job)
+
+            job['progress']['stage'] = 'user'
+            counts = await db.delete_user_cascade(user_id)
+            _add_counts(deleted, counts)
+            await self._finish(user_id, job['params']['user_email'], deleted, requested_by, context, on_deleted)
+            job['progress']['stage'] = 'done'
+            job['status'] = 'completed'
+        except asyncio.CancelledError:
+            job['status'] = 'interrupted'
+            raise
+        except Exception as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            logger.error(f"❌ Remoção em background do usuário {user_id} falhou: {e}")
+        finally:
+            job['finished_at'] = datetime.utcnow().isoformat()
+            self._tasks.pop(job['id'], None)
+            await db.save_admin_job(job)
+
+    async def _finish(
+        self,
+        user_id: str,
+        user_email: Optional[str],
+        counts: Dict[str, int],
+        requested_by: Dict[str, Any],
+        context: Optional[Dict[str, Any]],
+        on_deleted: Optional[Callable[[], None]]
+    ) -> None:
+        """Etapas fora do banco: caches, Auth e auditoria"""
+        db = get_supabase_service()
+        db.invalidate_user_quota(user_id, discard_pending=True)
+        if on_deleted is not None:
+            on_deleted()
+
+        try:
+            await asyncio.to_thread(db.client.auth.admin.delete_user, user_id)
+            logger.info(f"✅ Usuário deletado do Supabase Auth: {user_id}")
+        except Exception as e:
+            error_msg = str(e)
+            # Se o usuário não foi encontrado ou já foi deletado, considerar sucesso
+            if "not found" in error_msg.lower() or "user not allowed" in error_msg.lower():
+                logger.warning(f"⚠️ Usuário já removido do auth ou sem permissão: {user_id}")
+            else:
+                logger.error(f"❌ ERRO ao deletar do auth.users: {e}")
+                # Não levantar exceção, pois já deletamos do banco
+
+        context = context or {}
+        await get_audit_service().log_action(
+            user_id=requested_by['user_id'],
+            user_email=requested_by['email'],
+            action='user_deleted',
+            target_type='user',
+            target_id=user_id,
+            target_email=user_email,
+            details={'company_id': context.get('company_id'), 'deleted': counts},
+            ip_address=context.get('ip_address'),
+            user_agent=context.get('user_agent')
+        )
+        logger.info(f"✅ DELEÇÃO COMPLETA: Usuário {user_email} (ID: {user_id}) totalmente removido")
+
+    def _prune(self, keep: int = 50) -> None:
+        """Mantém em memória só os jobs mais recentes (os demais continuam em admin_jobs)"""
+        finished = [job for job in self.jobs.values() if job['status'] != 'running']
+        finished.sort(key=lambda job: job['created_at'])
+        for job in finished[:max(0, len(self.jobs) - keep)]:
+            del self.jobs[job['id']]
+
+
+# Singleton global
+_user_deletion_service: Optional[UserDeletionService] = None
+
+
+def get_user_deletion_service() -> UserDeletionService:
+    """Retorna instância singleton do UserDeletionService"""
+    global _user_deletion_service
+    if _user_deletion_service is None:
+        _user_deletion_service = UserDeletionService()
+    return _user_deletion_service
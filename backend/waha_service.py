@@ -3,7 +3,9 @@ import logging
 import base64
 from typing import Optional, Dict, Any
 import re
+from functools import lru_cache
 from security_utils import validate_media_url, sanitize_template_value
+from metrics import InstrumentedTransport
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +36,10 @@ class WahaService:
             "X-Api-Key": api_key
         }
     
+    def _client(self, timeout: float) -> httpx.AsyncClient:
+        """Cliente HTTP com latência/status medidos por sessão"""
+        return httpx.AsyncClient(timeout=timeout, transport=InstrumentedTransport(self.session_name))
+    
     # --- MÉTODOS DE SESSÃO ---
 
     async def start_session(self) -> Dict[str, Any]:
@@ -43,7 +49,7 @@ class WahaService:
             payload = {"name": self.session_name, "config": {"webhooks": []}}
             logger.info(f"🔌 Payload para criar sessão: {payload}")
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            async with self._client(30.0) as client:
                 response = await client.post(
                     f"{self.waha_url}/api/sessions",
                     headers=self.headers,
@@ -66,7 +72,7 @@ class WahaService:
 
     async def stop_session(self) -> Dict[str, Any]:
         try:
-            async with httpx.AsyncClient(timeout=20.0) as client:
+            async with self._client(20.0) as client:
                 response = await client.post(
                     f"{self.waha_url}/api/sessions/{self.session_name}/stop",
                     headers=self.headers
@@ -78,7 +84,7 @@ class WahaService:
 
     async def logout_session(self) -> Dict[str, Any]:
         try:
-            async with httpx.AsyncClient(timeout=20.0) as client:
+            async with self._client(20.0) as client:
                 response = await client.post(
                     f"{self.waha_url}/api/sessions/{self.session_name}/logout",
                     headers=self.headers
@@ -90,7 +96,7 @@ class WahaService:
 
     async def get_qr_code(self) -> Dict[str, Any]:
         try:
-            async with httpx.AsyncClient(timeout=20.0) as client:
+            async with self._client(20.0) as client:
                 response = await client.get(
                     f"{self.waha_url}/api/screenshot?session={self.session_name}",
                     headers=self.headers
@@ -114,7 +120,7 @@ class WahaService:
 
     async def check_connection(self) -> Dict[str, Any]:
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
+            async with self._client(10.0) as client:
                 response = await client.get(
                     f"{self.waha_url}/api/sessions/{self.session_name}",
                     headers=self.headers
@@ -146,7 +152,7 @@ class WahaService:
             if len(formatted_phone) < 10 or len(formatted_phone) > 13:
                 return False
 
-            async with httpx.AsyncClient(timeout=8.0) as client:
+            async with self._client(8.0) as client:
                 response = await client.get(
                     f"{self.waha_url}/api/contacts/check-exists",
                     headers=self.headers,
@@ -174,7 +180,7 @@ class WahaService:
     async def send_text_message(self, phone: str, message: str) -> Dict[str, Any]:
         chat_id = f"{normalize_phone(phone)}@c.us"
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            async with self._client(30.0) as client:
                 response = await client.post(
                     f"{self.waha_url}/api/sendText",
                     headers=self.headers,
@@ -219,7 +225,7 @@ class WahaService:
             
             logger.info(f"📸 Payload: {payload}")
             
-            async with httpx.AsyncClient(timeout=60.0) as client:
+            async with self._client(60.0) as client:
                 response = await client.post(
                     f"{self.waha_url}/api/sendImage",
                     headers=self.headers,
@@ -254,7 +260,7 @@ class WahaService:
             else:
                 return {"success": False, "error": "No document provided"}
             
-            async with httpx.AsyncClient(timeout=60.0) as client:
+            async with self._client(60.0) as client:
                 response = await client.post(
                     f"{self.waha_url}/api/sendFile",
                     headers=self.headers,
@@ -266,15 +272,81 @@ class WahaService:
         except Exception as e:
             return {"success": False, "error": str(e)}
 
+_PLACEHOLDER_RE = re.compile(r'\{([^{}]*)\}')
+
+
+class CompiledTemplate:
+    """
+    Template de mensagem pré-processado em segmentos literais e placeholders.
+
+    O texto é analisado uma única vez por campanha; cada render resolve os
+    placeholders contra os dados do contato e faz um único join.
+    A resolução segue a mesma regra de replace_variables: primeiro a chave
+    exata, depois a primeira chave (na ordem de `data`) cuja variante
+    lower/UPPER/Capitalize coincide com o placeholder.
+
+    Diferença intencional em relação ao replace_variables antigo (str.replace
+    em duas passadas): valores substituídos não são reprocessados em busca de
+    novos placeholders, então um contato com nome "{email}" recebe o texto
+    "{email}" e não o valor de outro campo.
+    """
+
+    _MAX_PLANS = 32
+
+    def __init__(self, template: str):
+        self.template = template or ""
+        parts = _PLACEHOLDER_RE.split(self.template)
+        # Índices pares são literais, ímpares são nomes de placeholder
+        self._parts = parts
+        self._names = parts[1::2]
+        # Cache: tupla de chaves de `data` -> chave que resolve cada placeholder
+        self._plans: Dict[tuple, tuple] = {}
+
+    def _resolve_plan(self, keys: tuple) -> tuple:
+        plan = self._plans.get(keys)
+        if plan is not None:
+            return plan
+
+        exact = set(keys)
+        variants: Dict[str, Any] = {}
+        for key in keys:
+            for variant in (key.lower(), key.upper(), key.capitalize()):
+                variants.setdefault(variant, key)
+
+        plan = tuple(
+            name if name in exact else variants.get(name)
+            for name in self._names
+        )
+        if len(self._plans) >= self._MAX_PLANS:
+            self._plans.clear()
+        self._plans[keys] = plan
+        return plan
+
+    def render(self, data: Dict[str, Any]) -> str:
+        if not self._names:
+            return self.template
+
+        plan = self._resolve_plan(tuple(data))
+        parts = self._parts[:]
+        safe_values: Dict[Any, str] = {}
+        for i, key in enumerate(plan):
+            if key is None:
+                # Placeholder desconhecido permanece intacto
+                parts[2 * i + 1] = "{" + self._names[i] + "}"
+                continue
+            safe_value = safe_values.get(key)
+            if safe_value is None:
+                safe_value = sanitize_template_value(data[key])
+                safe_values[key] = safe_value
+            parts[2 * i + 1] = safe_value
+        return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def compile_template(template: str) -> CompiledTemplate:
+    """Compila (e memoriza) um template de mensagem"""
+    return CompiledTemplate(template)
+
+
 def replace_variables(template: str, data: Dict[str, Any]) -> str:
-    result = template
-    for key, value in data.items():
-        safe_value = sanitize_template_value(value)
-        placeholder = "{" + key + "}"
-        result = result.replace(placeholder, safe_value)
-    for key, value in data.items():
-        safe_value = sanitize_template_value(value)
-        for variant in [key.lower(), key.upper(), key.capitalize()]:
-            placeholder = "{" + variant + "}"
-            result = result.replace(placeholder, safe_value)
-    return result
\ No newline at end of file
+    return compile_template(template).render(data)
@@ -0,0 +1,142 @@
+"""
+WAHA Session Cache
+Sessão do WhatsApp e servidor WAHA (URL + chave) de cada empresa
+
+- LRU limitado com TTL (WAHA_SESSION_CACHE_SIZE / WAHA_SESSION_CACHE_TTL)
+- Single-flight: misses concorrentes da mesma empresa fazem uma única busca
+- Invalidação explícita por empresa (invalidate); company_settings e waha_configs
+  são gravados direto pelo frontend, então as mudanças chegam pelo Supabase Realtime
+"""
+import os
+import re
+import logging
+from typing import Any, Dict, NamedTuple, Optional
+
+from cache_utils import TTLCache, SingleFlight
+from metrics import record_cache
+from supabase_service import get_supabase_service
+from realtime_listener import get_realtime_listener
+
+logger = logging.getLogger(__name__)
+
+
+class WahaTarget(NamedTuple):
+    """Onde e com qual sessão falar com o WAHA"""
+    waha_url: Optional[str]
+    waha_key: Optional[str]
+    session_name: str
+
+
+def build_session_name(company_id: str, company_name: Optional[str]) -> str:
+    """Formato: nome_empresa_id (ex: "acme_corp_efdaca5d")"""
+    short_id = company_id.split('-')[0] if company_id else 'unknown'
+    if not company_name:
+        return f"company_{short_id}"
+    safe_name = re.sub(r'[^a-zA-Z0-9]', '_', company_name.lower())
+    safe_name = re.sub(r'_+', '_', safe_name).strip('_')[:30]
+    return f"{safe_name}_{short_id}"
+
+
+class WahaSessionCache:
+    """company_id -> WahaTarget"""
+
+    def __init__(self):
+        self._cache = TTLCache(
+            maxsize=int(os.getenv('WAHA_SESSION_CACHE_SIZE', '5000')),
+            ttl=float(os.getenv('WAHA_SESSION_CACHE_TTL', '300')),
+            name="waha_sessions"
+        )
+        self._loading = SingleFlight()
+        self.loads = 0
+
+    async def resolve(self, company_id: str, company_name: Optional[str] = None) -> WahaTarget:
+        target = self._cache.get(company_id)
+        record_cache("waha_sessions", target is not None)
+        if target is not None:
+            return target
+        return await self._loading.run(company_id, lambda: self._load(company_id, company_name))
+
+    async def _load(self, company_id: str, company_name: Optional[str]) -> WahaTarget:
+        logger.info(f"Buscando sessão para company_id: {company_id} (cache miss)")
+        self.loads += 1
+        db = get_supabase_service()
+        config: Dict[str, Any] = {}
+        try:
+            config = await db.get_waha_config(company_id) or {}
+
+            session_name = config.get("session_name")
+            if session_name:
+                logger.info(f"Usando sessão do banco: {session_name}")
+            else:
+                if not company_name:
+                    try:
+                        company_result = db.client.table('companies')\
+                            .select('name')\
+                            .eq('id', company_id)\
+                            .limit(1)\
+                            .execute()
+                        if company_result.data:
+                            company_name = company_result.data[0].get('name')
+                    except Exception as e:
+                        logger.warning(f"Não encontrou nome da empresa: {e}")
+                session_name = build_session_name(company_id, company_name)
+                if not company_name:
+                    logger.warning(f"Usando fallback: {session_name}")
+        except Exception as e:
+            logger.warning(f"Usando sessão padrão devido a erro: {e}")
+            session_name = build_session_name(company_id, None)
+
+        # Webhooks do WAHA chegam com este nome de sessão (inclusive o gerado acima)
+        from agent_service import get_agent_service
+        get_agent_service().sessions.remember(session_name, company_id)
+
+        # URL e chave sempre do mesmo lugar: a master key do servidor nunca vai
+        # para uma URL gravada pela empresa
+        if os.getenv('WAHA_DEFAULT_URL'):
+            waha_url, waha_key = os.getenv('WAHA_DEFAULT_URL'), os.getenv('WAHA_MASTER_KEY')
+        else:
+            waha_url, waha_key = config.get('waha_api_url'), config.get('waha_api_key')
+
+        target = WahaTarget(waha_url=waha_url, waha_key=waha_key, session_name=session_name)
+        self._cache.set(company_id, target)
+        return target
+
+    def invalidate(self, company_id: Optional[str] = None) -> None:
+        """Descarta a entrada da empresa (ou todas, sem company_id)"""
+        if company_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(company_id)
+
+    def start(self) -> None:
+        """Registra a invalidação por mudanças em company_settings / waha_configs"""
+        listener = get_realtime_listener()
+        listener.on_change('company_settings', ['*'], self._on_change)
+        listener.on_change('waha_configs', ['*'], self._on_change)
+        # Mudanças perdidas enquanto desconectado
+        listener.on_connect(self._on_reconnect)
+
+    def _on_change(self, event_type: str, record: Dict[str, Any], old_record: Dict[str, Any]) -> None:
+        company_id = record.get('company_id') or old_record.get('company_id')
+        self.invalidate(company_id)
+        # O índice sessão -> empresa do agente também depende dessas tabelas
+        from agent_service import get_agent_service
+        get_agent_service().sessions.invalidate()
+
+    async def _on_reconnect(self) -> None:
+        self.invalidate()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._cache.stats(), "loads": self.loads, "loading": len(self._loading)}
+
+
+# Singleton global
+_waha_session_cache: Optional[WahaSessionCache] = None
+
+
+def get_waha_session_cache() -> WahaSessionCache:
+    """Retorna instância singleton do WahaSessionCache"""
+    global _waha_session_cache
+    if _waha_session_cache is None:
+        _waha_session_cache = WahaSessionCache()
+    return _waha_session_cache
@@ -0,0 +1,82 @@
+"""
+WAHA Webhook Handler
+Recebe eventos de mensagens do WAHA e repassa para o agente de IA
+
+O endpoint só valida, filtra e enfileira (resposta imediata); o encaminhamento
+para o n8n acontece nos workers do AgentService.
+"""
+from fastapi import APIRouter, HTTPException, Request, Header
+from typing import Optional
+import os
+import json
+import hmac
+import asyncio
+import hashlib
+import logging
+
+from agent_service import get_agent_service
+
+logger = logging.getLogger(__name__)
+
+# Usar prefixo /api para garantir roteamento correto no Kubernetes
+waha_webhook_router = APIRouter(prefix="/api")
+
+# Chave HMAC configurada no webhook da sessão WAHA (obrigatória com o agente ativo)
+WAHA_WEBHOOK_HMAC_KEY = os.environ.get('WAHA_WEBHOOK_HMAC_KEY', '')
+
+
+def verify_waha_signature(payload: bytes, signature: Optional[str]) -> bool:
+    """
+    Verifica o HMAC do WAHA (X-Webhook-Hmac, sha512 em hex). Sem chave configurada
+    recusa: cada mensagem aceita dispara execuções do agente cobradas da empresa.
+    """
+    if not WAHA_WEBHOOK_HMAC_KEY:
+        logger.error("WAHA_WEBHOOK_HMAC_KEY não configurado - rejeitando webhook")
+        return False
+    if not signature:
+        return False
+    expected_signature = hmac.new(
+        WAHA_WEBHOOK_HMAC_KEY.encode(),
+        payload,
+        hashlib.sha512
+    ).hexdigest()
+    return hmac.compare_digest(signature, expected_signature)
+
+
+@waha_webhook_router.post("/webhook/waha")
+async def waha_webhook(
+    request: Request,
+    x_webhook_hmac: Optional[str] = Header(None)
+):
+    """
+    Endpoint para receber eventos do WAHA (event = "message")
+
+    Mensagens de contatos com o agente ativo são encaminhadas ao n8n em background.
+    """
+    body = await request.body()
+
+    agent = get_agent_service()
+    if not agent.is_running:
+        # Agente desativado (sem N8N_WEBHOOK_URL): nada é processado
+        return {"status": "disabled"}
+
+    if not verify_waha_signature(body, x_webhook_hmac):
+        logger.warning("⚠️ Assinatura inválida do webhook WAHA")
+        raise HTTPException(status_code=401, detail="Invalid signature")
+
+    try:
+        payload = json.loads(body)
+        if not isinstance(payload, dict):
+            raise ValueError("payload deve ser um objeto JSON")
+    except ValueError as e:
+        logger.warning(f"⚠️ Payload inválido do webhook WAHA: {e}")
+        raise HTTPException(status_code=400, detail="Invalid payload")
+
+    try:
+        status = agent.submit(payload)
+    except asyncio.QueueFull:
+        # Sobrecarga: o WAHA re-tenta webhooks com erro
+        logger.warning("⚠️ Fila do agente de IA cheia - webhook WAHA recusado")
+        raise HTTPException(status_code=503, detail="Agent queue full")
+
+    return {"status": status}
@@ -0,0 +1,242 @@
+"""
+Webhook Queue
+Fila durável de eventos de webhook (tabela webhook_events)
+
+- enqueue() faz um único insert idempotente por (source, event_key): reenvios do
+  provedor são reconhecidos como duplicados e não são processados de novo
+- Um worker por fonte busca os eventos pendentes em ordem de chegada, marca como
+  'processing' (claim condicional, seguro com várias réplicas) e chama o handler
+- Falhas são re-tentadas com backoff exponencial; depois de WEBHOOK_MAX_ATTEMPTS
+  o evento fica 'failed' para análise
+- O handler pode gravar progresso (state) entre tentativas para retomar de onde parou
+- Enquanto o handler roda, updated_at é renovado (lease); eventos 'processing' sem
+  renovação há mais de WEBHOOK_PROCESSING_LEASE (réplica que caiu) voltam para 'pending'
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# handler(event, save_state) -> {'status': 'done' | 'ignored', ...resultado}
+WebhookHandler = Callable[
+    [Dict[str, Any], Callable[[Dict[str, Any]], Awaitable[None]]],
+    Awaitable[Dict[str, Any]]
+]
+
+
+class WebhookEventQueue:
+    """Fila de eventos de uma fonte de webhook (kiwify, ...)"""
+
+    def __init__(self, source: str, handler: WebhookHandler):
+        self.source = source
+        self.handler = handler
+        self.max_attempts = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '6'))
+        self.retry_backoff = float(os.getenv('WEBHOOK_RETRY_BACKOFF', '10'))
+        self.poll_interval = float(os.getenv('WEBHOOK_POLL_INTERVAL', '15'))
+        self.batch_size = int(os.getenv('WEBHOOK_BATCH_SIZE', '20'))
+        self.processing_lease = float(os.getenv('WEBHOOK_PROCESSING_LEASE', '300'))
+
+        self._worker: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_recover = 0.0
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self.duplicates = 0
+
+    @property
+    def is_running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+        logger.info(f"📥 Fila de webhooks '{self.source}' iniciada")
+
+    async def stop(self) -> None:
+        """Para o worker; o evento em andamento volta para 'pending' quando o lease vence"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def _db(self):
+        from supabase_service import get_supabase_service
+        return get_supabase_service()
+
+    async def enqueue(self, event_key: str, event_type: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Grava o evento para processamento. Devolve a linha criada, ou None se o
+        evento já tinha sido recebido. Erros de banco sobem (o provedor deve reenviar).
+        """
+        now = datetime.utcnow().isoformat()
+        result = self._db().client.table('webhook_events').upsert({
+            'source': self.source,
+            'event_key': event_key,
+            'event_type': event_type,
+            'payload': payload,
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': now,
+            'created_at': now,
+            'updated_at': now
+        }, on_conflict='source,event_key', ignore_duplicates=True).execute()
+
+        if not result.data:
+            self.duplicates += 1
+            return None
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return result.data[0]
+
+    # ========== Worker ==========
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if time.monotonic() - self._last_recover >= self.processing_lease:
+                await self._recover()
+            try:
+                claimed = await self._process_due()
+            except Exception as e:
+                logger.error(f"❌ Erro no worker de webhooks '{self.source}': {e}", exc_info=True)
+                claimed = 0
+            if claimed >= self.batch_size:
+                continue
+            # asyncio.timeout, não wait_for: no 3.11 wait_for engole um cancel()
+            # que chega junto com o set() e o stop() ficaria preso
+            try:
+                async with asyncio.timeout(self.poll_interval):
+                    await self._wakeup.wait()
+            except asyncio.TimeoutError:
+                pass
+
+    async def _recover(self) -> None:
+        """Eventos 'processing' com lease vencido (réplica que caiu) voltam para 'pending'"""
+        self._last_recover = time.monotonic()
+        now = datetime.utcnow()
+        try:
+            self._db().client.table('webhook_events')\
+                .update({'status': 'pending', 'updated_at': now.isoformat()})\
+                .eq('source', self.source)\
+                .eq('status', 'processing')\
+                .lt('updated_at', (now - timedelta(seconds=self.processing_lease)).isoformat())\
+                .execute()
+        except Exception as e:
+            logger.warning(f"Não foi possível recuperar webhook_events: {e}")
+
+    async def _claim(self) -> List[Dict[str, Any]]:
+        """Eventos vencidos, marcados como 'processing' só se ainda estiverem pendentes"""
+        db = self._db()
+        now = datetime.utcnow().isoformat()
+        due = db.client.table('webhook_events')\
+            .select('id')\
+            .eq('source', self.source)\
+            .eq('status', 'pending')\
+            .lte('next_attempt_at', now)\
+            .order('created_at')\
+            .limit(self.batch_size)\
+            .execute()
+        ids = [row['id'] for row in (due.data or [])]
+        if not ids:
+            return []
+        claimed = db.client.table('webhook_events')\
+            .update({'status': 'processing', 'updated_at': now})\
+            .in_('id', ids)\
+            .eq('status', 'pending')\
+            .execute()
+        return sorted(claimed.data or [], key=lambda row: row['created_at'])
+
+    async def _process_due(self) -> int:
+        events = await self._claim()
+        for event in events:
+            await self._handle(event)
+        return len(events)
+
+    async def _handle(self, event: Dict[str, Any]) -> None:
+        table = self._db().client.table('webhook_events')
+        event['state'] = event.get('state') or {}
+
+        async def save_state(state: Dict[str, Any]) -> None:
+            event['state'].update(state)
+            table.update({
+                'state': event['state'],
+                'updated_at': datetime.utcnow().isoformat()
+            }).eq('id', event['id']).execute()
+
+        async def renew_lease() -> None:
+            while True:
+                await asyncio.sleep(self.processing_lease / 3)
+                try:
+                    table.update({'updated_at': datetime.utcnow().isoformat()})\
+                        .eq('id', event['id'])\
+                        .eq('status', 'processing')\
+                        .execute()
+                except Exception as e:
+                    logger.warning(f"Não foi possível renovar o lease do webhook {event['event_key']}: {e}")
+
+        attempts = (event.get('attempts') or 0) + 1
+        heartbeat = asyncio.create_task(renew_lease())
+        try:
+            result = await self.handler(event, save_state)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            now = datetime.utcnow()
+            error = str(e)[:500]
+            if attempts >= self.max_attempts:
+                self.failed += 1
+                update = {'status': 'failed', 'processed_at': now.isoformat()}
+                logger.error(
+                    f"❌ Webhook {self.source} {event['event_key']} falhou após {attempts} tentativas: {e}"
+                )
+            else:
+                self.retried += 1
+                delay = self.retry_backoff * (2 ** (attempts - 1))
+                update = {'status': 'pending', 'next_attempt_at': (now + timedelta(seconds=delay)).isoformat()}
+                logger.warning(
+                    f"⚠️ Webhook {self.source} {event['event_key']} falhou (tentativa {attempts}), "
+                    f"nova tentativa em {delay:.0f}s: {e}"
+                )
+            table.update({
+                **update,
+                'attempts': attempts,
+                'last_error': error,
+                'updated_at': now.isoformat()
+            }).eq('id', event['id']).execute()
+            return
+        finally:
+            heartbeat.cancel()
+
+        now = datetime.utcnow()
+        self.processed += 1
+        result = dict(result or {})
+        status = result.pop('status', 'done')
+        event['state'].update(result)
+        table.update({
+            'status': status,
+            'attempts': attempts,
+            'last_error': None,
+            'state': event['state'],
+            'processed_at': now.isoformat(),
+            'updated_at': now.isoformat()
+        }).eq('id', event['id']).execute()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "running": self.is_running,
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "duplicates": self.duplicates
+        }
@@ -0,0 +1,42 @@
+-- Batch quota increment used by the backend quota ledger
+-- The backend accumulates increments in memory and flushes them in one call:
+--   p_items = [{"user_id": "...", "field": "campaigns_used", "amount": 3}, ...]
+
+CREATE OR REPLACE FUNCTION increment_quota_batch(
+  p_items JSONB
+)
+RETURNS INT
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  allowed_fields TEXT[] := ARRAY['campaigns_used', 'messages_used', 'leads_used', 'messages_sent'];
+  item JSONB;
+  updated INT := 0;
+  n INT;
+BEGIN
+  FOR item IN SELECT * FROM jsonb_array_elements(p_items)
+  LOOP
+    -- Validate field name to prevent SQL injection
+    IF NOT ((item->>'field') = ANY(allowed_fields)) THEN
+      RAISE EXCEPTION 'Invalid field name: %', item->>'field';
+    END IF;
+
+    EXECUTE format(
+      'UPDATE user_quotas SET %I = COALESCE(%I, 0) + $1 WHERE user_id = $2',
+      item->>'field', item->>'field'
+    ) USING (item->>'amount')::INT, (item->>'user_id')::UUID;
+
+    -- FOUND não é atualizado por EXECUTE dinâmico
+    GET DIAGNOSTICS n = ROW_COUNT;
+    updated := updated + n;
+  END LOOP;
+
+  RETURN updated;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.increment_quota_batch(JSONB) FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION public.increment_quota_batch(JSONB) FROM anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.increment_quota_batch(JSONB) TO service_role;
@@ -0,0 +1,21 @@
+-- Outbox de emails do backend
+-- Recebe emails quando a fila em memória está cheia ou o servidor é desligado,
+-- e registra envios que falharam após todas as tentativas.
+
+CREATE TABLE IF NOT EXISTS public.email_outbox (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  to_email TEXT NOT NULL,
+  subject TEXT NOT NULL,
+  html_body TEXT NOT NULL,
+  plain_body TEXT,
+  status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'queued', 'failed')),
+  attempts INTEGER NOT NULL DEFAULT 0,
+  last_error TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_status_created ON public.email_outbox(status, created_at);
+
+-- Apenas o backend (service_role) acessa o outbox
+ALTER TABLE public.email_outbox ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,47 @@
+-- Aggregated audit log statistics in a single round trip
+-- Replaces three count='exact' queries (which fetched full rows) and fills
+-- top_actions / top_users with GROUP BY on the server side.
+
+CREATE INDEX IF NOT EXISTS idx_audit_logs_user_email ON public.audit_logs(user_email);
+
+CREATE OR REPLACE FUNCTION public.get_audit_stats(
+  p_today_start TIMESTAMPTZ,
+  p_week_start TIMESTAMPTZ,
+  p_top_n INT DEFAULT 10
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  SELECT jsonb_build_object(
+    'total_logs', (SELECT count(*) FROM public.audit_logs),
+    'logs_today', (SELECT count(*) FROM public.audit_logs WHERE created_at >= p_today_start),
+    'logs_this_week', (SELECT count(*) FROM public.audit_logs WHERE created_at >= p_week_start),
+    'top_actions', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object('action', action, 'count', cnt) ORDER BY cnt DESC, action)
+      FROM (
+        SELECT action, count(*) AS cnt
+        FROM public.audit_logs
+        GROUP BY action
+        ORDER BY cnt DESC, action
+        LIMIT p_top_n
+      ) a
+    ), '[]'::jsonb),
+    'top_users', COALESCE((
+      SELECT jsonb_agg(jsonb_build_object('user_email', user_email, 'count', cnt) ORDER BY cnt DESC, user_email)
+      FROM (
+        SELECT user_email, count(*) AS cnt
+        FROM public.audit_logs
+        GROUP BY user_email
+        ORDER BY cnt DESC, user_email
+        LIMIT p_top_n
+      ) u
+    ), '[]'::jsonb)
+  );
+$$;
+
+REVOKE ALL ON FUNCTION public.get_audit_stats(TIMESTAMPTZ, TIMESTAMPTZ, INT) FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION public.get_audit_stats(TIMESTAMPTZ, TIMESTAMPTZ, INT) FROM anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.get_audit_stats(TIMESTAMPTZ, TIMESTAMPTZ, INT) TO service_role;
@@ -0,0 +1,106 @@
+-- Retention / compaction used by the backend maintenance scheduler
+-- Deletes run in chunks so a single call never holds long locks; the backend
+-- calls the functions repeatedly until they return fewer rows than p_batch_size.
+
+-- ===== 1. Daily aggregates of message_logs =====
+CREATE TABLE IF NOT EXISTS public.message_log_daily_stats (
+    campaign_id UUID NOT NULL REFERENCES public.campaigns(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    status TEXT NOT NULL,
+    message_count INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    PRIMARY KEY (campaign_id, day, status)
+);
+
+ALTER TABLE public.message_log_daily_stats ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view message stats of their company campaigns"
+    ON public.message_log_daily_stats FOR SELECT
+    USING (
+        EXISTS (
+            SELECT 1 FROM public.campaigns
+            WHERE campaigns.id = message_log_daily_stats.campaign_id
+            AND campaigns.company_id = get_user_company_id(auth.uid())
+        )
+    );
+
+COMMENT ON TABLE public.message_log_daily_stats IS 'message_logs antigos compactados em contagens diárias por campanha/status';
+
+-- ===== 2. Roll old message_logs into daily aggregates, then delete them =====
+CREATE OR REPLACE FUNCTION public.compact_message_logs(
+  p_before TIMESTAMPTZ,
+  p_batch_size INT DEFAULT 5000
+)
+RETURNS INT
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  compacted INT;
+BEGIN
+  WITH batch AS (
+    DELETE FROM public.message_logs
+    WHERE id IN (
+      SELECT id FROM public.message_logs
+      WHERE sent_at < p_before
+      ORDER BY sent_at
+      LIMIT p_batch_size
+      FOR UPDATE SKIP LOCKED
+    )
+    RETURNING campaign_id, (sent_at AT TIME ZONE 'UTC')::DATE AS day, status
+  ),
+  rolled AS (
+    INSERT INTO public.message_log_daily_stats (campaign_id, day, status, message_count, updated_at)
+    SELECT campaign_id, day, status, count(*), now()
+    FROM batch
+    GROUP BY campaign_id, day, status
+    ON CONFLICT (campaign_id, day, status) DO UPDATE
+      SET message_count = message_log_daily_stats.message_count + EXCLUDED.message_count,
+          updated_at = now()
+    RETURNING message_count
+  )
+  SELECT count(*) INTO compacted FROM batch;
+
+  RETURN compacted;
+END;
+$$;
+
+-- ===== 3. Generic chunked purge for append-only log tables =====
+CREATE OR REPLACE FUNCTION public.purge_old_rows(
+  p_table TEXT,
+  p_before TIMESTAMPTZ,
+  p_batch_size INT DEFAULT 5000
+)
+RETURNS INT
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  allowed_tables TEXT[] := ARRAY['login_attempts', 'audit_logs', 'webhook_logs'];
+  deleted INT;
+BEGIN
+  -- Validate table name to prevent SQL injection
+  IF NOT (p_table = ANY(allowed_tables)) THEN
+    RAISE EXCEPTION 'Invalid table name: %', p_table;
+  END IF;
+
+  EXECUTE format(
+    'DELETE FROM public.%I WHERE id IN (
+       SELECT id FROM public.%I WHERE created_at < $1 ORDER BY created_at LIMIT $2 FOR UPDATE SKIP LOCKED
+     )',
+    p_table, p_table
+  ) USING p_before, p_batch_size;
+
+  GET DIAGNOSTICS deleted = ROW_COUNT;
+  RETURN deleted;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.compact_message_logs(TIMESTAMPTZ, INT) FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION public.compact_message_logs(TIMESTAMPTZ, INT) FROM anon, authenticated;
+REVOKE ALL ON FUNCTION public.purge_old_rows(TEXT, TIMESTAMPTZ, INT) FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION public.purge_old_rows(TEXT, TIMESTAMPTZ, INT) FROM anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.compact_message_logs(TIMESTAMPTZ, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION public.purge_old_rows(TEXT, TIMESTAMPTZ, INT) TO service_role;
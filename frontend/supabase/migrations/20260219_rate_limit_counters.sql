@@ -0,0 +1,66 @@
+-- Shared fixed-window counters for the API rate limiter (slowapi)
+-- Each backend replica accumulates hits locally and flushes them in one call:
+--   p_items = [{"key": "LIMITER/user:.../50/1/hour", "amount": 3, "expiry": 3600}, ...]
+-- The function returns the current count and window end for every key, so
+-- replicas converge on the same totals.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS public.rate_limit_counters (
+  key TEXT PRIMARY KEY,
+  count INT NOT NULL DEFAULT 0,
+  expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limit_counters_expires ON public.rate_limit_counters(expires_at);
+
+-- Only the backend (service_role) touches this table
+ALTER TABLE public.rate_limit_counters ENABLE ROW LEVEL SECURITY;
+
+CREATE OR REPLACE FUNCTION public.rate_limit_hit_batch(
+  p_items JSONB
+)
+RETURNS TABLE (key TEXT, count INT, expires_at TIMESTAMPTZ)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+#variable_conflict use_column
+BEGIN
+  -- Drop windows that already ended
+  DELETE FROM public.rate_limit_counters c
+  WHERE c.expires_at <= now()
+    AND c.key IN (SELECT i->>'key' FROM jsonb_array_elements(p_items) i);
+
+  RETURN QUERY
+  INSERT INTO public.rate_limit_counters AS c (key, count, expires_at)
+  SELECT i->>'key',
+         (i->>'amount')::INT,
+         now() + make_interval(secs => (i->>'expiry')::INT)
+  FROM jsonb_array_elements(p_items) i
+  ON CONFLICT ON CONSTRAINT rate_limit_counters_pkey DO UPDATE
+    SET count = c.count + EXCLUDED.count
+  RETURNING c.key, c.count, c.expires_at;
+END;
+$$;
+
+-- Periodic cleanup of expired windows (keys that stopped receiving hits)
+CREATE OR REPLACE FUNCTION public.cleanup_rate_limit_counters()
+RETURNS INT
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  deleted INT;
+BEGIN
+  DELETE FROM public.rate_limit_counters WHERE expires_at <= now();
+  GET DIAGNOSTICS deleted = ROW_COUNT;
+  RETURN deleted;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.rate_limit_hit_batch(JSONB) FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION public.rate_limit_hit_batch(JSONB) FROM anon, authenticated;
+REVOKE ALL ON FUNCTION public.cleanup_rate_limit_counters() FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION public.cleanup_rate_limit_counters() FROM anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.rate_limit_hit_batch(JSONB) TO service_role;
+GRANT EXECUTE ON FUNCTION public.cleanup_rate_limit_counters() TO service_role;
@@ -0,0 +1,84 @@
+-- Admin user listing in a single round trip
+-- profiles LEFT JOIN user_quotas (no FK between them, so PostgREST cannot embed),
+-- server-side filters (plan, status, expiry, search), whitelisted sort columns,
+-- keyset pagination on (sort_key, id) and an optional total count.
+
+CREATE INDEX IF NOT EXISTS idx_profiles_created_at_id ON public.profiles(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_user_quotas_plan_type ON public.user_quotas(plan_type);
+CREATE INDEX IF NOT EXISTS idx_user_quotas_plan_expires_at ON public.user_quotas(plan_expires_at);
+
+CREATE OR REPLACE FUNCTION public.admin_list_users(
+  p_limit INT DEFAULT 50,
+  p_sort TEXT DEFAULT 'created_at',
+  p_desc BOOLEAN DEFAULT TRUE,
+  p_plan_type TEXT DEFAULT NULL,
+  p_status TEXT DEFAULT NULL,
+  p_expires_before TIMESTAMPTZ DEFAULT NULL,
+  p_expires_after TIMESTAMPTZ DEFAULT NULL,
+  p_search TEXT DEFAULT NULL,
+  p_cursor_value TEXT DEFAULT NULL,
+  p_cursor_id UUID DEFAULT NULL,
+  p_offset INT DEFAULT 0,
+  p_include_total BOOLEAN DEFAULT FALSE
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_key TEXT;
+  v_type TEXT;
+  v_dir TEXT := CASE WHEN p_desc THEN 'DESC' ELSE 'ASC' END;
+  v_op TEXT := CASE WHEN p_desc THEN '<' ELSE '>' END;
+  v_from TEXT := '
+    FROM public.profiles p
+    LEFT JOIN public.user_quotas q ON q.user_id = p.id
+    WHERE ($1::text IS NULL OR COALESCE(q.plan_type, ''sem_plano'') = $1)
+      AND ($2::text IS NULL OR COALESCE(q.subscription_status, ''inactive'') = $2)
+      AND ($3::timestamptz IS NULL OR q.plan_expires_at < $3)
+      AND ($4::timestamptz IS NULL OR q.plan_expires_at >= $4)
+      AND ($5::text IS NULL OR p.email ILIKE ''%'' || $5 || ''%'' OR p.full_name ILIKE ''%'' || $5 || ''%'')';
+  v_users JSONB;
+  v_total BIGINT;
+BEGIN
+  CASE p_sort
+    WHEN 'created_at' THEN v_key := 'p.created_at'; v_type := 'timestamptz';
+    WHEN 'email' THEN v_key := 'p.email'; v_type := 'text';
+    WHEN 'plan_type' THEN v_key := 'COALESCE(q.plan_type, ''sem_plano'')'; v_type := 'text';
+    WHEN 'status' THEN v_key := 'COALESCE(q.subscription_status, ''inactive'')'; v_type := 'text';
+    WHEN 'expires_at' THEN v_key := 'COALESCE(q.plan_expires_at, ''infinity''::timestamptz)'; v_type := 'timestamptz';
+    ELSE RAISE EXCEPTION 'invalid sort column: %', p_sort USING ERRCODE = '22023';
+  END CASE;
+
+  EXECUTE format(
+    'SELECT COALESCE(jsonb_agg(to_jsonb(u) ORDER BY u.sort_key %1$s, u.id %1$s), ''[]''::jsonb)
+     FROM (
+       SELECT p.id, p.email, p.full_name, p.company_id, p.created_at,
+              q.plan_type, q.plan_name, q.subscription_status, q.plan_expires_at,
+              %2$s AS sort_key
+       %3$s
+         AND ($6::text IS NULL OR (%2$s, p.id) %4$s ($6::%5$s, $7::uuid))
+       ORDER BY %2$s %1$s, p.id %1$s
+       LIMIT $8 OFFSET $9
+     ) u',
+    v_dir, v_key, v_from, v_op, v_type
+  )
+  INTO v_users
+  USING p_plan_type, p_status, p_expires_before, p_expires_after, p_search,
+        p_cursor_value, p_cursor_id, p_limit, p_offset;
+
+  IF p_include_total THEN
+    EXECUTE 'SELECT count(*)' || v_from
+    INTO v_total
+    USING p_plan_type, p_status, p_expires_before, p_expires_after, p_search;
+  END IF;
+
+  RETURN jsonb_build_object('users', v_users, 'total', v_total);
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.admin_list_users(INT, TEXT, BOOLEAN, TEXT, TEXT, TIMESTAMPTZ, TIMESTAMPTZ, TEXT, TEXT, UUID, INT, BOOLEAN) FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION public.admin_list_users(INT, TEXT, BOOLEAN, TEXT, TEXT, TIMESTAMPTZ, TIMESTAMPTZ, TEXT, TEXT, UUID, INT, BOOLEAN) FROM anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.admin_list_users(INT, TEXT, BOOLEAN, TEXT, TEXT, TIMESTAMPTZ, TIMESTAMPTZ, TEXT, TEXT, UUID, INT, BOOLEAN) TO service_role;
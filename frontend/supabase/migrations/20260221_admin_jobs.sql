@@ -0,0 +1,25 @@
+-- Jobs administrativos em background (reconciliação de órfãos, ...)
+-- O backend grava o progresso e um checkpoint a cada etapa, para que o job
+-- possa ser consultado enquanto roda e retomado após cancelamento/restart.
+
+CREATE TABLE IF NOT EXISTS public.admin_jobs (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  kind TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'running'
+    CHECK (status IN ('running', 'completed', 'failed', 'cancelled', 'interrupted')),
+  params JSONB NOT NULL DEFAULT '{}'::jsonb,
+  progress JSONB NOT NULL DEFAULT '{}'::jsonb,
+  checkpoint JSONB NOT NULL DEFAULT '{}'::jsonb,
+  result JSONB NOT NULL DEFAULT '{}'::jsonb,
+  error TEXT,
+  requested_by UUID,
+  requested_by_email TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  finished_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_admin_jobs_kind_created ON public.admin_jobs(kind, created_at DESC);
+
+-- Apenas o backend (service_role) acessa os jobs
+ALTER TABLE public.admin_jobs ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,92 @@
+-- Set-based cascading deletes used by the backend
+-- delete_campaigns_cascade: message_logs -> campaign_contacts -> campaigns for a set of
+--   campaigns in one transaction (logs first, so deleting contacts does not have to
+--   SET NULL message_logs.contact_id row by row)
+-- delete_user_cascade: everything owned by a user (campaigns, quotas, roles, leads,
+--   search history, notifications, profile) in one transaction. auth.users is removed
+--   by the backend through the Auth admin API afterwards.
+
+-- Índices para os filtros usados nos deletes (e na verificação de FK de contact_id)
+CREATE INDEX IF NOT EXISTS idx_campaigns_user_id ON public.campaigns(user_id);
+CREATE INDEX IF NOT EXISTS idx_message_logs_contact_id ON public.message_logs(contact_id);
+CREATE INDEX IF NOT EXISTS idx_leads_user_id ON public.leads(user_id);
+CREATE INDEX IF NOT EXISTS idx_search_history_user_id ON public.search_history(user_id);
+
+CREATE OR REPLACE FUNCTION public.delete_campaigns_cascade(p_campaign_ids UUID[])
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_logs INT := 0;
+  v_contacts INT := 0;
+  v_campaigns INT := 0;
+BEGIN
+  IF p_campaign_ids IS NOT NULL AND cardinality(p_campaign_ids) > 0 THEN
+    DELETE FROM public.message_logs WHERE campaign_id = ANY(p_campaign_ids);
+    GET DIAGNOSTICS v_logs = ROW_COUNT;
+
+    DELETE FROM public.campaign_contacts WHERE campaign_id = ANY(p_campaign_ids);
+    GET DIAGNOSTICS v_contacts = ROW_COUNT;
+
+    DELETE FROM public.campaigns WHERE id = ANY(p_campaign_ids);
+    GET DIAGNOSTICS v_campaigns = ROW_COUNT;
+  END IF;
+
+  RETURN jsonb_build_object(
+    'message_logs', v_logs,
+    'campaign_contacts', v_contacts,
+    'campaigns', v_campaigns
+  );
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.delete_user_cascade(p_user_id UUID)
+RETURNS JSONB
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  v_result JSONB;
+  v_count INT;
+BEGIN
+  v_result := public.delete_campaigns_cascade(
+    ARRAY(SELECT id FROM public.campaigns WHERE user_id = p_user_id)
+  );
+
+  DELETE FROM public.user_quotas WHERE user_id = p_user_id;
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  v_result := v_result || jsonb_build_object('user_quotas', v_count);
+
+  DELETE FROM public.user_roles WHERE user_id = p_user_id;
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  v_result := v_result || jsonb_build_object('user_roles', v_count);
+
+  DELETE FROM public.leads WHERE user_id = p_user_id;
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  v_result := v_result || jsonb_build_object('leads', v_count);
+
+  DELETE FROM public.search_history WHERE user_id = p_user_id;
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  v_result := v_result || jsonb_build_object('search_history', v_count);
+
+  DELETE FROM public.notifications WHERE user_id = p_user_id;
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  v_result := v_result || jsonb_build_object('notifications', v_count);
+
+  DELETE FROM public.profiles WHERE id = p_user_id;
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  v_result := v_result || jsonb_build_object('profiles', v_count);
+
+  RETURN v_result;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.delete_campaigns_cascade(UUID[]) FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION public.delete_campaigns_cascade(UUID[]) FROM anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.delete_campaigns_cascade(UUID[]) TO service_role;
+REVOKE ALL ON FUNCTION public.delete_user_cascade(UUID) FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION public.delete_user_cascade(UUID) FROM anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.delete_user_cascade(UUID) TO service_role;
@@ -0,0 +1,30 @@
+-- Fila durável de webhooks recebidos (Kiwify, ...)
+-- O endpoint só valida a assinatura e grava o evento; um worker do backend processa
+-- com retentativas. (source, event_key) é único: reenvios do mesmo evento pelo
+-- provedor não são processados de novo.
+
+CREATE TABLE IF NOT EXISTS public.webhook_events (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  source TEXT NOT NULL,
+  event_key TEXT NOT NULL,
+  event_type TEXT NOT NULL,
+  payload JSONB NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending'
+    CHECK (status IN ('pending', 'processing', 'done', 'ignored', 'failed')),
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  last_error TEXT,
+  -- Progresso entre tentativas (ex.: usuário já criado) e resultado final
+  state JSONB NOT NULL DEFAULT '{}'::jsonb,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  processed_at TIMESTAMPTZ,
+  UNIQUE (source, event_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_webhook_events_due
+  ON public.webhook_events(next_attempt_at)
+  WHERE status = 'pending';
+
+-- Apenas o backend (service_role) acessa a fila
+ALTER TABLE public.webhook_events ENABLE ROW LEVEL SECURITY;
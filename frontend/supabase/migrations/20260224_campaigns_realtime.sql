@@ -0,0 +1,14 @@
+-- Mudanças de status de campaigns via Supabase Realtime
+-- O backend escuta UPDATE/DELETE para parar na hora workers de campanha que rodam
+-- em outra réplica (pausar / cancelar / excluir), sem consultar o status em loop.
+
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_publication WHERE pubname = 'supabase_realtime')
+     AND NOT EXISTS (
+       SELECT 1 FROM pg_publication_tables
+       WHERE pubname = 'supabase_realtime' AND schemaname = 'public' AND tablename = 'campaigns'
+     ) THEN
+    ALTER PUBLICATION supabase_realtime ADD TABLE public.campaigns;
+  END IF;
+END $$;
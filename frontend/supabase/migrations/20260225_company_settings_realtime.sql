@@ -0,0 +1,21 @@
+-- Mudanças de company_settings / waha_configs via Supabase Realtime
+-- O frontend grava essas tabelas direto; o backend escuta para invalidar o cache
+-- de sessão/servidor WAHA por empresa e o índice sessão -> empresa do agente.
+
+DO $$
+DECLARE
+  tbl TEXT;
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_publication WHERE pubname = 'supabase_realtime') THEN
+    RETURN;
+  END IF;
+  FOREACH tbl IN ARRAY ARRAY['company_settings', 'waha_configs'] LOOP
+    IF to_regclass('public.' || tbl) IS NOT NULL
+       AND NOT EXISTS (
+         SELECT 1 FROM pg_publication_tables
+         WHERE pubname = 'supabase_realtime' AND schemaname = 'public' AND tablename = tbl
+       ) THEN
+      EXECUTE format('ALTER PUBLICATION supabase_realtime ADD TABLE public.%I', tbl);
+    END IF;
+  END LOOP;
+END $$;
@@ -0,0 +1,14 @@
+-- Mudanças de companies via Supabase Realtime
+-- O backend mantém um cache do contexto da empresa (nome, timezone, configurações,
+-- sessão WAHA, plano) e descarta a entrada quando a empresa é alterada.
+
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_publication WHERE pubname = 'supabase_realtime')
+     AND NOT EXISTS (
+       SELECT 1 FROM pg_publication_tables
+       WHERE pubname = 'supabase_realtime' AND schemaname = 'public' AND tablename = 'companies'
+     ) THEN
+    ALTER PUBLICATION supabase_realtime ADD TABLE public.companies;
+  END IF;
+END $$;
@@ -0,0 +1,33 @@
+-- Claim atômico do email_outbox (várias réplicas do backend)
+-- Marca como 'queued' e devolve, em um único comando, emails 'pending' e emails
+-- 'queued' cujo lease expirou (réplica que caiu antes de enviar). Linhas já
+-- travadas por outra réplica são puladas (SKIP LOCKED).
+-- Devolve destinatário e corpo (inclui senhas temporárias): só service_role executa.
+
+CREATE OR REPLACE FUNCTION claim_email_outbox(
+  p_limit INT,
+  p_lease_seconds INT
+)
+RETURNS SETOF public.email_outbox
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+  UPDATE public.email_outbox o
+  SET status = 'queued',
+      updated_at = now()
+  WHERE o.id IN (
+    SELECT id
+    FROM public.email_outbox
+    WHERE status = 'pending'
+       OR (status = 'queued' AND updated_at < now() - make_interval(secs => p_lease_seconds))
+    ORDER BY created_at
+    LIMIT p_limit
+    FOR UPDATE SKIP LOCKED
+  )
+  RETURNING o.*;
+$$;
+
+REVOKE ALL ON FUNCTION public.claim_email_outbox(INT, INT) FROM PUBLIC;
+REVOKE EXECUTE ON FUNCTION public.claim_email_outbox(INT, INT) FROM anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.claim_email_outbox(INT, INT) TO service_role;